@@ -0,0 +1,197 @@
+import numpy as np
+import contextlib
+import heapq
+import pathlib
+import sqlite3
+from .queries import *
+
+MAX_TOP_RESULTS = 100
+
+
+class GuildAnalytics:
+    """
+    Word statistics for a guild, held as NumPy arrays indexed by token id so that
+    each query is a handful of vectorized operations.
+
+    Token ids here are indices into self.tokens and are local to this object.
+    """
+
+    def __init__(self):
+        self.tokens = []
+        self.token_counts = np.zeros(0, dtype=np.int64)
+        # (first_token, second_token, frequency), most frequent first
+        self.top_bigrams = []
+        self.member_ids = []
+        # One entry per (member, token) pair with a nonzero count, as for a sparse matrix
+        # in coordinate format.
+        self.entry_member_indices = np.zeros(0, dtype=np.int64)
+        self.entry_token_ids = np.zeros(0, dtype=np.int64)
+        self.entry_weights = np.zeros(0, dtype=np.float64)
+        self.member_norms = np.zeros(0, dtype=np.float64)
+
+    @classmethod
+    def load(
+        cls,
+        db_path: pathlib.Path,
+        guild_id_bytes: bytes,
+        compact_member_data: bool,
+        excluded_member_ids: set[int] = frozenset(),
+    ) -> "GuildAnalytics":
+        """
+        Build analytics for a guild from the database. Members in excluded_member_ids
+        are left out of the per-member statistics.
+        """
+        analytics = cls()
+        token_ids = {}
+
+        def get_token_id(token: str) -> int:
+            try:
+                return token_ids[token]
+            except KeyError:
+                token_ids[token] = len(analytics.tokens)
+                analytics.tokens.append(token)
+                return token_ids[token]
+
+        with contextlib.closing(sqlite3.connect(db_path)) as db:
+            token_counts = []
+            for token, count in db.execute(
+                "SELECT first_token, total_completion_count FROM guild_total_completion_count"
+                " WHERE guild_id = ? AND first_token != '';",
+                (guild_id_bytes,),
+            ):
+                get_token_id(token)
+                token_counts.append(count)
+            analytics.token_counts = np.array(token_counts, dtype=np.int64)
+
+            analytics.top_bigrams = heapq.nlargest(
+                MAX_TOP_RESULTS,
+                db.execute(
+                    GUILD_ANALYTICS_PAIRS_QUERY,
+                    (guild_id_bytes,),
+                ),
+                key=lambda row: row[2],
+            )
+
+            if compact_member_data:
+                member_rows = db.execute(
+                    "SELECT member_contributions.member_id, tokens.token, SUM(member_contributions.frequency)"
+                    " FROM member_contributions"
+                    " JOIN tokens ON tokens.id = member_contributions.first_token_id"
+                    " WHERE member_contributions.guild_id = ? AND tokens.token != ''"
+                    " GROUP BY member_contributions.member_id, member_contributions.first_token_id;",
+                    (guild_id_bytes,),
+                )
+            else:
+                member_rows = db.execute(
+                    "SELECT member_id, first_token, total_completion_count"
+                    " FROM member_total_completion_count"
+                    " WHERE guild_id = ? AND first_token != '';",
+                    (guild_id_bytes,),
+                )
+            member_indices = {}
+            entry_member_indices = []
+            entry_token_ids = []
+            entry_counts = []
+            for member_id_bytes, token, count in member_rows:
+                member_id = int.from_bytes(member_id_bytes, byteorder="big")
+                if member_id in excluded_member_ids:
+                    continue
+                try:
+                    member_index = member_indices[member_id]
+                except KeyError:
+                    member_index = member_indices[member_id] = len(member_indices)
+                    analytics.member_ids.append(member_id)
+                entry_member_indices.append(member_index)
+                entry_token_ids.append(get_token_id(token))
+                entry_counts.append(count)
+
+        analytics.entry_member_indices = np.array(entry_member_indices, dtype=np.int64)
+        analytics.entry_token_ids = np.array(entry_token_ids, dtype=np.int64)
+        # TF-IDF weighting, so that words everyone uses don't dominate similarity
+        entry_counts = np.array(entry_counts, dtype=np.float64)
+        document_frequencies = np.bincount(
+            analytics.entry_token_ids, minlength=len(analytics.tokens)
+        )
+        inverse_document_frequencies = np.log(
+            (1 + len(analytics.member_ids)) / (1 + document_frequencies)
+        )
+        analytics.entry_weights = (1 + np.log(entry_counts)) * (
+            inverse_document_frequencies[analytics.entry_token_ids]
+            if len(analytics.entry_token_ids)
+            else 0
+        )
+        analytics.member_norms = np.sqrt(
+            np.bincount(
+                analytics.entry_member_indices,
+                weights=analytics.entry_weights**2,
+                minlength=len(analytics.member_ids),
+            )
+        )
+        return analytics
+
+    @property
+    def total_token_count(self) -> int:
+        return int(self.token_counts.sum())
+
+    def top_tokens(self, k: int) -> list[tuple[str, int]]:
+        k = min(k, len(self.token_counts))
+        if not k:
+            return []
+        top_token_ids = np.argpartition(self.token_counts, -k)[-k:]
+        top_token_ids = top_token_ids[
+            np.argsort(self.token_counts[top_token_ids])[::-1]
+        ]
+        return [
+            (self.tokens[token_id], int(self.token_counts[token_id]))
+            for token_id in top_token_ids
+        ]
+
+    def entropy_bits(self) -> float:
+        """
+        The Shannon entropy of the guild's word distribution.
+        """
+        total = self.total_token_count
+        if not total:
+            return 0.0
+        probabilities = self.token_counts[self.token_counts > 0] / total
+        return float(-(probabilities * np.log2(probabilities)).sum())
+
+    def similar_members(self, member_id: int, k: int) -> list[tuple[int, float]] | None:
+        """
+        Return up to k (member id, cosine similarity) pairs for the members whose word
+        usage is most like member_id's, or None if there's no data for member_id.
+        """
+        try:
+            member_index = self.member_ids.index(member_id)
+        except ValueError:
+            return None
+        if not self.member_norms[member_index]:
+            return []
+
+        member_entries = self.entry_member_indices == member_index
+        member_vector = np.zeros(len(self.tokens), dtype=np.float64)
+        member_vector[self.entry_token_ids[member_entries]] = self.entry_weights[
+            member_entries
+        ]
+        dot_products = np.bincount(
+            self.entry_member_indices,
+            weights=self.entry_weights * member_vector[self.entry_token_ids],
+            minlength=len(self.member_ids),
+        )
+        with np.errstate(divide="ignore", invalid="ignore"):
+            similarities = dot_products / (
+                self.member_norms * self.member_norms[member_index]
+            )
+        similarities = np.nan_to_num(similarities)
+        similarities[member_index] = -np.inf
+
+        k = min(k, len(self.member_ids) - 1)
+        if k <= 0:
+            return []
+        top_indices = np.argpartition(similarities, -k)[-k:]
+        top_indices = top_indices[np.argsort(similarities[top_indices])[::-1]]
+        return [
+            (self.member_ids[index], float(similarities[index]))
+            for index in top_indices
+            if similarities[index] > 0
+        ]
@@ -0,0 +1,274 @@
+"""
+Approximate pair counts for guilds too large to be worth counting exactly.
+
+An ApproximateModel keeps a count-min sketch of every pair added, plus a Space-Saving
+table of the most frequent completions of each of the most frequent first tokens.
+Generation samples only from the tables. With N pairs added in total, N_t of them
+with first token t, a sketch of the given width and depth and k completions per
+table:
+
+- The sketch never underestimates, and overestimates a pair's count by more than
+  e * N / width with probability at most exp(-depth).
+- Every completion of t that has followed it more than N_t / k times is in t's
+  table, and its tabled count overestimates the true count by at most N_t / k.
+  Counts used for sampling are the smaller of the tabled count and the sketch's
+  estimate, so both bounds apply.
+- Once there are more than max_first_tokens tables, those with the fewest pairs
+  are dropped, forgetting their completions.
+
+Memory use is fixed by the parameters: 8 * width * depth bytes for the sketch and
+roughly 100 bytes per completion slot (max_first_tokens * k of them) for the tables.
+
+Saving, loading, seeding and writing models do blocking I/O, so they should only be
+done off the event loop.
+"""
+
+import contextlib
+import hashlib
+import json
+import os
+import pathlib
+import random
+import sqlite3
+import numpy as np
+
+DEFAULT_SKETCH_WIDTH = 1 << 16
+DEFAULT_SKETCH_DEPTH = 4
+DEFAULT_MAX_FIRST_TOKENS = 20_000
+DEFAULT_COMPLETIONS_PER_TOKEN = 16
+# Tables are pruned back to max_first_tokens when there get to be this many times as
+# many, so that pruning (which sorts every table) doesn't happen on every new token.
+PRUNE_AT_FRACTION = 1.1
+
+
+class ApproximateModel:
+    def __init__(
+        self,
+        sketch_width: int = DEFAULT_SKETCH_WIDTH,
+        sketch_depth: int = DEFAULT_SKETCH_DEPTH,
+        max_first_tokens: int = DEFAULT_MAX_FIRST_TOKENS,
+        completions_per_token: int = DEFAULT_COMPLETIONS_PER_TOKEN,
+    ):
+        self.sketch = np.zeros((sketch_depth, sketch_width), dtype=np.int64)
+        # The same counts as one row, since indexing it with a plain int is much
+        # faster than indexing the sketch with arrays.
+        self.flat_sketch = self.sketch.reshape(-1)
+        self.max_first_tokens = max_first_tokens
+        self.completions_per_token = completions_per_token
+        # first token -> {second token: Space-Saving count}
+        self.tables = {}
+        # first token -> number of pairs added with it since its table was created
+        self.first_token_totals = {}
+        self.total = 0
+
+    def get_flat_sketch_indices(self, first_token: str, second_token: str) -> list[int]:
+        # Two hashes combined into as many as needed (Kirsch and Mitzenmacher). Hashes
+        # have to be stable across restarts, since the sketch is saved.
+        digest = hashlib.blake2b(
+            f"{first_token}\0{second_token}".encode("utf-8"), digest_size=16
+        ).digest()
+        hash_1 = int.from_bytes(digest[:8], "little")
+        hash_2 = int.from_bytes(digest[8:], "little") | 1
+        sketch_depth, sketch_width = self.sketch.shape
+        return [
+            row * sketch_width + (hash_1 + row * hash_2) % sketch_width
+            for row in range(sketch_depth)
+        ]
+
+    def estimate(self, first_token: str, second_token: str) -> int:
+        return int(
+            min(
+                self.flat_sketch[index]
+                for index in self.get_flat_sketch_indices(first_token, second_token)
+            )
+        )
+
+    def add(
+        self, first_token: str, second_token: str, count: int = 1, tabled: bool = True
+    ):
+        """
+        Add count occurrences of a pair. With tabled False, the pair is only added to
+        the sketch and to its first token's total.
+        """
+        for index in self.get_flat_sketch_indices(first_token, second_token):
+            self.flat_sketch[index] += count
+        self.total += count
+
+        table = self.tables.get(first_token)
+        if table is None:
+            if len(self.tables) >= self.max_first_tokens * PRUNE_AT_FRACTION:
+                self.prune()
+            table = self.tables[first_token] = {}
+            self.first_token_totals[first_token] = 0
+        self.first_token_totals[first_token] += count
+        if not tabled:
+            return
+        if second_token in table or len(table) < self.completions_per_token:
+            table[second_token] = table.get(second_token, 0) + count
+        else:
+            # Space-Saving: the new completion takes over the least frequent one's slot
+            # and count, which bounds how much it can be overestimated.
+            least_frequent = min(table, key=table.__getitem__)
+            table[second_token] = table.pop(least_frequent) + count
+
+    def prune(self):
+        kept = sorted(
+            self.tables, key=self.first_token_totals.__getitem__, reverse=True
+        )[: self.max_first_tokens]
+        self.tables = {first_token: self.tables[first_token] for first_token in kept}
+        self.first_token_totals = {
+            first_token: self.first_token_totals[first_token] for first_token in kept
+        }
+
+    def get_completions(self, first_token: str) -> list[tuple[str, int]]:
+        """
+        Return (second token, estimated count) for the tabled completions of
+        first_token.
+        """
+        return [
+            (second_token, min(count, self.estimate(first_token, second_token)))
+            for second_token, count in self.tables.get(first_token, {}).items()
+        ]
+
+    def sample_next(self, first_token: str) -> str | None:
+        completions = self.get_completions(first_token)
+        if not completions:
+            return None
+        return random.choices(
+            [second_token for second_token, _ in completions],
+            [count for _, count in completions],
+        )[0]
+
+    def can_end(self, first_token: str) -> bool:
+        return "" in self.tables.get(first_token, ())
+
+    def copy(self) -> "ApproximateModel":
+        model = ApproximateModel(
+            self.sketch.shape[1],
+            self.sketch.shape[0],
+            self.max_first_tokens,
+            self.completions_per_token,
+        )
+        model.sketch[:] = self.sketch
+        model.tables = {
+            first_token: dict(table) for first_token, table in self.tables.items()
+        }
+        model.first_token_totals = dict(self.first_token_totals)
+        model.total = self.total
+        return model
+
+    def save(self, path: pathlib.Path):
+        """
+        Write the model to path, replacing any model already there.
+        """
+        tables = json.dumps(
+            [
+                self.max_first_tokens,
+                self.completions_per_token,
+                self.total,
+                [
+                    [first_token, self.first_token_totals[first_token], table]
+                    for first_token, table in self.tables.items()
+                ],
+            ]
+        )
+        temporary_path = path.with_suffix(".tmp")
+        with open(temporary_path, "wb") as file:
+            np.savez(
+                file,
+                sketch=self.sketch,
+                tables=np.frombuffer(tables.encode("utf-8"), dtype=np.uint8),
+            )
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary_path, path)
+
+    @classmethod
+    def load(cls, path: pathlib.Path) -> "ApproximateModel":
+        """
+        Read a model written by save().
+        """
+        with np.load(path, allow_pickle=False) as data:
+            sketch = data["sketch"]
+            max_first_tokens, completions_per_token, total, tables = json.loads(
+                data["tables"].tobytes().decode("utf-8")
+            )
+        model = cls(
+            sketch.shape[1], sketch.shape[0], max_first_tokens, completions_per_token
+        )
+        model.sketch[:] = sketch
+        model.total = total
+        for first_token, first_token_total, table in tables:
+            model.tables[first_token] = table
+            model.first_token_totals[first_token] = first_token_total
+        return model
+
+
+def seed_approximate_model(
+    db_path: pathlib.Path, guild_id_bytes: bytes, model: ApproximateModel
+):
+    """
+    Add a guild's guild_pairs data to model.
+    """
+    with contextlib.closing(sqlite3.connect(db_path)) as db:
+        # Each first token's most frequent completions are tabled with their exact
+        # counts; the rest only go into the sketch, rather than displacing them.
+        previous_first_token = None
+        completions_tabled = 0
+        for first_token, second_token, frequency in db.execute(
+            "SELECT first_token, second_token, frequency FROM guild_pairs"
+            " WHERE guild_id = ? ORDER BY first_token, frequency DESC;",
+            (guild_id_bytes,),
+        ):
+            if first_token != previous_first_token:
+                previous_first_token = first_token
+                completions_tabled = 0
+            model.add(
+                first_token,
+                second_token,
+                frequency,
+                tabled=completions_tabled < model.completions_per_token,
+            )
+            completions_tabled += 1
+
+
+def write_approximate_model(
+    db_path: pathlib.Path, guild_id_bytes: bytes, model: ApproximateModel
+):
+    """
+    Replace a guild's guild_pairs and guild_total_completion_count data with model's
+    tabled completions and their estimated counts.
+    """
+    rows = [
+        (guild_id_bytes, first_token, second_token, count)
+        for first_token in model.tables
+        for second_token, count in model.get_completions(first_token)
+        if count > 0
+    ]
+    # Completions whose own table was pruned are given an end, so that sentences
+    # reaching them can finish.
+    tabled_first_tokens = {first_token for _, first_token, _, _ in rows}
+    rows += [
+        (guild_id_bytes, second_token, "", 1)
+        for second_token in {second_token for _, _, second_token, _ in rows}
+        - tabled_first_tokens
+        if second_token != ""
+    ]
+    with contextlib.closing(sqlite3.connect(db_path)) as db:
+        db.execute("DELETE FROM guild_pairs WHERE guild_id = ?;", (guild_id_bytes,))
+        db.execute(
+            "DELETE FROM guild_total_completion_count WHERE guild_id = ?;",
+            (guild_id_bytes,),
+        )
+        db.executemany(
+            "INSERT INTO guild_pairs(guild_id, first_token, second_token, frequency)"
+            " VALUES (?, ?, ?, ?);",
+            rows,
+        )
+        db.execute(
+            "INSERT INTO guild_total_completion_count(guild_id, first_token, total_completion_count)"
+            " SELECT guild_id, first_token, SUM(frequency) FROM guild_pairs"
+            " WHERE guild_id = ? GROUP BY first_token;",
+            (guild_id_bytes,),
+        )
+        db.commit()
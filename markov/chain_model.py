@@ -0,0 +1,80 @@
+import bisect
+import collections
+import itertools
+import random
+
+
+class ChainModel:
+    """
+    An in-memory Markov chain: for each token, the tokens that have followed it
+    along with cumulative frequencies for weighted sampling.
+    """
+
+    def __init__(self, rows):
+        """
+        rows is an iterable of (first_token, second_token, frequency).
+        """
+        grouped = collections.defaultdict(list)
+        for first_token, second_token, frequency in rows:
+            grouped[first_token].append((second_token, frequency))
+        self.completions = {
+            first_token: (
+                [second_token for second_token, _ in pairs],
+                [*itertools.accumulate(frequency for _, frequency in pairs)],
+            )
+            for first_token, pairs in grouped.items()
+        }
+
+    def __len__(self):
+        return len(self.completions)
+
+    def total_frequency(self, token: str) -> int:
+        try:
+            return self.completions[token][1][-1]
+        except KeyError:
+            return 0
+
+    def can_end(self, token: str) -> bool:
+        try:
+            return "" in self.completions[token][0]
+        except KeyError:
+            return False
+
+    def sample_next(self, token: str) -> str | None:
+        try:
+            next_tokens, cumulative_frequencies = self.completions[token]
+        except KeyError:
+            return None
+        choice = random.randrange(cumulative_frequencies[-1])
+        return next_tokens[bisect.bisect_right(cumulative_frequencies, choice)]
+
+
+class ChainModelCache:
+    """
+    A least-recently-used cache of ChainModels.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.models = collections.OrderedDict()
+
+    def get(self, key) -> ChainModel | None:
+        try:
+            self.models.move_to_end(key)
+        except KeyError:
+            return None
+        return self.models[key]
+
+    def put(self, key, model: ChainModel):
+        self.models[key] = model
+        self.models.move_to_end(key)
+        while len(self.models) > self.max_size:
+            self.models.popitem(last=False)
+
+    def invalidate(self, key):
+        self.models.pop(key, None)
+
+    def invalidate_where(self, predicate):
+        for key in [*self.models]:
+            if predicate(key):
+                del self.models[key]
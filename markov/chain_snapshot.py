@@ -0,0 +1,199 @@
+import numpy as np
+import bisect
+import contextlib
+import mmap
+import os
+import pathlib
+import random
+import sqlite3
+import struct
+from .queries import *
+
+MAGIC = b"MKVSNAP1"
+# magic, number of tokens, length of the token text, number of pairs, delta watermark
+HEADER_FORMAT = "<8sqqqq"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+
+class ChainSnapshot:
+    """
+    A read-only, memory-mapped copy of a guild's guild_pairs data.
+
+    The file holds, after a header:
+    - token_offsets: where each token's UTF-8 text starts in token_text, for tokens
+      sorted by their text, plus the end of the last one. A token's index in this
+      order is its id within the snapshot.
+    - completion_offsets: for each token id, where its completions start in the
+      two arrays below, plus the end of the last token's.
+    - next_token_ids: the completions' token ids.
+    - cumulative_frequencies: running totals of the completions' frequencies, per
+      first token.
+    - token_text
+
+    Nothing is copied out of the file, so processes using the same snapshot share
+    it through the page cache. delta_watermark is the highest guild_pair_deltas id
+    whose pair is included; newer deltas have to be added on top.
+    """
+
+    def __init__(self, path: pathlib.Path):
+        with open(path, "rb") as file:
+            self.inode = os.fstat(file.fileno()).st_ino
+            self.mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, token_count, token_text_length, pair_count, self.delta_watermark = (
+            struct.unpack_from(HEADER_FORMAT, self.mmap)
+        )
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a chain snapshot")
+        offset = HEADER_SIZE
+        self.token_offsets = np.frombuffer(
+            self.mmap, dtype=np.int64, count=token_count + 1, offset=offset
+        )
+        offset += self.token_offsets.nbytes
+        self.completion_offsets = np.frombuffer(
+            self.mmap, dtype=np.int64, count=token_count + 1, offset=offset
+        )
+        offset += self.completion_offsets.nbytes
+        self.cumulative_frequencies = np.frombuffer(
+            self.mmap, dtype=np.int64, count=pair_count, offset=offset
+        )
+        offset += self.cumulative_frequencies.nbytes
+        self.next_token_ids = np.frombuffer(
+            self.mmap, dtype=np.int32, count=pair_count, offset=offset
+        )
+        offset += self.next_token_ids.nbytes
+        self.token_text = memoryview(self.mmap)[offset : offset + token_text_length]
+        self.token_count = token_count
+        self.end_token_id = self.get_token_id("")
+
+    def get_token(self, token_id: int) -> str:
+        return str(
+            self.token_text[
+                self.token_offsets[token_id] : self.token_offsets[token_id + 1]
+            ],
+            "utf-8",
+        )
+
+    def get_token_id(self, token: str) -> int | None:
+        token_bytes = token.encode("utf-8")
+        token_id = bisect.bisect_left(
+            range(self.token_count),
+            token_bytes,
+            key=lambda token_id: self.token_text[
+                self.token_offsets[token_id] : self.token_offsets[token_id + 1]
+            ].tobytes(),
+        )
+        if token_id < self.token_count and self.get_token(token_id) == token:
+            return token_id
+        return None
+
+    def get_completion_range(self, token: str) -> tuple[int, int]:
+        token_id = self.get_token_id(token)
+        if token_id is None:
+            return 0, 0
+        return (
+            int(self.completion_offsets[token_id]),
+            int(self.completion_offsets[token_id + 1]),
+        )
+
+    def total_frequency(self, token: str) -> int:
+        start, end = self.get_completion_range(token)
+        if start == end:
+            return 0
+        return int(self.cumulative_frequencies[end - 1])
+
+    def can_end(self, token: str) -> bool:
+        start, end = self.get_completion_range(token)
+        # The end sentinel "" sorts first, so it's the first completion if it's there
+        return start != end and self.next_token_ids[start] == self.end_token_id
+
+    def sample_next(self, token: str) -> str | None:
+        start, end = self.get_completion_range(token)
+        if start == end:
+            return None
+        cumulative_frequencies = self.cumulative_frequencies[start:end]
+        choice = random.randrange(int(cumulative_frequencies[-1]))
+        index = start + int(np.searchsorted(cumulative_frequencies, choice, "right"))
+        return self.get_token(int(self.next_token_ids[index]))
+
+
+def build_snapshot(db_path: pathlib.Path, guild_id_bytes: bytes, path: pathlib.Path):
+    """
+    Write a snapshot of a guild's pairs to path, replacing any snapshot already there,
+    then delete the deltas it includes.
+    """
+    with contextlib.closing(sqlite3.connect(db_path)) as db:
+        # Read the pairs and the delta watermark together, so every pair is either in
+        # the snapshot or in a newer delta.
+        db.execute("BEGIN;")
+        delta_watermark = db.execute(
+            "SELECT COALESCE(MAX(id), 0) FROM guild_pair_deltas WHERE guild_id = ?;",
+            (guild_id_bytes,),
+        ).fetchone()[0]
+        rows = db.execute(
+            CHAIN_SNAPSHOT_PAIRS_QUERY,
+            (guild_id_bytes,),
+        ).fetchall()
+        db.commit()
+
+        tokens = sorted(
+            {first_token for first_token, _, _ in rows}
+            | {second_token for _, second_token, _ in rows}
+        )
+        token_ids = {token: token_id for token_id, token in enumerate(tokens)}
+        encoded_tokens = [token.encode("utf-8") for token in tokens]
+        token_offsets = np.zeros(len(tokens) + 1, dtype=np.int64)
+        np.cumsum(
+            np.array([len(token) for token in encoded_tokens], dtype=np.int64),
+            out=token_offsets[1:],
+        )
+        first_token_ids = np.array(
+            [token_ids[first_token] for first_token, _, _ in rows], dtype=np.int64
+        )
+        completion_offsets = np.zeros(len(tokens) + 1, dtype=np.int64)
+        np.cumsum(
+            np.bincount(first_token_ids, minlength=len(tokens)),
+            out=completion_offsets[1:],
+        )
+        next_token_ids = np.array(
+            [token_ids[second_token] for _, second_token, _ in rows], dtype=np.int32
+        )
+        cumulative_frequencies = np.cumsum(
+            np.array([frequency for _, _, frequency in rows], dtype=np.int64)
+        )
+        # Restart the running totals at each first token
+        if len(rows):
+            group_starts = completion_offsets[:-1][
+                completion_offsets[:-1] < completion_offsets[1:]
+            ]
+            totals_before = np.concatenate(([0], cumulative_frequencies))[group_starts]
+            cumulative_frequencies -= np.repeat(
+                totals_before, np.diff(np.append(group_starts, len(rows)))
+            )
+
+        temporary_path = path.with_suffix(".tmp")
+        with open(temporary_path, "wb") as file:
+            file.write(
+                struct.pack(
+                    HEADER_FORMAT,
+                    MAGIC,
+                    len(tokens),
+                    int(token_offsets[-1]),
+                    len(rows),
+                    delta_watermark,
+                )
+            )
+            file.write(token_offsets.tobytes())
+            file.write(completion_offsets.tobytes())
+            file.write(cumulative_frequencies.tobytes())
+            file.write(next_token_ids.tobytes())
+            file.write(b"".join(encoded_tokens))
+            file.flush()
+            os.fsync(file.fileno())
+        # Processes that have the old snapshot mapped keep using it until they reopen
+        os.replace(temporary_path, path)
+
+        db.execute(
+            "DELETE FROM guild_pair_deltas WHERE guild_id = ? AND id <= ?;",
+            (guild_id_bytes, delta_watermark),
+        )
+        db.commit()
@@ -0,0 +1,77 @@
+-- Rebuild the pair and completion count tables as WITHOUT ROWID tables clustered on
+-- the columns they're looked up by, so that each row is stored once instead of in
+-- the table, its UNIQUE index and a covering index. Generation reads completions in
+-- order of frequency through the secondary indexes, which also hold the rest of the
+-- primary key and so still cover those reads.
+CREATE TABLE guild_total_completion_count_new (
+    guild_id BLOB,
+    first_token TEXT,
+    total_completion_count INTEGER,
+    PRIMARY KEY (guild_id, first_token)
+) STRICT, WITHOUT ROWID;
+
+INSERT INTO guild_total_completion_count_new
+SELECT guild_id, first_token, total_completion_count FROM guild_total_completion_count
+ORDER BY guild_id, first_token;
+
+DROP TABLE guild_total_completion_count;
+
+ALTER TABLE guild_total_completion_count_new RENAME TO guild_total_completion_count;
+
+CREATE TABLE guild_pairs_new (
+    guild_id BLOB,
+    first_token TEXT,
+    second_token TEXT,
+    frequency INTEGER,
+    PRIMARY KEY (guild_id, first_token, second_token)
+) STRICT, WITHOUT ROWID;
+
+INSERT INTO guild_pairs_new
+SELECT guild_id, first_token, second_token, frequency FROM guild_pairs
+ORDER BY guild_id, first_token, second_token;
+
+DROP TABLE guild_pairs;
+
+ALTER TABLE guild_pairs_new RENAME TO guild_pairs;
+
+CREATE INDEX idx_guild_pairs__guild_id__first_token__frequency ON guild_pairs (guild_id, first_token, frequency);
+
+CREATE TABLE member_total_completion_count_new (
+    guild_id BLOB,
+    member_id BLOB,
+    first_token TEXT,
+    total_completion_count INTEGER,
+    PRIMARY KEY (guild_id, member_id, first_token)
+) STRICT, WITHOUT ROWID;
+
+INSERT INTO member_total_completion_count_new
+SELECT guild_id, member_id, first_token, total_completion_count FROM member_total_completion_count
+ORDER BY guild_id, member_id, first_token;
+
+DROP TABLE member_total_completion_count;
+
+ALTER TABLE member_total_completion_count_new RENAME TO member_total_completion_count;
+
+CREATE TABLE member_pairs_new (
+    guild_id BLOB,
+    member_id BLOB,
+    first_token TEXT,
+    second_token TEXT,
+    frequency INTEGER,
+    PRIMARY KEY (guild_id, member_id, first_token, second_token)
+) STRICT, WITHOUT ROWID;
+
+INSERT INTO member_pairs_new
+SELECT guild_id, member_id, first_token, second_token, frequency FROM member_pairs
+ORDER BY guild_id, member_id, first_token, second_token;
+
+DROP TABLE member_pairs;
+
+ALTER TABLE member_pairs_new RENAME TO member_pairs;
+
+CREATE INDEX idx_member_pairs__guild_id__member_id__first_token__frequency ON member_pairs (
+    guild_id,
+    member_id,
+    first_token,
+    frequency
+);
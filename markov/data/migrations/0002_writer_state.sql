@@ -0,0 +1,8 @@
+-- The sequence number of the last batch applied by the writer process, committed
+-- together with the batch so that resent batches aren't applied twice.
+CREATE TABLE writer_state (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    last_applied_batch INTEGER NOT NULL
+) STRICT;
+
+INSERT INTO writer_state(id, last_applied_batch) VALUES (0, 0);
@@ -40,6 +40,30 @@ CREATE INDEX IF NOT EXISTS idx_member_pairs__guild_id__member_id__first_token__f
     second_token
 );
 
-PRAGMA analysis_limit = 1000;
+CREATE TABLE IF NOT EXISTS tokens (
+    id INTEGER PRIMARY KEY,
+    token TEXT NOT NULL UNIQUE
+) STRICT;
+
+-- Used instead of member_pairs/member_total_completion_count for guilds with
+-- compact_member_data enabled. Member models are built from this on demand.
+CREATE TABLE IF NOT EXISTS member_contributions (
+    guild_id BLOB,
+    member_id BLOB,
+    first_token_id INTEGER,
+    second_token_id INTEGER,
+    frequency INTEGER,
+    PRIMARY KEY (guild_id, member_id, first_token_id, second_token_id)
+) STRICT, WITHOUT ROWID;
+
+-- Pairs added to guilds with chain_snapshot enabled, kept until they're compiled into
+-- the guild's snapshot file. AUTOINCREMENT so that ids are never reused, since
+-- snapshots record the highest id they include.
+CREATE TABLE IF NOT EXISTS guild_pair_deltas (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    guild_id BLOB,
+    first_token TEXT,
+    second_token TEXT
+) STRICT;
 
-PRAGMA optimize;
+CREATE INDEX IF NOT EXISTS idx_guild_pair_deltas__guild_id__id ON guild_pair_deltas (guild_id, id);
@@ -0,0 +1,241 @@
+import collections
+import enum
+import random
+import sqlite3
+import time
+import typing
+from .approximate_model import ApproximateModel
+from .chain_model import ChainModel
+from .chain_snapshot import ChainSnapshot
+from .errors import *
+from .queries import *
+
+MAX_TOKEN_GENERATION_ITERATIONS = 1000
+# Once this fraction of the token budget is used, end the sentence as soon as the
+# chain allows it.
+STEER_TO_END_AFTER_BUDGET_FRACTION = 0.75
+# A loop is detected when the same run of LOOP_NGRAM_SIZE tokens is generated
+# LOOP_REPEAT_THRESHOLD times within the last LOOP_WINDOW_SIZE tokens.
+LOOP_NGRAM_SIZE = 3
+LOOP_REPEAT_THRESHOLD = 3
+LOOP_WINDOW_SIZE = 60
+
+
+class StopReason(enum.Enum):
+    # The chain reached the end sentinel by itself
+    END = enum.auto()
+    # The end sentinel was chosen early because of a loop or the token budget
+    STEERED_END = enum.auto()
+    # The result was cut off
+    TOKEN_BUDGET = enum.auto()
+    LENGTH_LIMIT = enum.auto()
+    TIMEOUT = enum.auto()
+
+
+class TokenSource(typing.Protocol):
+    def sample_next(self, token: str) -> str: ...
+
+    def can_end(self, token: str) -> bool: ...
+
+
+class ModelTokenSource:
+    def __init__(self, model: ChainModel, guild_id: int, member_id: int | None):
+        self.model = model
+        self.guild_id = guild_id
+        self.member_id = member_id
+
+    def sample_next(self, token: str) -> str:
+        next_token = self.model.sample_next(token)
+        if next_token is None:
+            raise NoTotalCompletionCountError(self.guild_id, self.member_id, token)
+        return next_token
+
+    def can_end(self, token: str) -> bool:
+        return self.model.can_end(token)
+
+
+class SnapshotTokenSource:
+    """
+    Samples from a guild's chain snapshot together with the pairs added since it was
+    built, without querying the database.
+    """
+
+    def __init__(self, snapshot: ChainSnapshot, delta: ChainModel, guild_id: int):
+        self.snapshot = snapshot
+        self.delta = delta
+        self.guild_id = guild_id
+
+    def sample_next(self, token: str) -> str:
+        snapshot_frequency = self.snapshot.total_frequency(token)
+        total_frequency = snapshot_frequency + self.delta.total_frequency(token)
+        if not total_frequency:
+            raise NoTotalCompletionCountError(self.guild_id, None, token)
+        if random.randrange(total_frequency) < snapshot_frequency:
+            return self.snapshot.sample_next(token)
+        return self.delta.sample_next(token)
+
+    def can_end(self, token: str) -> bool:
+        return self.snapshot.can_end(token) or self.delta.can_end(token)
+
+
+class ApproximateTokenSource:
+    """
+    Samples from a guild's approximate model. Tokens whose completions have been
+    pruned end the sentence.
+    """
+
+    def __init__(self, model: ApproximateModel, guild_id: int):
+        self.model = model
+        self.guild_id = guild_id
+
+    def sample_next(self, token: str) -> str:
+        next_token = self.model.sample_next(token)
+        if next_token is None:
+            if token == "":
+                raise NoTotalCompletionCountError(self.guild_id, None, token)
+            return ""
+        return next_token
+
+    def can_end(self, token: str) -> bool:
+        return self.model.can_end(token)
+
+
+class DatabaseTokenSource:
+    """
+    Samples tokens directly from the pair tables.
+    """
+
+    def __init__(
+        self,
+        db: sqlite3.Connection,
+        guild_id: int,
+        guild_id_bytes: bytes,
+        member_id: int | None,
+        member_id_bytes: bytes | None,
+    ):
+        self.db = db
+        self.guild_id = guild_id
+        self.guild_id_bytes = guild_id_bytes
+        self.member_id = member_id
+        self.member_id_bytes = member_id_bytes
+
+    def get_total_completion_count(self, first_token: str) -> int | None:
+        if not self.member_id:
+            row = self.db.execute(
+                GUILD_TOTAL_COMPLETION_COUNT_QUERY,
+                (self.guild_id_bytes, first_token),
+            ).fetchone()
+        else:
+            row = self.db.execute(
+                MEMBER_TOTAL_COMPLETION_COUNT_QUERY,
+                (self.guild_id_bytes, self.member_id_bytes, first_token),
+            ).fetchone()
+        return row[0] if row else None
+
+    def get_possible_next_token(
+        self, first_token: str, offset: int
+    ) -> tuple[str | None, int | None]:
+        if not self.member_id:
+            row = self.db.execute(
+                GUILD_COMPLETION_BY_FREQUENCY_QUERY,
+                (self.guild_id_bytes, first_token, offset),
+            ).fetchone()
+        else:
+            row = self.db.execute(
+                MEMBER_COMPLETION_BY_FREQUENCY_QUERY,
+                (self.guild_id_bytes, self.member_id_bytes, first_token, offset),
+            ).fetchone()
+        if not row:
+            return None, None
+        next_token, frequency = row
+        return next_token, frequency
+
+    def sample_next(self, token: str) -> str:
+        completion_count = self.get_total_completion_count(token)
+        if completion_count is None:
+            raise NoTotalCompletionCountError(self.guild_id, self.member_id, token)
+        next_token = None
+        for i in range(MAX_TOKEN_GENERATION_ITERATIONS):
+            next_token, frequency = self.get_possible_next_token(token, i)
+            if next_token is None:
+                raise NoNextTokenError(self.guild_id, self.member_id, token, i)
+            if random.randint(1, completion_count) <= frequency:
+                return next_token
+
+            completion_count -= frequency
+            if completion_count <= 0:
+                raise InvalidCompletionCountError(
+                    self.guild_id, self.member_id, token, i
+                )
+        # If we went through MAX_TOKEN_GENERATION_ITERATIONS completions
+        # without selecting any, then just select the last one we considered
+        # (round off the probability, effectively)
+        return next_token
+
+    def can_end(self, token: str) -> bool:
+        if not self.member_id:
+            row = self.db.execute(
+                GUILD_CAN_END_QUERY,
+                (self.guild_id_bytes, token),
+            ).fetchone()
+        else:
+            row = self.db.execute(
+                MEMBER_CAN_END_QUERY,
+                (self.guild_id_bytes, self.member_id_bytes, token),
+            ).fetchone()
+        return row is not None
+
+
+def generate_text(
+    source: TokenSource,
+    append_token: typing.Callable[[str, str], str],
+    deadline: float,
+    max_tokens: int,
+    max_length: int,
+) -> tuple[str, StopReason, bool]:
+    """
+    Generate text from source until the end sentinel is reached or a limit is hit.
+
+    deadline is compared against time.monotonic(). Returns the text, why generation
+    stopped, and whether a loop was detected along the way.
+    """
+    result = ""
+    token = ""
+    tokens_generated = 0
+    steer_after = int(max_tokens * STEER_TO_END_AFTER_BUDGET_FRACTION)
+    recent_tokens = collections.deque(maxlen=LOOP_NGRAM_SIZE)
+    recent_ngrams = collections.deque()
+    ngram_counts = collections.Counter()
+    loop_detected = False
+
+    while True:
+        if time.monotonic() > deadline:
+            return result, StopReason.TIMEOUT, loop_detected
+        if (
+            tokens_generated
+            and (loop_detected or tokens_generated >= steer_after)
+            and source.can_end(token)
+        ):
+            return result, StopReason.STEERED_END, loop_detected
+
+        next_token = source.sample_next(token)
+        if next_token == "":
+            return result, StopReason.END, loop_detected
+        new_result = append_token(result, next_token)
+        if len(new_result) > max_length:
+            return result, StopReason.LENGTH_LIMIT, loop_detected
+        result = new_result
+        token = next_token
+        tokens_generated += 1
+        if tokens_generated >= max_tokens:
+            return result, StopReason.TOKEN_BUDGET, loop_detected
+
+        recent_tokens.append(token)
+        if len(recent_tokens) == LOOP_NGRAM_SIZE:
+            ngram = tuple(recent_tokens)
+            recent_ngrams.append(ngram)
+            ngram_counts[ngram] += 1
+            if len(recent_ngrams) > LOOP_WINDOW_SIZE:
+                ngram_counts[recent_ngrams.popleft()] -= 1
+            if ngram_counts[ngram] >= LOOP_REPEAT_THRESHOLD:
+                loop_detected = True
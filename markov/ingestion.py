@@ -0,0 +1,121 @@
+import asyncio
+import collections
+import random
+import time
+
+DEFAULT_HIGH_WATER_MARK = 1000
+# Once the queue is at least this fraction of the way to the high-water mark, messages
+# that repeat one recently seen in the same guild are dropped.
+DEDUPLICATE_FROM_FRACTION = 0.5
+RECENT_CONTENT_TTL_SECS = 60
+
+
+class IngestionQueue:
+    """
+    A bounded queue of messages waiting to be processed, served round-robin across
+    guilds so that a flood in one guild doesn't hold up the others.
+
+    When the queue reaches the high-water mark, each guild's pending messages become
+    a reservoir sample of everything it has sent since then, so load is shed without
+    favouring either the start or the end of a flood. Duplicate spam is dropped
+    before that point using a short-lived set of content hashes.
+    """
+
+    def __init__(self, high_water_mark: int = DEFAULT_HIGH_WATER_MARK):
+        self.high_water_mark = high_water_mark
+        # guild id -> deque of pending (content, guild id, member id), in the order
+        # guilds are served
+        self.pending = collections.OrderedDict()
+        self.depth = 0
+        self.not_empty = asyncio.Event()
+        # guild id -> number of messages seen since the high-water mark was reached
+        self.seen_under_pressure = collections.Counter()
+        # hash of (guild id, content) -> when it stops counting as recent
+        self.recent_content = {}
+        self.enqueued = 0
+        self.deduplicated = 0
+        self.shed = 0
+        self.max_depth = 0
+
+    def put(self, content: str, guild_id: int, member_id: int) -> bool:
+        """
+        Queue a message. Returns whether it was queued (it may have replaced another
+        pending message).
+        """
+        item = (content, guild_id, member_id)
+        now = time.monotonic()
+        content_hash = hash((guild_id, content))
+        is_recent = self.recent_content.get(content_hash, 0) > now
+        self.recent_content[content_hash] = now + RECENT_CONTENT_TTL_SECS
+        if len(self.recent_content) > self.high_water_mark * 10:
+            self.recent_content = {
+                content_hash: expiry
+                for content_hash, expiry in self.recent_content.items()
+                if expiry > now
+            }
+
+        if is_recent and self.depth >= self.high_water_mark * DEDUPLICATE_FROM_FRACTION:
+            self.deduplicated += 1
+            return False
+
+        guild_pending = self.pending.get(guild_id)
+        if self.depth >= self.high_water_mark and guild_pending:
+            # Algorithm R, treating the guild's pending items as the reservoir
+            if guild_id not in self.seen_under_pressure:
+                self.seen_under_pressure[guild_id] = len(guild_pending)
+            self.seen_under_pressure[guild_id] += 1
+            index = random.randrange(self.seen_under_pressure[guild_id])
+            self.shed += 1
+            if index >= len(guild_pending):
+                return False
+            guild_pending[index] = item
+            return True
+
+        # Guilds with nothing pending always get a message in, so a flood elsewhere
+        # can't starve them; this can take the queue slightly past the high-water mark.
+        if guild_pending is None:
+            guild_pending = self.pending[guild_id] = collections.deque()
+        guild_pending.append(item)
+        self.depth += 1
+        self.enqueued += 1
+        self.max_depth = max(self.max_depth, self.depth)
+        self.not_empty.set()
+        return True
+
+    async def get(self):
+        while not self.depth:
+            self.not_empty.clear()
+            await self.not_empty.wait()
+        guild_id, guild_pending = self.pending.popitem(last=False)
+        item = guild_pending.popleft()
+        if guild_pending:
+            self.pending[guild_id] = guild_pending
+        self.depth -= 1
+        if self.depth < self.high_water_mark * DEDUPLICATE_FROM_FRACTION:
+            self.seen_under_pressure.clear()
+        return item
+
+    def discard(self, guild_id: int, member_id: int | None = None):
+        """
+        Drop the pending messages for a guild, or only for one member in it.
+        """
+        guild_pending = self.pending.pop(guild_id, None)
+        if guild_pending is None:
+            return
+        self.depth -= len(guild_pending)
+        if member_id is not None:
+            guild_pending = collections.deque(
+                item for item in guild_pending if item[2] != member_id
+            )
+            if guild_pending:
+                self.pending[guild_id] = guild_pending
+                self.depth += len(guild_pending)
+
+    def stats_text(self) -> str:
+        return (
+            f"queue depth: {self.depth} (high-water mark {self.high_water_mark},"
+            f" max seen {self.max_depth})\n"
+            f"guilds with pending messages: {len(self.pending)}\n"
+            f"messages queued: {self.enqueued}, dropped as duplicates: {self.deduplicated},"
+            f" shed: {self.shed}"
+        )
@@ -1,18 +1,62 @@
 import aiosqlite
 import discord
+from discord.ext import tasks
 import redbot.core
 from redbot.core import Config
 from redbot.core import commands
+import asyncio
+import collections
+import contextlib
 import enum
+import logging
 import math
-import random
+import pathlib
 import re
+import sqlite3
+import time
 import unicodedata
+from .analytics import GuildAnalytics, MAX_TOP_RESULTS
+from .approximate_model import *
+from .chain_model import ChainModel, ChainModelCache
+from .chain_snapshot import ChainSnapshot, build_snapshot
+from .discord_cache import DiscordObjectResolver
 from .errors import *
+from .generation import *
+from .ingestion import DEFAULT_HIGH_WATER_MARK, IngestionQueue
+from .queries import *
+from .query_plans import check_query_plans
+from .sentence_pool import SentencePool
+from .writer_client import WriterClient
 
 MAX_EXCLUSIONS_PER_GUILD = 50
-MAX_TOKEN_GENERATION_ITERATIONS = 1000
 MAX_TOKEN_LENGTH = 70
+MAX_GENERATED_TOKENS = 300
+# Discord's message length limit
+MAX_GENERATED_LENGTH = 2000
+GENERATION_TIMEOUT_SECS = 5
+# Cached analytics are rebuilt once this many pairs (or this fraction of the guild's
+# total, if larger) have been added since they were built.
+ANALYTICS_STALE_AFTER_PAIRS = 1000
+ANALYTICS_STALE_AFTER_FRACTION = 0.01
+MAX_CACHED_MEMBER_MODELS = 32
+MAX_CACHED_TOKEN_IDS = 100_000
+# Sentence pools are only refilled once the cog has been idle (no messages processed
+# or sentences generated) for this long.
+SENTENCE_POOL_IDLE_SECS = 10
+SENTENCE_POOL_REFILL_INTERVAL_SECS = 30
+MAX_SENTENCES_POOLED_PER_REFILL = 50
+CHAIN_SNAPSHOT_CHECK_INTERVAL_SECS = 5 * 60
+# A guild's chain snapshot is rebuilt once this many pairs have been added since it
+# was built.
+CHAIN_SNAPSHOT_REBUILD_AFTER_DELTAS = 10_000
+# PRAGMA optimize is run this long after the cog loads and then at this interval,
+# rather than while loading.
+DATABASE_MAINTENANCE_DELAY_SECS = 10 * 60
+DATABASE_MAINTENANCE_INTERVAL_SECS = 6 * 60 * 60
+# How long unloading the cog waits for queued messages to be processed
+INGESTION_DRAIN_TIMEOUT_SECS = 10
+# Approximate models changed since they were last saved are saved at this interval
+APPROXIMATE_MODEL_CHECKPOINT_INTERVAL_SECS = 60
 
 
 class ExclusionType(enum.Enum):
@@ -22,26 +66,197 @@ class ExclusionType(enum.Enum):
 
 class Markov(commands.Cog):
     def __init__(self, bot):
+        self.logger = logging.getLogger("red.aps-cogs.markov")
         self.bot = bot
         self.config = Config.get_conf(
             self, identifier="551742410770612234|085c218a-e850-4b07-9fc9-535c1b0d4c73"
         )
         self.config.register_guild(
-            use_messages=False, blacklisted_strings=[], ignored_strings=[]
+            use_messages=False,
+            blacklisted_strings=[],
+            ignored_strings=[],
+            compact_member_data=False,
+            sentence_pool=False,
+            chain_snapshot=False,
+            approximate_mode=False,
+            # str(channel id) -> whether to process messages in that channel
+            channel_use_messages={},
         )
         self.config.register_member(use_messages=True)
+        # use_messages is only kept here so that data from before it moved to the guild
+        # scope can be migrated; see migrate_channel_use_messages().
         self.config.register_channel(use_messages=False)
+        self.config.register_global(
+            ingestion_high_water_mark=DEFAULT_HIGH_WATER_MARK,
+            writer_process=False,
+            approximate_model_size={
+                "sketch_width": DEFAULT_SKETCH_WIDTH,
+                "sketch_depth": DEFAULT_SKETCH_DEPTH,
+                "max_first_tokens": DEFAULT_MAX_FIRST_TOKENS,
+                "completions_per_token": DEFAULT_COMPLETIONS_PER_TOKEN,
+            },
+        )
 
         self.db_path = redbot.core.data_manager.cog_data_path(self) / "markov.db"
+        self.snapshots_path = redbot.core.data_manager.cog_data_path(self) / "snapshots"
+        self.approximate_models_path = (
+            redbot.core.data_manager.cog_data_path(self) / "approximate"
+        )
+        self.writer_journal_path = (
+            redbot.core.data_manager.cog_data_path(self) / "writer_journal.jsonl"
+        )
+        self.resolver = DiscordObjectResolver(bot)
+        # channel id -> use_messages, mirroring the guilds' channel_use_messages
+        self.channel_use_messages = {}
+        self.channel_migration_task = None
+        # (guild id, member id) -> ChainModel, for guilds with compact_member_data
+        self.member_models = ChainModelCache(MAX_CACHED_MEMBER_MODELS)
+        # token -> id in the tokens table; ids never change once assigned
+        self.token_ids = {}
+        self.generation_stop_reasons = collections.Counter()
+        self.generation_loops_detected = 0
+        # guild id -> (GuildAnalytics, value of pairs_processed when it was built)
+        self.guild_analytics = {}
+        # guild id -> number of times its analytics have been invalidated, so that
+        # analytics built across an invalidation aren't used
+        self.guild_analytics_invalidations = collections.Counter()
+        # guild id -> number of pairs processed since the cog was loaded
+        self.pairs_processed = collections.Counter()
+        self.sentence_pool = SentencePool()
+        # guild id -> ChainSnapshot, for guilds with chain_snapshot
+        self.chain_snapshots = {}
+        # guild id -> lock held while building or deleting its snapshot, so that a
+        # build that read deleted data can't put its file back after the delete
+        self.chain_snapshot_locks = collections.defaultdict(asyncio.Lock)
+        # guild id -> ApproximateModel, for guilds with approximate_mode
+        self.approximate_models = {}
+        # ids of guilds whose approximate models have changed since they were saved
+        self.unsaved_approximate_models = set()
+        # guild id -> lock held while loading, saving or deleting its model's file, so
+        # that a checkpoint already under way can't recreate the file after a delete
+        self.approximate_model_locks = collections.defaultdict(asyncio.Lock)
+        self.last_active_at = 0.0
+        # Messages are processed one at a time from here, so that a flood of them
+        # doesn't turn into a pile of connections contending for the write lock.
+        self.ingestion_queue = IngestionQueue()
+        self.ingestion_task = None
+        # Held while processing a message, so that converting a guild's data can keep
+        # messages from being processed halfway through.
+        self.processing_lock = asyncio.Lock()
+        # Set while writes go through a writer process (see writer_process.py)
+        self.writer_client = None
 
     async def cog_load(self):
-        with open(
-            redbot.core.data_manager.bundled_data_path(self) / "migrations/init.sql",
-            "r",
-        ) as setup_script_file:
-            async with aiosqlite.connect(self.db_path) as db:
-                await db.executescript(setup_script_file.read())
-                await db.commit()
+        start_time = time.perf_counter()
+        async with aiosqlite.connect(self.db_path) as db:
+            await self.migrate_database(db)
+            for description, plan, problem in await check_query_plans(db):
+                if problem is not None:
+                    self.logger.warning(
+                        f"Query plan regression in {description} query ({problem}):"
+                        f" {'; '.join(plan)}"
+                    )
+        self.logger.debug(
+            f"Database ready in {(time.perf_counter() - start_time) * 1000:.0f} ms."
+        )
+        legacy_channel_data = await self.config.all_channels()
+        self.channel_use_messages = {
+            channel_id: channel_data["use_messages"]
+            for channel_id, channel_data in legacy_channel_data.items()
+        }
+        for guild_data in (await self.config.all_guilds()).values():
+            self.channel_use_messages.update(
+                (int(channel_id), use_messages)
+                for channel_id, use_messages in guild_data[
+                    "channel_use_messages"
+                ].items()
+            )
+        if legacy_channel_data:
+            self.channel_migration_task = asyncio.create_task(
+                self.migrate_channel_use_messages(legacy_channel_data)
+            )
+        await asyncio.to_thread(self.snapshots_path.mkdir, exist_ok=True)
+        await asyncio.to_thread(self.approximate_models_path.mkdir, exist_ok=True)
+        self.ingestion_queue.high_water_mark = (
+            await self.config.ingestion_high_water_mark()
+        )
+        if await self.config.writer_process():
+            await self.start_writer_client()
+        self.ingestion_task = asyncio.create_task(self.ingest_messages())
+        self.refill_sentence_pools.start()
+        self.rebuild_chain_snapshots.start()
+        self.maintain_database.start()
+        self.checkpoint_approximate_models.start()
+
+    async def cog_unload(self):
+        if self.channel_migration_task is not None:
+            self.channel_migration_task.cancel()
+        self.refill_sentence_pools.cancel()
+        self.rebuild_chain_snapshots.cancel()
+        self.maintain_database.cancel()
+        self.checkpoint_approximate_models.cancel()
+        if self.ingestion_task is not None:
+            self.ingestion_task.cancel()
+            try:
+                await asyncio.wait_for(
+                    self.drain_ingestion_queue(), INGESTION_DRAIN_TIMEOUT_SECS
+                )
+            except asyncio.TimeoutError:
+                self.logger.warning(
+                    f"Dropped {self.ingestion_queue.depth} queued messages on unload."
+                )
+        if self.writer_client is not None:
+            await self.writer_client.stop()
+        await self.save_approximate_models()
+
+    async def migrate_database(self, db: aiosqlite.Connection):
+        version = (await db.execute_fetchall("PRAGMA user_version;"))[0][0]
+        for migration_version, name, script in await asyncio.to_thread(
+            self.read_pending_migrations, version
+        ):
+            self.logger.info(f"Applying database migration {name}.")
+            # Each migration and the version bump are committed together
+            await db.executescript(
+                f"BEGIN;\n{script}\nPRAGMA user_version = {migration_version};\nCOMMIT;"
+            )
+
+    def read_pending_migrations(self, version: int) -> list[tuple[int, str, str]]:
+        """
+        Return (version, file name, script) for each migration newer than version, in
+        order. init.sql, which creates the original schema that the numbered
+        migrations build on, counts as version 0; it's safe to run on databases from
+        before there were any migrations.
+        """
+        migrations_path = (
+            redbot.core.data_manager.bundled_data_path(self) / "migrations"
+        )
+        migrations = []
+        if version == 0:
+            migrations.append(
+                (0, "init.sql", (migrations_path / "init.sql").read_text("utf-8"))
+            )
+        for migration_path in sorted(migrations_path.glob("[0-9]*.sql")):
+            migration_version = int(migration_path.name.split("_")[0])
+            if migration_version > version:
+                migrations.append(
+                    (
+                        migration_version,
+                        migration_path.name,
+                        migration_path.read_text("utf-8"),
+                    )
+                )
+        return migrations
+
+    @tasks.loop(seconds=DATABASE_MAINTENANCE_INTERVAL_SECS)
+    async def maintain_database(self):
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.execute("PRAGMA analysis_limit = 1000;")
+            await db.execute("PRAGMA optimize;")
+
+    @maintain_database.before_loop
+    async def before_maintain_database(self):
+        # Keep ANALYZE from competing with everything else that happens on startup
+        await asyncio.sleep(DATABASE_MAINTENANCE_DELAY_SECS)
 
     @commands.Cog.listener()
     async def on_message_without_command(self, message):
@@ -51,9 +266,9 @@ class Markov(commands.Cog):
         if not await self.config.guild(message.guild).use_messages():
             return
 
-        if not await self.config.channel(
-            self.get_base_channel(message.channel)
-        ).use_messages():
+        if not self.channel_use_messages.get(
+            self.get_base_channel(message.channel).id, False
+        ):
             return
 
         if not await self.config.member(message.author).use_messages():
@@ -62,7 +277,26 @@ class Markov(commands.Cog):
         if message.author.id == self.bot.user.id:
             return
 
-        await self.process_message(message.content, message.guild.id, message.author.id)
+        self.last_active_at = time.monotonic()
+        self.ingestion_queue.put(message.content, message.guild.id, message.author.id)
+
+    async def ingest_messages(self):
+        while True:
+            await self.process_queued_message(await self.ingestion_queue.get())
+
+    async def drain_ingestion_queue(self):
+        while self.ingestion_queue.depth:
+            await self.process_queued_message(await self.ingestion_queue.get())
+
+    async def process_queued_message(self, item):
+        try:
+            async with self.processing_lock:
+                await self.process_message(*item)
+        except Exception:
+            _content, guild_id, member_id = item
+            self.logger.exception(
+                f"Failed to process a message from {member_id} in {guild_id}."
+            )
 
     async def process_message(self, content: str, guild_id: int, member_id: int):
         # Normalize
@@ -103,18 +337,56 @@ class Markov(commands.Cog):
         if len(tokens) <= 2:
             return
 
+        compact_member_data = await self.config.guild_from_id(
+            guild_id
+        ).compact_member_data()
+        chain_snapshot = await self.config.guild_from_id(guild_id).chain_snapshot()
+        approximate_model = None
+        if await self.config.guild_from_id(guild_id).approximate_mode():
+            approximate_model = await self.get_approximate_model(guild_id)
+
+        if approximate_model is not None:
+            for first_token, second_token in zip(tokens, tokens[1:]):
+                approximate_model.add(first_token, second_token)
+            self.unsaved_approximate_models.add(guild_id)
+        message = [
+            guild_id,
+            member_id,
+            tokens,
+            approximate_model is None,
+            chain_snapshot,
+            compact_member_data,
+        ]
+        if self.writer_client is not None:
+            await self.writer_client.add(message)
+        else:
+            await self.write_message(*message)
+        self.pairs_processed[guild_id] += len(tokens) - 1
+
+    async def write_message(
+        self,
+        guild_id: int,
+        member_id: int,
+        tokens: list[str],
+        write_guild_pairs: bool,
+        chain_snapshot: bool,
+        compact_member_data: bool,
+    ):
         async with aiosqlite.connect(self.db_path) as db:
+            if compact_member_data:
+                token_ids = await self.get_token_ids(db, tokens)
             for i in range(len(tokens) - 1):
                 first_token = tokens[i]
                 second_token = tokens[i + 1]
 
-                await db.execute(
-                    "INSERT INTO guild_pairs(guild_id, first_token, second_token, frequency)"
-                    " VALUES (?, ?, ?, 1)"
-                    " ON CONFLICT(guild_id, first_token, second_token)"
-                    " DO UPDATE SET frequency = frequency + 1;",
-                    (self.uint_to_bytes(guild_id), first_token, second_token),
-                )
+                if write_guild_pairs:
+                    await db.execute(
+                        "INSERT INTO guild_pairs(guild_id, first_token, second_token, frequency)"
+                        " VALUES (?, ?, ?, 1)"
+                        " ON CONFLICT(guild_id, first_token, second_token)"
+                        " DO UPDATE SET frequency = frequency + 1;",
+                        (self.uint_to_bytes(guild_id), first_token, second_token),
+                    )
                 await db.execute(
                     "INSERT INTO guild_total_completion_count(guild_id, first_token, total_completion_count)"
                     " VALUES(?, ?, 1)"
@@ -122,32 +394,107 @@ class Markov(commands.Cog):
                     " DO UPDATE SET total_completion_count = total_completion_count + 1;",
                     (self.uint_to_bytes(guild_id), first_token),
                 )
+                if chain_snapshot:
+                    await db.execute(
+                        "INSERT INTO guild_pair_deltas(guild_id, first_token, second_token)"
+                        " VALUES (?, ?, ?);",
+                        (self.uint_to_bytes(guild_id), first_token, second_token),
+                    )
 
-                await db.execute(
-                    "INSERT INTO member_pairs(guild_id, member_id, first_token, second_token, frequency)"
-                    " VALUES (?, ?, ?, ?, 1)"
-                    " ON CONFLICT(guild_id, member_id, first_token, second_token)"
-                    " DO UPDATE SET frequency = frequency + 1;",
-                    (
-                        self.uint_to_bytes(guild_id),
-                        self.uint_to_bytes(member_id),
-                        first_token,
-                        second_token,
-                    ),
-                )
-                await db.execute(
-                    "INSERT INTO member_total_completion_count(guild_id, member_id, first_token, total_completion_count)"
-                    " VALUES(?, ?, ?, 1)"
-                    " ON CONFLICT(guild_id, member_id, first_token)"
-                    " DO UPDATE SET total_completion_count = total_completion_count + 1;",
-                    (
-                        self.uint_to_bytes(guild_id),
-                        self.uint_to_bytes(member_id),
-                        first_token,
-                    ),
-                )
+                if compact_member_data:
+                    await db.execute(
+                        "INSERT INTO member_contributions(guild_id, member_id, first_token_id, second_token_id, frequency)"
+                        " VALUES (?, ?, ?, ?, 1)"
+                        " ON CONFLICT(guild_id, member_id, first_token_id, second_token_id)"
+                        " DO UPDATE SET frequency = frequency + 1;",
+                        (
+                            self.uint_to_bytes(guild_id),
+                            self.uint_to_bytes(member_id),
+                            token_ids[first_token],
+                            token_ids[second_token],
+                        ),
+                    )
+                else:
+                    await db.execute(
+                        "INSERT INTO member_pairs(guild_id, member_id, first_token, second_token, frequency)"
+                        " VALUES (?, ?, ?, ?, 1)"
+                        " ON CONFLICT(guild_id, member_id, first_token, second_token)"
+                        " DO UPDATE SET frequency = frequency + 1;",
+                        (
+                            self.uint_to_bytes(guild_id),
+                            self.uint_to_bytes(member_id),
+                            first_token,
+                            second_token,
+                        ),
+                    )
+                    await db.execute(
+                        "INSERT INTO member_total_completion_count(guild_id, member_id, first_token, total_completion_count)"
+                        " VALUES(?, ?, ?, 1)"
+                        " ON CONFLICT(guild_id, member_id, first_token)"
+                        " DO UPDATE SET total_completion_count = total_completion_count + 1;",
+                        (
+                            self.uint_to_bytes(guild_id),
+                            self.uint_to_bytes(member_id),
+                            first_token,
+                        ),
+                    )
 
-                await db.commit()
+            # Commit the whole message at once, so generation never sees a pair whose
+            # second token has no completions yet.
+            await db.commit()
+
+        if compact_member_data:
+            self.cache_token_ids(token_ids)
+            self.member_models.invalidate((guild_id, member_id))
+
+    def on_writes_applied(self, messages: list):
+        for guild_id, member_id, _, _, _, compact_member_data in messages:
+            if compact_member_data:
+                self.member_models.invalidate((guild_id, member_id))
+
+    async def get_token_ids(
+        self, db: aiosqlite.Connection, tokens: list[str]
+    ) -> dict[str, int]:
+        """
+        Return token -> id in the tokens table, inserting the tokens that aren't there
+        yet. New ids only count once the transaction is committed, so they should be
+        passed to cache_token_ids() after that.
+        """
+        token_ids = {}
+        missing_tokens = []
+        for token in set(tokens):
+            try:
+                token_ids[token] = self.token_ids[token]
+            except KeyError:
+                missing_tokens.append(token)
+        if missing_tokens:
+            await db.executemany(
+                "INSERT OR IGNORE INTO tokens(token) VALUES (?);",
+                ((token,) for token in missing_tokens),
+            )
+            rows = await db.execute_fetchall(
+                TOKEN_IDS_QUERY.format(", ".join("?" * len(missing_tokens))),
+                missing_tokens,
+            )
+            token_ids.update(rows)
+        return token_ids
+
+    def cache_token_ids(self, token_ids: dict[str, int]):
+        if len(self.token_ids) + len(token_ids) > MAX_CACHED_TOKEN_IDS:
+            self.token_ids.clear()
+        self.token_ids.update(token_ids)
+
+    async def get_member_model(self, guild_id: int, member_id: int) -> ChainModel:
+        model = self.member_models.get((guild_id, member_id))
+        if model is None:
+            async with aiosqlite.connect(self.db_path) as db:
+                rows = await db.execute_fetchall(
+                    MEMBER_MODEL_QUERY,
+                    (self.uint_to_bytes(guild_id), self.uint_to_bytes(member_id)),
+                )
+            model = ChainModel(rows)
+            self.member_models.put((guild_id, member_id), model)
+        return model
 
     def uint_to_bytes(self, x: int):
         if x < 0:
@@ -188,6 +535,9 @@ class Markov(commands.Cog):
         Opt out of processing your messages to build Markov chains.
         """
         await self.config.member(ctx.author).use_messages.set(False)
+        self.ingestion_queue.discard(ctx.guild.id, ctx.author.id)
+        self.sentence_pool.invalidate_guild(ctx.guild.id, ctx.author.id)
+        self.invalidate_guild_analytics(ctx.guild.id)
         await ctx.reply(
             "Words in your messages will no longer be processed by the markov cog.\n"
             f"You can use `{ctx.clean_prefix}markov optin` to opt back in."
@@ -199,6 +549,7 @@ class Markov(commands.Cog):
         Opt in to processing your messages to build Markov chains. (This is the default.)
         """
         await self.config.member(ctx.author).use_messages.set(True)
+        self.invalidate_guild_analytics(ctx.guild.id)
         await ctx.reply(
             "Words in your messages will now be processed by the markov cog.\n"
             f"You can use `{ctx.clean_prefix}markov optout` to opt out."
@@ -211,32 +562,91 @@ class Markov(commands.Cog):
         Enable/disable processing in this channel (must be enabled for the guild
         using toggle_guild as well).
         """
-        channel_conf = self.config.channel(self.get_base_channel(ctx.channel))
-        new_state = not (await channel_conf.use_messages())
-        await channel_conf.use_messages.set(new_state)
+        channel = self.get_base_channel(ctx.channel)
+        new_state = not self.channel_use_messages.get(channel.id, False)
+        await self.set_channels_use_messages(ctx.guild, [channel], new_state)
         await ctx.reply(
             f"This channel will be {'processed' if new_state else 'ignored'} by the markov cog."
         )
 
+    async def set_channels_use_messages(
+        self, guild: discord.Guild, channels, use_messages: bool
+    ):
+        """
+        Set use_messages for many of a guild's channels with a single Config write.
+        """
+        await self.update_channel_use_messages(
+            guild, {channel.id: use_messages for channel in channels}
+        )
+
+    async def update_channel_use_messages(
+        self, guild: discord.Guild, updates: dict[int, bool], overwrite: bool = True
+    ):
+        """
+        Apply channel id -> use_messages updates to a guild's channel_use_messages,
+        then refresh self.channel_use_messages from it. With overwrite False, channels
+        that already have a value are left alone.
+        """
+        async with self.config.guild(
+            guild
+        ).channel_use_messages() as channel_use_messages:
+            for channel_id, use_messages in updates.items():
+                if overwrite:
+                    channel_use_messages[str(channel_id)] = use_messages
+                else:
+                    channel_use_messages.setdefault(str(channel_id), use_messages)
+        self.channel_use_messages.update(
+            (int(channel_id), use_messages)
+            for channel_id, use_messages in channel_use_messages.items()
+        )
+
+    async def migrate_channel_use_messages(self, legacy_channel_data: dict):
+        """
+        Move use_messages from the channel scope, where it used to be kept, into each
+        channel's guild. Channels that can't be found are left for the next load.
+        """
+        await self.bot.wait_until_red_ready()
+        guild_updates = collections.defaultdict(dict)
+        for channel_id, channel_data in legacy_channel_data.items():
+            channel = self.bot.get_channel(channel_id)
+            if channel is not None:
+                guild_updates[channel.guild][channel_id] = channel_data["use_messages"]
+        for guild, updates in guild_updates.items():
+            # Values set since the cog loaded are newer than the migrated ones
+            await self.update_channel_use_messages(guild, updates, overwrite=False)
+        migrated_channel_count = sum(len(updates) for updates in guild_updates.values())
+        if migrated_channel_count == len(legacy_channel_data):
+            await self.config.clear_all_channels()
+        else:
+            for updates in guild_updates.values():
+                for channel_id in updates:
+                    await self.config.channel_from_id(channel_id).clear()
+        self.logger.info(
+            f"Migrated use_messages for {migrated_channel_count} of"
+            f" {len(legacy_channel_data)} channels to the guild scope."
+        )
+
     @markov.command()
-    @commands.admin_or_permissions(manage_server=True)
+    @commands.admin_or_permissions(manage_guild=True)
     async def enable_all_channels(self, ctx):
         """
         Enable processing in all channels. You can disable the undesired ones individually.
         The default for a new channel will remain disabled.
         """
-        for channel in await ctx.guild.fetch_channels():
-            await self.config.channel(channel).use_messages.set(True)
+        await self.set_channels_use_messages(
+            ctx.guild, await self.resolver.channels(ctx.guild), True
+        )
         await ctx.reply("Enabled markov processing in all existing channels.")
 
     @markov.command()
-    @commands.admin_or_permissions(manage_server=True)
+    @commands.admin_or_permissions(manage_guild=True)
     async def disable_all_channels(self, ctx):
         """
         Disable processing in all channels. You can enable the desired ones individually.
         """
-        for channel in await ctx.guild.fetch_channels():
-            await self.config.channel(channel).use_messages.set(False)
+        await self.set_channels_use_messages(
+            ctx.guild, await self.resolver.channels(ctx.guild), False
+        )
         await ctx.reply("Disabled markov processing in all existing channels.")
 
     @markov.command()
@@ -249,10 +659,93 @@ class Markov(commands.Cog):
         guild_conf = self.config.guild(ctx.guild)
         new_state = not (await guild_conf.use_messages())
         await guild_conf.use_messages.set(new_state)
+        if not new_state:
+            self.ingestion_queue.discard(ctx.guild.id)
+            self.sentence_pool.invalidate_guild(ctx.guild.id)
         await ctx.reply(
             f"The markov cog is now {'enabled' if new_state else 'disabled'} in this guild."
         )
 
+    @markov.command()
+    @commands.admin_or_permissions(manage_guild=True)
+    async def toggle_compact_member_data(self, ctx):
+        """
+        Switch how per-member data is stored in this guild.
+
+        Compact mode stores much less per message and builds a member's chain only when
+        it's used with `markov generate`, at the cost of a slower first generation for
+        each member. Existing member data is converted when switching.
+        """
+        guild_conf = self.config.guild(ctx.guild)
+        new_state = not await guild_conf.compact_member_data()
+        guild_id_bytes = self.uint_to_bytes(ctx.guild.id)
+        async with ctx.typing(), self.processing_lock:
+            await self.wait_for_writes()
+            async with aiosqlite.connect(self.db_path) as db:
+                if new_state:
+                    await db.execute(
+                        "INSERT OR IGNORE INTO tokens(token)"
+                        " SELECT first_token FROM member_pairs WHERE guild_id = ?"
+                        " UNION SELECT second_token FROM member_pairs WHERE guild_id = ?;",
+                        (guild_id_bytes, guild_id_bytes),
+                    )
+                    await db.execute(
+                        "INSERT INTO member_contributions(guild_id, member_id, first_token_id, second_token_id, frequency)"
+                        " SELECT member_pairs.guild_id, member_pairs.member_id, first.id, second.id, member_pairs.frequency"
+                        " FROM member_pairs"
+                        " JOIN tokens AS first ON first.token = member_pairs.first_token"
+                        " JOIN tokens AS second ON second.token = member_pairs.second_token"
+                        " WHERE member_pairs.guild_id = ?"
+                        " ON CONFLICT(guild_id, member_id, first_token_id, second_token_id)"
+                        " DO UPDATE SET frequency = frequency + excluded.frequency;",
+                        (guild_id_bytes,),
+                    )
+                    await db.execute(
+                        "DELETE FROM member_total_completion_count WHERE guild_id = ?;",
+                        (guild_id_bytes,),
+                    )
+                    await db.execute(
+                        "DELETE FROM member_pairs WHERE guild_id = ?;",
+                        (guild_id_bytes,),
+                    )
+                else:
+                    await db.execute(
+                        "INSERT INTO member_pairs(guild_id, member_id, first_token, second_token, frequency)"
+                        " SELECT member_contributions.guild_id, member_contributions.member_id, first.token, second.token, member_contributions.frequency"
+                        " FROM member_contributions"
+                        " JOIN tokens AS first ON first.id = member_contributions.first_token_id"
+                        " JOIN tokens AS second ON second.id = member_contributions.second_token_id"
+                        " WHERE member_contributions.guild_id = ?"
+                        " ON CONFLICT(guild_id, member_id, first_token, second_token)"
+                        " DO UPDATE SET frequency = frequency + excluded.frequency;",
+                        (guild_id_bytes,),
+                    )
+                    await db.execute(
+                        "INSERT INTO member_total_completion_count(guild_id, member_id, first_token, total_completion_count)"
+                        " SELECT member_contributions.guild_id, member_contributions.member_id, first.token, SUM(member_contributions.frequency)"
+                        " FROM member_contributions"
+                        " JOIN tokens AS first ON first.id = member_contributions.first_token_id"
+                        " WHERE member_contributions.guild_id = ?"
+                        " GROUP BY member_contributions.member_id, member_contributions.first_token_id"
+                        " ON CONFLICT(guild_id, member_id, first_token)"
+                        " DO UPDATE SET total_completion_count = total_completion_count + excluded.total_completion_count;",
+                        (guild_id_bytes,),
+                    )
+                    await db.execute(
+                        "DELETE FROM member_contributions WHERE guild_id = ?;",
+                        (guild_id_bytes,),
+                    )
+                # Commit the conversion together with the new setting so that messages
+                # processed in between aren't written in the old format.
+                await guild_conf.compact_member_data.set(new_state)
+                await db.commit()
+        self.member_models.invalidate_where(lambda key: key[0] == ctx.guild.id)
+        self.invalidate_guild_analytics(ctx.guild.id)
+        self.sentence_pool.invalidate_guild(ctx.guild.id)
+        await ctx.reply(
+            f"Compact member data is now {'enabled' if new_state else 'disabled'} in this guild."
+        )
+
     async def exclusion_get_config_value(self, ctx, exclusion_type: ExclusionType):
         config_value = None
         match exclusion_type:
@@ -381,25 +874,42 @@ class Markov(commands.Cog):
                 " if you are sure."
             )
             return
-        guild_id_bytes = self.uint_to_bytes(ctx.guild.id)
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute(
-                "DELETE FROM guild_total_completion_count WHERE guild_id = ?;",
-                (guild_id_bytes,),
-            )
-            await db.execute(
-                "DELETE FROM guild_pairs WHERE guild_id = ?;",
-                (guild_id_bytes,),
-            )
-            await db.execute(
-                "DELETE FROM member_total_completion_count WHERE guild_id = ?;",
-                (guild_id_bytes,),
-            )
-            await db.execute(
-                "DELETE FROM member_pairs WHERE guild_id = ?;",
-                (guild_id_bytes,),
-            )
-            await db.commit()
+        # Held throughout, so that no message is processed halfway through deleting
+        async with ctx.typing(), self.processing_lock:
+            self.ingestion_queue.discard(ctx.guild.id)
+            await self.wait_for_writes()
+            guild_id_bytes = self.uint_to_bytes(ctx.guild.id)
+            async with aiosqlite.connect(self.db_path) as db:
+                await db.execute(
+                    "DELETE FROM guild_total_completion_count WHERE guild_id = ?;",
+                    (guild_id_bytes,),
+                )
+                await db.execute(
+                    "DELETE FROM guild_pairs WHERE guild_id = ?;",
+                    (guild_id_bytes,),
+                )
+                await db.execute(
+                    "DELETE FROM member_total_completion_count WHERE guild_id = ?;",
+                    (guild_id_bytes,),
+                )
+                await db.execute(
+                    "DELETE FROM member_pairs WHERE guild_id = ?;",
+                    (guild_id_bytes,),
+                )
+                await db.execute(
+                    "DELETE FROM member_contributions WHERE guild_id = ?;",
+                    (guild_id_bytes,),
+                )
+                await db.execute(
+                    "DELETE FROM guild_pair_deltas WHERE guild_id = ?;",
+                    (guild_id_bytes,),
+                )
+                await db.commit()
+            await self.delete_chain_snapshot(ctx.guild.id)
+            await self.delete_approximate_model(ctx.guild.id)
+            self.member_models.invalidate_where(lambda key: key[0] == ctx.guild.id)
+            self.invalidate_guild_analytics(ctx.guild.id)
+            self.sentence_pool.invalidate_guild(ctx.guild.id)
         await ctx.reply("All markov data for this guild has been deleted.")
 
     @markov.command()
@@ -412,106 +922,625 @@ class Markov(commands.Cog):
                 await ctx.reply("That member has opted out of markov generation.")
                 return
 
-        async def get_total_completion_count(
-            db: aiosqlite.Connection,
-            guild_id: int,
-            member_id: int | None,
-            first_token: str,
+        member_id = member.id if member else None
+        self.last_active_at = time.monotonic()
+        result = None
+        if await self.config.guild(ctx.guild).sentence_pool():
+            result = self.sentence_pool.pop(
+                (ctx.guild.id, member_id),
+                self.pairs_processed[ctx.guild.id],
+                time.monotonic(),
+            )
+        if result is None:
+            try:
+                result = await self.generate_sentence(ctx.guild.id, member_id)
+            except NoTotalCompletionCountError as e:
+                if e.token != "":
+                    raise
+                await ctx.reply(
+                    f"Error: no data for this {'member' if member else 'guild'} yet!"
+                )
+                return
+        text, stop_reason, loop_detected = result
+
+        self.generation_stop_reasons[stop_reason] += 1
+        if loop_detected:
+            self.generation_loops_detected += 1
+        await ctx.send(text, allowed_mentions=discord.AllowedMentions.none())
+
+    async def generate_sentence(
+        self, guild_id: int, member_id: int | None
+    ) -> tuple[str, StopReason, bool]:
+        deadline = time.monotonic() + GENERATION_TIMEOUT_SECS
+        if (
+            member_id
+            and await self.config.guild_from_id(guild_id).compact_member_data()
         ):
-            if not member_id:
-                row = await (
-                    await db.execute(
-                        "SELECT total_completion_count FROM guild_total_completion_count"
-                        " WHERE guild_id = ? AND first_token = ?;",
-                        (self.uint_to_bytes(guild_id), first_token),
-                    )
-                ).fetchone()
-            else:
-                row = await (
-                    await db.execute(
-                        "SELECT total_completion_count FROM member_total_completion_count"
-                        " WHERE guild_id = ? AND member_id = ? AND first_token = ?;",
-                        (
-                            self.uint_to_bytes(guild_id),
-                            self.uint_to_bytes(member_id),
-                            first_token,
-                        ),
-                    )
-                ).fetchone()
-            return row[0] if row else None
-
-        async def get_possible_next_token(
-            db: aiosqlite.Connection,
-            guild_id: int,
-            member_id: int | None,
-            first_token: str,
-            offset: int,
+            model = await self.get_member_model(guild_id, member_id)
+            return generate_text(
+                ModelTokenSource(model, guild_id, member_id),
+                self.append_token,
+                deadline,
+                MAX_GENERATED_TOKENS,
+                MAX_GENERATED_LENGTH,
+            )
+        if (
+            not member_id
+            and await self.config.guild_from_id(guild_id).approximate_mode()
         ):
-            if not member_id:
-                row = await (
-                    await db.execute(
-                        "SELECT second_token, frequency FROM guild_pairs"
-                        " WHERE guild_id = ? AND first_token = ?"
-                        " ORDER BY frequency DESC LIMIT 1 OFFSET ?;",
-                        (self.uint_to_bytes(guild_id), first_token, offset),
-                    )
-                ).fetchone()
+            return generate_text(
+                ApproximateTokenSource(
+                    await self.get_approximate_model(guild_id), guild_id
+                ),
+                self.append_token,
+                deadline,
+                MAX_GENERATED_TOKENS,
+                MAX_GENERATED_LENGTH,
+            )
+        snapshot = await self.get_chain_snapshot(guild_id) if not member_id else None
+        if snapshot is not None:
+            async with aiosqlite.connect(self.db_path) as db:
+                delta_rows = await db.execute_fetchall(
+                    CHAIN_SNAPSHOT_DELTAS_QUERY,
+                    (self.uint_to_bytes(guild_id), snapshot.delta_watermark),
+                )
+            return generate_text(
+                SnapshotTokenSource(snapshot, ChainModel(delta_rows), guild_id),
+                self.append_token,
+                deadline,
+                MAX_GENERATED_TOKENS,
+                MAX_GENERATED_LENGTH,
+            )
+        return await asyncio.to_thread(
+            self.generate_from_database, guild_id, member_id, deadline
+        )
+
+    def generate_from_database(
+        self, guild_id: int, member_id: int | None, deadline: float
+    ) -> tuple[str, StopReason, bool]:
+        with contextlib.closing(sqlite3.connect(self.db_path)) as db:
+            return generate_text(
+                DatabaseTokenSource(
+                    db,
+                    guild_id,
+                    self.uint_to_bytes(guild_id),
+                    member_id,
+                    self.uint_to_bytes(member_id) if member_id else None,
+                ),
+                self.append_token,
+                deadline,
+                MAX_GENERATED_TOKENS,
+                MAX_GENERATED_LENGTH,
+            )
+
+    @markov.command()
+    @commands.is_owner()
+    async def generation_stats(self, ctx):
+        """
+        Show why generated messages have stopped since the cog was loaded.
+        """
+        text = "\n".join(
+            f"{stop_reason.name.lower()}: {self.generation_stop_reasons[stop_reason]}"
+            for stop_reason in StopReason
+        )
+        text += f"\nloops detected: {self.generation_loops_detected}"
+        text += "\n" + self.sentence_pool.stats_text()
+        await ctx.reply(redbot.core.utils.chat_formatting.box(text))
+
+    @markov.command()
+    @commands.is_owner()
+    async def query_plans(self, ctx):
+        """
+        Check that the queries run while processing and generating use the intended indexes.
+        """
+        async with aiosqlite.connect(self.db_path) as db:
+            results = await check_query_plans(db)
+        text = "\n".join(
+            f"{description}: {'ok' if problem is None else problem}\n"
+            + "\n".join(f"  {step}" for step in plan)
+            for description, plan, problem in results
+        )
+        pages = [
+            redbot.core.utils.chat_formatting.box(page)
+            for page in redbot.core.utils.chat_formatting.pagify(text, page_length=1900)
+        ]
+        await redbot.core.utils.menus.menu(ctx, pages)
+
+    @markov.command()
+    @commands.is_owner()
+    async def ingestion_stats(self, ctx):
+        """
+        Show how many messages are waiting to be processed and how many have been dropped.
+        """
+        text = self.ingestion_queue.stats_text()
+        if self.writer_client is not None:
+            text += "\n" + self.writer_client.stats_text()
+        await ctx.reply(redbot.core.utils.chat_formatting.box(text))
+
+    @markov.command()
+    @commands.is_owner()
+    async def ingestion_limit(self, ctx, high_water_mark: int):
+        """
+        Set how many messages can be waiting to be processed before some are dropped.
+
+        Past half of this, messages repeating one seen in the same guild in the last
+        minute are dropped. Past all of it, each guild keeps a random sample of its
+        new messages in place of the rest.
+        """
+        if high_water_mark < 1:
+            await ctx.reply("Error: the limit must be at least 1.")
+            return
+        await self.config.ingestion_high_water_mark.set(high_water_mark)
+        self.ingestion_queue.high_water_mark = high_water_mark
+        await ctx.reply(
+            f"Up to {high_water_mark} messages can now be waiting to be processed."
+        )
+
+    async def start_writer_client(self):
+        async with aiosqlite.connect(self.db_path) as db:
+            last_applied_batch = (
+                await db.execute_fetchall(
+                    "SELECT last_applied_batch FROM writer_state;"
+                )
+            )[0][0]
+        writer_client = WriterClient(
+            self.db_path, self.writer_journal_path, self.logger, self.on_writes_applied
+        )
+        await writer_client.start(last_applied_batch)
+        self.writer_client = writer_client
+
+    async def wait_for_writes(self):
+        """
+        Wait until every processed message is in the database.
+        """
+        if self.writer_client is not None:
+            await self.writer_client.wait_until_applied()
+
+    @markov.command()
+    @commands.is_owner()
+    async def toggle_writer_process(self, ctx):
+        """
+        Enable/disable writing processed messages to the database from a separate process.
+
+        With this on, messages are still parsed by the bot, but are written in large
+        batches by a helper process, which keeps the work of writing them from holding
+        up the bot. Batches waiting to be written are kept in a journal file, so they
+        are written even if the bot stops first.
+        """
+        new_state = not await self.config.writer_process()
+        async with self.processing_lock:
+            if new_state:
+                await self.start_writer_client()
             else:
-                row = await (
-                    await db.execute(
-                        "SELECT second_token, frequency FROM member_pairs"
-                        " WHERE guild_id = ? AND member_id = ? AND first_token = ?"
-                        " ORDER BY frequency DESC LIMIT 1 OFFSET ?;",
-                        (
-                            self.uint_to_bytes(guild_id),
-                            self.uint_to_bytes(member_id),
-                            first_token,
-                            offset,
-                        ),
+                writer_client, self.writer_client = self.writer_client, None
+                # Writes are made in-process from here on, so nothing may be left in
+                # the journal to be applied after them
+                await writer_client.stop(apply_leftovers=True)
+            await self.config.writer_process.set(new_state)
+        await ctx.reply(
+            f"The writer process is now {'enabled' if new_state else 'disabled'}."
+        )
+
+    @markov.command()
+    @commands.admin_or_permissions(manage_guild=True)
+    async def toggle_sentence_pool(self, ctx):
+        """
+        Enable/disable pre-generating sentences for this guild in the background.
+
+        With this on, `markov generate` can usually reply straight away with a sentence
+        generated while the bot was idle. Sentences are kept for the guild and for
+        frequently requested members, and are thrown away as new messages come in.
+        """
+        guild_conf = self.config.guild(ctx.guild)
+        new_state = not await guild_conf.sentence_pool()
+        await guild_conf.sentence_pool.set(new_state)
+        if not new_state:
+            self.sentence_pool.invalidate_guild(ctx.guild.id)
+        await ctx.reply(
+            f"Pre-generating sentences is now {'enabled' if new_state else 'disabled'} in this guild."
+        )
+
+    @tasks.loop(seconds=SENTENCE_POOL_REFILL_INTERVAL_SECS)
+    async def refill_sentence_pools(self):
+        sentences_pooled = 0
+        for key, deficit in self.sentence_pool.get_deficits(time.monotonic()):
+            guild_id, member_id = key
+            # The same checks as generate, since these can change after a request
+            guild_conf = self.config.guild_from_id(guild_id)
+            if not (
+                await guild_conf.use_messages() and await guild_conf.sentence_pool()
+            ):
+                self.sentence_pool.invalidate_guild(guild_id)
+                continue
+            if (
+                member_id is not None
+                and not await self.config.member_from_ids(
+                    guild_id, member_id
+                ).use_messages()
+            ):
+                self.sentence_pool.invalidate_guild(guild_id, member_id)
+                continue
+            for _ in range(deficit):
+                if (
+                    sentences_pooled >= MAX_SENTENCES_POOLED_PER_REFILL
+                    or time.monotonic() - self.last_active_at < SENTENCE_POOL_IDLE_SECS
+                ):
+                    return
+                epoch = self.sentence_pool.guild_epochs[guild_id]
+                pairs_processed = self.pairs_processed[guild_id]
+                start_time = time.perf_counter()
+                try:
+                    result = await self.generate_sentence(guild_id, member_id)
+                except NoTotalCompletionCountError:
+                    break
+                except Exception:
+                    self.logger.exception(
+                        f"Failed to pre-generate a sentence for {key}."
                     )
-                ).fetchone()
-            if not row:
-                return None, None
-            next_token, frequency = row
-            return next_token, frequency
+                    break
+                finally:
+                    self.sentence_pool.refill_secs += time.perf_counter() - start_time
+                self.sentence_pool.add(
+                    key, result, epoch, pairs_processed, time.monotonic()
+                )
+                sentences_pooled += 1
 
-        member_id = member.id if member else None
-        result = ""
-        token = ""
-        async with aiosqlite.connect(self.db_path) as db:
-            while True:
-                completion_count = await get_total_completion_count(
-                    db, ctx.guild.id, member_id, token
+    def get_chain_snapshot_path(self, guild_id: int) -> pathlib.Path:
+        return self.snapshots_path / f"{guild_id}.snapshot"
+
+    async def get_chain_snapshot(self, guild_id: int) -> ChainSnapshot | None:
+        if not await self.config.guild_from_id(guild_id).chain_snapshot():
+            return None
+        path = self.get_chain_snapshot_path(guild_id)
+        try:
+            inode = (await asyncio.to_thread(path.stat)).st_ino
+        except FileNotFoundError:
+            self.chain_snapshots.pop(guild_id, None)
+            return None
+        snapshot = self.chain_snapshots.get(guild_id)
+        # The file is replaced rather than changed when it's rebuilt, possibly by
+        # another process, so a new inode means there's a new snapshot.
+        if snapshot is None or snapshot.inode != inode:
+            snapshot = await asyncio.to_thread(ChainSnapshot, path)
+            self.chain_snapshots[guild_id] = snapshot
+        return snapshot
+
+    async def delete_chain_snapshot(self, guild_id: int):
+        async with self.chain_snapshot_locks[guild_id]:
+            self.chain_snapshots.pop(guild_id, None)
+            await asyncio.to_thread(
+                self.get_chain_snapshot_path(guild_id).unlink, missing_ok=True
+            )
+
+    @markov.command()
+    @commands.admin_or_permissions(manage_guild=True)
+    async def toggle_chain_snapshot(self, ctx):
+        """
+        Enable/disable generating this guild's sentences from a compiled snapshot.
+
+        This makes generation much faster for guilds with a lot of data. The snapshot
+        is rebuilt in the background as new messages come in; until then, recent
+        messages are still used from the database.
+        """
+        guild_conf = self.config.guild(ctx.guild)
+        new_state = not await guild_conf.chain_snapshot()
+        if new_state and await guild_conf.approximate_mode():
+            await ctx.reply(
+                "Error: chain snapshots can't be used together with approximate mode."
+            )
+            return
+        await guild_conf.chain_snapshot.set(new_state)
+        if new_state:
+            async with ctx.typing():
+                await self.build_chain_snapshot(ctx.guild.id)
+        else:
+            async with aiosqlite.connect(self.db_path) as db:
+                await db.execute(
+                    "DELETE FROM guild_pair_deltas WHERE guild_id = ?;",
+                    (self.uint_to_bytes(ctx.guild.id),),
                 )
-                if completion_count is None:
-                    if token == "":
-                        await ctx.reply(
-                            f"Error: no data for this {'member' if member else 'guild'} yet!"
+                await db.commit()
+            await self.delete_chain_snapshot(ctx.guild.id)
+        await ctx.reply(
+            f"Chain snapshots are now {'enabled' if new_state else 'disabled'} in this guild."
+        )
+
+    async def build_chain_snapshot(self, guild_id: int):
+        start_time = time.perf_counter()
+        async with self.chain_snapshot_locks[guild_id]:
+            await asyncio.to_thread(
+                build_snapshot,
+                self.db_path,
+                self.uint_to_bytes(guild_id),
+                self.get_chain_snapshot_path(guild_id),
+            )
+        self.logger.info(
+            f"Built chain snapshot for guild {guild_id} in {time.perf_counter() - start_time:.3f} seconds."
+        )
+
+    @tasks.loop(seconds=CHAIN_SNAPSHOT_CHECK_INTERVAL_SECS)
+    async def rebuild_chain_snapshots(self):
+        for guild_id, guild_data in (await self.config.all_guilds()).items():
+            if not guild_data["chain_snapshot"]:
+                continue
+            snapshot = await self.get_chain_snapshot(guild_id)
+            async with aiosqlite.connect(self.db_path) as db:
+                delta_count = (
+                    await (
+                        await db.execute(
+                            "SELECT COUNT(*) FROM guild_pair_deltas"
+                            " WHERE guild_id = ? AND id > ?;",
+                            (
+                                self.uint_to_bytes(guild_id),
+                                snapshot.delta_watermark if snapshot else 0,
+                            ),
                         )
-                        return
-                    raise NoTotalCompletionCountError(ctx.guild.id, member_id, token)
-                next_token = None
-                for i in range(MAX_TOKEN_GENERATION_ITERATIONS):
-                    next_token, frequency = await get_possible_next_token(
-                        db, ctx.guild.id, member_id, token, i
+                    ).fetchone()
+                )[0]
+            if snapshot is None or delta_count >= CHAIN_SNAPSHOT_REBUILD_AFTER_DELTAS:
+                try:
+                    await self.build_chain_snapshot(guild_id)
+                except Exception:
+                    self.logger.exception(
+                        f"Failed to build chain snapshot for guild {guild_id}."
                     )
-                    if next_token is None:
-                        raise NoNextTokenError(ctx.guild.id, member_id, token, i)
-                    if random.randint(1, completion_count) <= frequency:
-                        result = self.append_token(result, next_token)
-                        token = next_token
-                        break
-
-                    completion_count -= frequency
-                    if completion_count <= 0:
-                        raise InvalidCompletionCountError(
-                            ctx.guild.id, member_id, token, i
+
+    def get_approximate_model_path(self, guild_id: int) -> pathlib.Path:
+        return self.approximate_models_path / f"{guild_id}.npz"
+
+    async def get_approximate_model(self, guild_id: int) -> ApproximateModel:
+        model = self.approximate_models.get(guild_id)
+        if model is None:
+            async with self.approximate_model_locks[guild_id]:
+                # Another call may have loaded it while we waited for the lock
+                model = self.approximate_models.get(guild_id)
+                if model is None:
+                    try:
+                        model = await asyncio.to_thread(
+                            ApproximateModel.load,
+                            self.get_approximate_model_path(guild_id),
                         )
-                else:
-                    # If we went through MAX_TOKEN_GENERATION_ITERATIONS completions
-                    # without selecting any, then just select the last one we considered
-                    # (round off the probability, effectively)
-                    token = next_token
-                if token == "":
-                    break
-        await ctx.send(result, allowed_mentions=discord.AllowedMentions.none())
+                    except FileNotFoundError:
+                        model = ApproximateModel(
+                            **await self.config.approximate_model_size()
+                        )
+                    self.approximate_models[guild_id] = model
+        return model
+
+    async def delete_approximate_model(self, guild_id: int):
+        async with self.approximate_model_locks[guild_id]:
+            self.approximate_models.pop(guild_id, None)
+            self.unsaved_approximate_models.discard(guild_id)
+            await asyncio.to_thread(
+                self.get_approximate_model_path(guild_id).unlink, missing_ok=True
+            )
+
+    async def save_approximate_models(self):
+        for guild_id in list(self.unsaved_approximate_models):
+            async with self.approximate_model_locks[guild_id]:
+                # Looked up under the lock, so a model deleted in the meantime is skipped
+                model = self.approximate_models.get(guild_id)
+                self.unsaved_approximate_models.discard(guild_id)
+                if model is None:
+                    continue
+                try:
+                    # Saved from a copy, since the model keeps changing on the event loop
+                    await asyncio.to_thread(
+                        model.copy().save, self.get_approximate_model_path(guild_id)
+                    )
+                except Exception:
+                    self.unsaved_approximate_models.add(guild_id)
+                    self.logger.exception(
+                        f"Failed to save the approximate model for guild {guild_id}."
+                    )
+
+    @tasks.loop(seconds=APPROXIMATE_MODEL_CHECKPOINT_INTERVAL_SECS)
+    async def checkpoint_approximate_models(self):
+        await self.save_approximate_models()
+
+    @markov.command()
+    @commands.admin_or_permissions(manage_guild=True)
+    async def toggle_approximate_mode(self, ctx):
+        """
+        Enable/disable keeping only approximate counts of this guild's pairs.
+
+        This is meant for very large guilds. Instead of storing every pair, the bot keeps
+        the most frequent completions of the most frequent words in a model of fixed
+        size, and generates from those. Per-member data is unaffected. While this is on,
+        `markov top` can't list bigrams for the guild. Turning it off writes the kept
+        completions back to the database; the rest are lost.
+        """
+        guild_conf = self.config.guild(ctx.guild)
+        new_state = not await guild_conf.approximate_mode()
+        if new_state and await guild_conf.chain_snapshot():
+            await ctx.reply(
+                "Error: approximate mode can't be used together with chain snapshots."
+            )
+            return
+        guild_id_bytes = self.uint_to_bytes(ctx.guild.id)
+        async with ctx.typing(), self.processing_lock:
+            await self.wait_for_writes()
+            if new_state:
+                model = ApproximateModel(**await self.config.approximate_model_size())
+                await asyncio.to_thread(
+                    seed_approximate_model, self.db_path, guild_id_bytes, model
+                )
+                async with self.approximate_model_locks[ctx.guild.id]:
+                    await asyncio.to_thread(
+                        model.save, self.get_approximate_model_path(ctx.guild.id)
+                    )
+                    self.approximate_models[ctx.guild.id] = model
+                await guild_conf.approximate_mode.set(True)
+                async with aiosqlite.connect(self.db_path) as db:
+                    await db.execute(
+                        "DELETE FROM guild_pairs WHERE guild_id = ?;",
+                        (guild_id_bytes,),
+                    )
+                    await db.commit()
+            else:
+                await asyncio.to_thread(
+                    write_approximate_model,
+                    self.db_path,
+                    guild_id_bytes,
+                    await self.get_approximate_model(ctx.guild.id),
+                )
+                await guild_conf.approximate_mode.set(False)
+                await self.delete_approximate_model(ctx.guild.id)
+        self.invalidate_guild_analytics(ctx.guild.id)
+        self.sentence_pool.invalidate_guild(ctx.guild.id)
+        await ctx.reply(
+            f"Approximate mode is now {'enabled' if new_state else 'disabled'} in this guild."
+        )
+
+    @markov.command()
+    @commands.is_owner()
+    async def approximate_model_size(
+        self,
+        ctx,
+        sketch_width: int,
+        sketch_depth: int,
+        max_first_tokens: int,
+        completions_per_token: int,
+    ):
+        """
+        Set the size of the models used by guilds in approximate mode.
+
+        A pair's count can be overestimated by about 2.7 / sketch_width of all the
+        guild's pairs, except with probability e^-sketch_depth. Only the
+        completions_per_token most frequent completions of the max_first_tokens most
+        frequent words are kept. This applies to models created after it's set.
+        """
+        if min(sketch_width, sketch_depth, max_first_tokens, completions_per_token) < 1:
+            await ctx.reply("Error: every size must be at least 1.")
+            return
+        await self.config.approximate_model_size.set(
+            {
+                "sketch_width": sketch_width,
+                "sketch_depth": sketch_depth,
+                "max_first_tokens": max_first_tokens,
+                "completions_per_token": completions_per_token,
+            }
+        )
+        megabytes = (
+            8 * sketch_width * sketch_depth
+            + 100 * max_first_tokens * completions_per_token
+        ) / 1_000_000
+        await ctx.reply(
+            f"New approximate models will take about {megabytes:.1f} MB each."
+        )
+
+    def invalidate_guild_analytics(self, guild_id: int):
+        self.guild_analytics.pop(guild_id, None)
+        self.guild_analytics_invalidations[guild_id] += 1
+
+    async def get_guild_analytics(self, guild_id: int) -> GuildAnalytics:
+        try:
+            analytics, pairs_processed_at_build = self.guild_analytics[guild_id]
+        except KeyError:
+            pass
+        else:
+            stale_after = max(
+                ANALYTICS_STALE_AFTER_PAIRS,
+                analytics.total_token_count * ANALYTICS_STALE_AFTER_FRACTION,
+            )
+            if self.pairs_processed[guild_id] - pairs_processed_at_build < stale_after:
+                return analytics
+
+        while True:
+            invalidations = self.guild_analytics_invalidations[guild_id]
+            pairs_processed_at_build = self.pairs_processed[guild_id]
+            # Opted-out members are left out of the per-member statistics
+            excluded_member_ids = {
+                member_id
+                for member_id, member_data in (
+                    await self.config.all_members(discord.Object(guild_id))
+                ).items()
+                if not member_data["use_messages"]
+            }
+            analytics = await asyncio.to_thread(
+                GuildAnalytics.load,
+                self.db_path,
+                self.uint_to_bytes(guild_id),
+                await self.config.guild_from_id(guild_id).compact_member_data(),
+                excluded_member_ids,
+            )
+            # Rebuild if a member opted out or data was deleted while these were built
+            if self.guild_analytics_invalidations[guild_id] == invalidations:
+                break
+        self.guild_analytics[guild_id] = (analytics, pairs_processed_at_build)
+        return analytics
+
+    @markov.command()
+    async def top(self, ctx, count: int = 10):
+        """
+        Show the most common words and phrases in this guild.
+        """
+        if not await self.config.guild(ctx.guild).use_messages():
+            await ctx.reply("Not enabled in this guild.")
+            return
+        count = max(1, min(count, MAX_TOP_RESULTS))
+        async with ctx.typing():
+            analytics = await self.get_guild_analytics(ctx.guild.id)
+        if not analytics.total_token_count:
+            await ctx.reply("Error: no data for this guild yet!")
+            return
+
+        text = "Top words:\n"
+        for i, (token, token_count) in enumerate(analytics.top_tokens(count)):
+            text += f"{i + 1}. {token} ({token_count})\n"
+        text += "\nTop phrases:\n"
+        for i, (first_token, second_token, frequency) in enumerate(
+            analytics.top_bigrams[:count]
+        ):
+            text += f"{i + 1}. {first_token} {second_token} ({frequency})\n"
+        text += (
+            f"\n{analytics.total_token_count} words, {len(analytics.tokens)} distinct."
+            f" Entropy: {analytics.entropy_bits():.2f} bits per word."
+        )
+        pages = list(
+            redbot.core.utils.chat_formatting.pagify(
+                discord.utils.escape_markdown(discord.utils.escape_mentions(text))
+            )
+        )
+        await redbot.core.utils.menus.menu(ctx, pages)
+
+    @markov.command()
+    async def similar(self, ctx, member: discord.Member | None, count: int = 5):
+        """
+        Show the members whose word usage is most similar to a member's (or your own).
+        """
+        if not await self.config.guild(ctx.guild).use_messages():
+            await ctx.reply("Not enabled in this guild.")
+            return
+        member = member or ctx.author
+        if not await self.config.member(member).use_messages():
+            await ctx.reply("That member has opted out of markov generation.")
+            return
+        count = max(1, min(count, MAX_TOP_RESULTS))
+        async with ctx.typing():
+            analytics = await self.get_guild_analytics(ctx.guild.id)
+        similar_members = analytics.similar_members(member.id, count)
+        if similar_members is None:
+            await ctx.reply("Error: no data for this member yet!")
+            return
+        if not similar_members:
+            await ctx.reply("No similar members found.")
+            return
+
+        text = ""
+        for i, (similar_member_id, similarity) in enumerate(similar_members):
+            similar_member = ctx.guild.get_member(similar_member_id)
+            name = (
+                similar_member.display_name
+                if similar_member is not None
+                else str(similar_member_id)
+            )
+            text += f"{i + 1}. {name} ({similarity:.3f})\n"
+        await ctx.reply(
+            discord.utils.escape_markdown(
+                discord.utils.escape_mentions(
+                    f"Members who talk like {member.display_name}:\n" + text
+                )
+            ),
+            allowed_mentions=discord.AllowedMentions.none(),
+        )
@@ -0,0 +1,53 @@
+"""
+The queries that run once per token or per message, or that read a whole guild.
+They're kept here so that query_plans.py checks exactly the text that's run.
+"""
+
+GUILD_TOTAL_COMPLETION_COUNT_QUERY = (
+    "SELECT total_completion_count FROM guild_total_completion_count"
+    " WHERE guild_id = ? AND first_token = ?;"
+)
+MEMBER_TOTAL_COMPLETION_COUNT_QUERY = (
+    "SELECT total_completion_count FROM member_total_completion_count"
+    " WHERE guild_id = ? AND member_id = ? AND first_token = ?;"
+)
+GUILD_COMPLETION_BY_FREQUENCY_QUERY = (
+    "SELECT second_token, frequency FROM guild_pairs"
+    " WHERE guild_id = ? AND first_token = ?"
+    " ORDER BY frequency DESC LIMIT 1 OFFSET ?;"
+)
+MEMBER_COMPLETION_BY_FREQUENCY_QUERY = (
+    "SELECT second_token, frequency FROM member_pairs"
+    " WHERE guild_id = ? AND member_id = ? AND first_token = ?"
+    " ORDER BY frequency DESC LIMIT 1 OFFSET ?;"
+)
+GUILD_CAN_END_QUERY = (
+    "SELECT 1 FROM guild_pairs"
+    " WHERE guild_id = ? AND first_token = ? AND second_token = '';"
+)
+MEMBER_CAN_END_QUERY = (
+    "SELECT 1 FROM member_pairs"
+    " WHERE guild_id = ? AND member_id = ? AND first_token = ? AND second_token = '';"
+)
+# Formatted with one placeholder per token
+TOKEN_IDS_QUERY = "SELECT token, id FROM tokens WHERE token IN ({});"
+MEMBER_MODEL_QUERY = (
+    "SELECT first.token, second.token, member_contributions.frequency"
+    " FROM member_contributions"
+    " JOIN tokens AS first ON first.id = member_contributions.first_token_id"
+    " JOIN tokens AS second ON second.id = member_contributions.second_token_id"
+    " WHERE member_contributions.guild_id = ? AND member_contributions.member_id = ?;"
+)
+GUILD_ANALYTICS_PAIRS_QUERY = (
+    "SELECT first_token, second_token, frequency FROM guild_pairs"
+    " WHERE guild_id = ? AND first_token != '' AND second_token != '';"
+)
+# Text compares by code point, which matches sorting by UTF-8 bytes
+CHAIN_SNAPSHOT_PAIRS_QUERY = (
+    "SELECT first_token, second_token, frequency FROM guild_pairs"
+    " WHERE guild_id = ? ORDER BY first_token, second_token;"
+)
+CHAIN_SNAPSHOT_DELTAS_QUERY = (
+    "SELECT first_token, second_token, COUNT(*) FROM guild_pair_deltas"
+    " WHERE guild_id = ? AND id > ? GROUP BY first_token, second_token;"
+)
@@ -0,0 +1,71 @@
+import aiosqlite
+from .queries import *
+
+# (description, query, text its plan should contain) for each query in queries.py.
+# The text is usually the index the query should be answered with.
+HOT_QUERIES = [
+    (
+        "guild total completion count",
+        GUILD_TOTAL_COMPLETION_COUNT_QUERY,
+        "PRIMARY KEY",
+    ),
+    (
+        "member total completion count",
+        MEMBER_TOTAL_COMPLETION_COUNT_QUERY,
+        "PRIMARY KEY",
+    ),
+    (
+        "guild completions by frequency",
+        GUILD_COMPLETION_BY_FREQUENCY_QUERY,
+        "idx_guild_pairs__guild_id__first_token__frequency",
+    ),
+    (
+        "member completions by frequency",
+        MEMBER_COMPLETION_BY_FREQUENCY_QUERY,
+        "idx_member_pairs__guild_id__member_id__first_token__frequency",
+    ),
+    ("guild can end", GUILD_CAN_END_QUERY, "PRIMARY KEY"),
+    ("member can end", MEMBER_CAN_END_QUERY, "PRIMARY KEY"),
+    ("token ids", TOKEN_IDS_QUERY.format("?, ?"), "sqlite_autoindex_tokens_1"),
+    ("member model", MEMBER_MODEL_QUERY, "PRIMARY KEY"),
+    (
+        "guild analytics pairs",
+        GUILD_ANALYTICS_PAIRS_QUERY,
+        # Either index will do, as long as only the guild's rows are read
+        "(guild_id=?)",
+    ),
+    ("chain snapshot pairs", CHAIN_SNAPSHOT_PAIRS_QUERY, "PRIMARY KEY"),
+    (
+        "chain snapshot deltas",
+        CHAIN_SNAPSHOT_DELTAS_QUERY,
+        "idx_guild_pair_deltas__guild_id__id",
+    ),
+]
+
+
+async def check_query_plans(
+    db: aiosqlite.Connection,
+) -> list[tuple[str, list[str], str | None]]:
+    """
+    Return (description, query plan, problem or None) for each of HOT_QUERIES. A
+    query has a problem if it scans a whole table, sorts its results in a temporary
+    B-tree, or its plan doesn't contain the expected text.
+    """
+    results = []
+    for description, query, expected in HOT_QUERIES:
+        plan = [
+            row[3]
+            for row in await db.execute_fetchall(
+                f"EXPLAIN QUERY PLAN {query}", (None,) * query.count("?")
+            )
+        ]
+        problem = None
+        for step in plan:
+            if step.startswith("SCAN "):
+                problem = f"table scan: {step}"
+            elif step == "USE TEMP B-TREE FOR ORDER BY":
+                problem = "sorts in a temporary B-tree"
+        if problem is None and not any(expected in step for step in plan):
+            problem = f"expected {expected}"
+        results.append((description, plan, problem))
+    return results
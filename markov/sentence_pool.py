@@ -0,0 +1,129 @@
+import collections
+import math
+
+# How often each guild and member is requested is tracked as a count that decays
+# exponentially with this time constant, and pools are sized to that count.
+REQUEST_RATE_WINDOW_SECS = 600
+MAX_POOL_SIZE = 20
+# Members only get a pool once they're requested about this often within the window;
+# guilds get one as soon as they're requested.
+MIN_MEMBER_REQUESTS_TO_POOL = 3
+# Keys requested less than this within the window are forgotten along with their pool
+MIN_TRACKED_REQUESTS = 0.1
+MAX_POOLED_SENTENCE_AGE_SECS = 60 * 60
+# A pooled sentence is discarded once this many pairs have been added to its guild
+# since it was generated.
+POOLED_SENTENCE_STALE_AFTER_PAIRS = 500
+
+
+class SentencePool:
+    """
+    Pre-generated sentences for each (guild id, member id or None) key, so that
+    frequently requested sentences can be served without waiting for generation.
+
+    Times are from time.monotonic(). Each pooled sentence is kept with the value of
+    the guild's pairs-processed counter when it was generated, so it can be aged
+    out as new data arrives.
+    """
+
+    def __init__(self):
+        # key -> deque of (sentence, generated at, pairs processed at generation)
+        self.pools = collections.defaultdict(collections.deque)
+        # key -> (decayed request count, time of last update)
+        self.request_counts = {}
+        # guild id -> number of times the guild's pools have been invalidated, so
+        # sentences generated before an invalidation aren't added after it
+        self.guild_epochs = collections.Counter()
+        self.hits = 0
+        self.misses = 0
+        self.discarded = 0
+        self.refilled = 0
+        self.refill_secs = 0.0
+
+    def get_request_count(self, key, now: float) -> float:
+        try:
+            request_count, updated_at = self.request_counts[key]
+        except KeyError:
+            return 0.0
+        return request_count * math.exp(-(now - updated_at) / REQUEST_RATE_WINDOW_SECS)
+
+    def target_size(self, key, now: float) -> int:
+        request_count = self.get_request_count(key, now)
+        _guild_id, member_id = key
+        if member_id is not None and request_count < MIN_MEMBER_REQUESTS_TO_POOL:
+            return 0
+        return min(math.ceil(request_count), MAX_POOL_SIZE)
+
+    def pop(self, key, pairs_processed: int, now: float):
+        """
+        Record a request for key and return a pooled (sentence, stop reason, loop
+        detected) result for it, or None if there isn't a fresh one.
+        """
+        self.request_counts[key] = (self.get_request_count(key, now) + 1, now)
+        pool = self.pools.get(key)
+        while pool:
+            result, generated_at, pairs_processed_at_generation = pool.popleft()
+            if (
+                now - generated_at <= MAX_POOLED_SENTENCE_AGE_SECS
+                and pairs_processed - pairs_processed_at_generation
+                <= POOLED_SENTENCE_STALE_AFTER_PAIRS
+            ):
+                self.hits += 1
+                return result
+            self.discarded += 1
+        self.misses += 1
+        return None
+
+    def add(self, key, result, epoch: int, pairs_processed: int, now: float):
+        guild_id, _member_id = key
+        if epoch != self.guild_epochs[guild_id]:
+            return
+        self.pools[key].append((result, now, pairs_processed))
+        self.refilled += 1
+
+    def get_deficits(self, now: float) -> list[tuple[tuple, int]]:
+        """
+        Return (key, number of sentences missing) for each pool that's below its
+        target size, largest deficit first. Keys that are no longer being requested
+        are forgotten.
+        """
+        deficits = []
+        for key in [*self.request_counts]:
+            if self.get_request_count(key, now) < MIN_TRACKED_REQUESTS:
+                del self.request_counts[key]
+                self.pools.pop(key, None)
+                continue
+            deficit = self.target_size(key, now) - len(self.pools.get(key, ()))
+            if deficit > 0:
+                deficits.append((key, deficit))
+        deficits.sort(key=lambda key_and_deficit: key_and_deficit[1], reverse=True)
+        return deficits
+
+    def invalidate_guild(self, guild_id: int, member_id: int | None = None):
+        """
+        Drop the pooled sentences and request counts for a guild, or only for one
+        member in it, so that its pools aren't refilled until it's requested again.
+        """
+        self.guild_epochs[guild_id] += 1
+        for key in [*self.request_counts]:
+            if key[0] == guild_id and (member_id is None or key[1] == member_id):
+                del self.request_counts[key]
+        for key in [*self.pools]:
+            if key[0] == guild_id and (member_id is None or key[1] == member_id):
+                self.discarded += len(self.pools.pop(key))
+
+    def stats_text(self) -> str:
+        requests = self.hits + self.misses
+        hit_rate = f"{self.hits / requests:.1%}" if requests else "n/a"
+        mean_refill_ms = (
+            f"{self.refill_secs / self.refilled * 1000:.1f} ms"
+            if self.refilled
+            else "n/a"
+        )
+        return (
+            f"sentence pool hits: {self.hits}, misses: {self.misses} (hit rate {hit_rate})\n"
+            f"sentences pre-generated: {self.refilled} (mean cost {mean_refill_ms}),"
+            f" discarded: {self.discarded}\n"
+            f"sentences pooled: {sum(len(pool) for pool in self.pools.values())}"
+            f" across {len(self.pools)} pools"
+        )
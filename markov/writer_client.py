@@ -0,0 +1,226 @@
+import asyncio
+import json
+import logging
+import pathlib
+import sys
+import typing
+
+WRITER_PROCESS_PATH = pathlib.Path(__file__).with_name("writer_process.py")
+# Messages are sent to the writer in batches of up to this many, or of whatever has
+# been added in this long.
+MAX_BATCH_SIZE = 500
+BATCH_INTERVAL_SECS = 0.5
+# How long stop() waits for the writer to apply what it's been sent
+STOP_TIMEOUT_SECS = 10
+# How long to wait before restarting a writer that exited unexpectedly
+RESTART_DELAY_SECS = 1
+
+
+class WriterClient:
+    """
+    Sends tokenized messages to a writer process (see writer_process.py) in batches
+    and tracks which batches it has applied.
+
+    Each batch is appended to a journal before it's sent, and the journal is emptied
+    whenever everything in it has been applied. A writer applies what's in the
+    journal when it starts, so nothing is lost if the bot or the writer stops first.
+    on_applied is called with each batch's messages once they're in the database.
+    """
+
+    def __init__(
+        self,
+        db_path: pathlib.Path,
+        journal_path: pathlib.Path,
+        logger: logging.Logger,
+        on_applied: typing.Callable[[list], None],
+    ):
+        self.db_path = db_path
+        self.journal_path = journal_path
+        self.logger = logger
+        self.on_applied = on_applied
+        self.pending = []
+        self.next_sequence_number = None
+        # sequence number -> messages, for batches sent but not applied yet
+        self.unapplied = {}
+        self.applied = asyncio.Event()
+        # Held while appending to or emptying the journal and while starting the writer,
+        # so that batches go in the journal in order and every batch the writer doesn't
+        # find in the journal is sent to it.
+        self.journal_lock = asyncio.Lock()
+        self.process = None
+        self.reader_task = None
+        self.flusher_task = None
+        self.stopping = False
+        self.batches_applied = 0
+        self.messages_applied = 0
+        self.restarts = 0
+
+    async def start(self, last_applied_batch: int):
+        """
+        Start the writer. last_applied_batch is writer_state.last_applied_batch.
+        """
+        self.unapplied = await asyncio.to_thread(self.read_journal, last_applied_batch)
+        self.next_sequence_number = max([last_applied_batch, *self.unapplied]) + 1
+        async with self.journal_lock:
+            await self.start_process()
+        self.flusher_task = asyncio.create_task(self.flush_periodically())
+
+    async def stop(self, apply_leftovers: bool = False):
+        """
+        Send what's pending, then wait for the writer to apply everything and exit.
+
+        If the writer has to be killed or has exited, whatever it didn't apply is left
+        in the journal for the next writer to apply when it starts. With
+        apply_leftovers, a writer is instead run straight away to apply it, for when
+        writes are about to go back to being made in-process and the journal would
+        otherwise be replayed after them.
+        """
+        self.stopping = True
+        self.flusher_task.cancel()
+        await self.flush()
+        # Taken so that a writer being restarted has finished starting before its
+        # stdin is closed
+        async with self.journal_lock:
+            self.process.stdin.close()
+        try:
+            await asyncio.wait_for(self.process.wait(), STOP_TIMEOUT_SECS)
+        except asyncio.TimeoutError:
+            self.process.kill()
+        await self.reader_task
+        if not self.unapplied:
+            return
+        if apply_leftovers:
+            await self.apply_journal()
+        else:
+            self.logger.warning(
+                f"Stopped the writer process with {len(self.unapplied)} batches"
+                " unapplied; they'll be applied when it's next started."
+            )
+
+    async def apply_journal(self):
+        """
+        Run a writer with nothing to send it, so that it applies the journal and exits.
+        If it fails, the journal is discarded rather than kept to be applied out of
+        order later.
+        """
+        async with self.journal_lock:
+            await self.start_process(stdin=asyncio.subprocess.DEVNULL)
+        await self.reader_task
+        if self.unapplied:
+            self.logger.error(
+                f"Failed to apply {len(self.unapplied)} batches left in the writer"
+                " journal; discarding them."
+            )
+            self.unapplied.clear()
+            async with self.journal_lock:
+                await asyncio.to_thread(self.empty_journal)
+
+    def read_journal(self, last_applied_batch: int) -> dict[int, list]:
+        """
+        Return sequence number -> messages for the unapplied batches in the journal.
+        """
+        unapplied = {}
+        try:
+            with open(self.journal_path, encoding="utf-8") as journal:
+                for line in journal:
+                    try:
+                        sequence_number, messages = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    if sequence_number > last_applied_batch:
+                        unapplied[sequence_number] = messages
+        except FileNotFoundError:
+            pass
+        return unapplied
+
+    def append_to_journal(self, line: str):
+        with open(self.journal_path, "a", encoding="utf-8") as journal:
+            journal.write(line)
+
+    def empty_journal(self):
+        with open(self.journal_path, "w", encoding="utf-8"):
+            pass
+
+    async def start_process(self, stdin: int = asyncio.subprocess.PIPE):
+        self.process = await asyncio.create_subprocess_exec(
+            sys.executable,
+            str(WRITER_PROCESS_PATH),
+            str(self.db_path),
+            str(self.journal_path),
+            stdin=stdin,
+            stdout=asyncio.subprocess.PIPE,
+        )
+        self.reader_task = asyncio.create_task(self.read_acknowledgements(self.process))
+
+    async def read_acknowledgements(self, process: asyncio.subprocess.Process):
+        async for line in process.stdout:
+            messages = self.unapplied.pop(int(line), None)
+            if messages is not None:
+                self.batches_applied += 1
+                self.messages_applied += len(messages)
+                self.on_applied(messages)
+            self.applied.set()
+            if not self.unapplied:
+                async with self.journal_lock:
+                    if not self.unapplied:
+                        await asyncio.to_thread(self.empty_journal)
+        return_code = await process.wait()
+        if self.stopping:
+            return
+        self.logger.error(
+            f"The writer process exited with code {return_code}; restarting it."
+        )
+        self.restarts += 1
+        await asyncio.sleep(RESTART_DELAY_SECS)
+        async with self.journal_lock:
+            # stop() may have been called in the meantime
+            if self.stopping:
+                return
+            await self.start_process()
+
+    async def add(self, message: list):
+        self.pending.append(message)
+        if len(self.pending) >= MAX_BATCH_SIZE:
+            await self.flush()
+        else:
+            # Nothing else here waits, so without this a backlog of messages would be
+            # processed without letting anything else run.
+            await asyncio.sleep(0)
+
+    async def flush_periodically(self):
+        while True:
+            await asyncio.sleep(BATCH_INTERVAL_SECS)
+            await self.flush()
+
+    async def flush(self):
+        if not self.pending:
+            return
+        messages, self.pending = self.pending, []
+        async with self.journal_lock:
+            sequence_number = self.next_sequence_number
+            self.next_sequence_number += 1
+            line = json.dumps([sequence_number, messages]) + "\n"
+            self.unapplied[sequence_number] = messages
+            await asyncio.to_thread(self.append_to_journal, line)
+            try:
+                self.process.stdin.write(line.encode("utf-8"))
+                await self.process.stdin.drain()
+            except ConnectionError:
+                # The writer exited; the next one will apply this from the journal
+                pass
+
+    async def wait_until_applied(self):
+        """
+        Send what's pending and wait for the writer to apply everything sent so far.
+        """
+        await self.flush()
+        while self.unapplied:
+            self.applied.clear()
+            await self.applied.wait()
+
+    def stats_text(self) -> str:
+        return (
+            f"writer process: pid {self.process.pid}, restarts: {self.restarts}\n"
+            f"batches applied: {self.batches_applied} ({self.messages_applied} messages),"
+            f" unapplied: {len(self.unapplied)}, messages pending: {len(self.pending)}"
+        )
@@ -0,0 +1,203 @@
+"""
+Applies the markov cog's database writes in a separate process, so that they don't
+compete with the bot for the GIL. WriterClient in writer_client.py is the other end.
+
+Usage: python writer_process.py DB_PATH JOURNAL_PATH
+
+Batches are read from stdin, one JSON array per line: [sequence number, messages],
+where each message is [guild id, member id, tokens, write guild pairs, write chain
+snapshot deltas, compact member data]. Each batch is applied in one transaction that
+also records its sequence number in writer_state, so a batch is applied once however
+many times it's sent. The sequence number is then written to stdout. On start, the
+batches in the journal are applied first.
+
+This is run as a script rather than imported, so it can't import anything from the
+cog.
+"""
+
+import collections
+import contextlib
+import json
+import sqlite3
+import sys
+
+# Large batches can wait this long for generation and maintenance to release the
+# database.
+BUSY_TIMEOUT_SECS = 30
+# Tokens are looked up in chunks of this many, staying well under SQLite's limit on
+# the number of parameters.
+TOKEN_LOOKUP_CHUNK_SIZE = 500
+MAX_CACHED_TOKEN_IDS = 100_000
+
+
+def uint_to_bytes(x: int) -> bytes:
+    byte_length, remainder = divmod(x.bit_length(), 8)
+    if remainder:
+        byte_length += 1
+    return x.to_bytes(byte_length, byteorder="big", signed=False)
+
+
+class Writer:
+    def __init__(self, db: sqlite3.Connection):
+        self.db = db
+        self.last_applied_batch = db.execute(
+            "SELECT last_applied_batch FROM writer_state;"
+        ).fetchone()[0]
+        # token -> id in the tokens table; ids never change once assigned
+        self.token_ids = {}
+
+    def apply_batch(self, sequence_number: int, messages: list):
+        if sequence_number <= self.last_applied_batch:
+            return
+        # Counts are summed over the batch first, so each distinct row is written once
+        guild_pairs = collections.Counter()
+        guild_totals = collections.Counter()
+        guild_pair_deltas = []
+        member_pairs = collections.Counter()
+        member_totals = collections.Counter()
+        member_contributions = collections.Counter()
+        for (
+            guild_id,
+            member_id,
+            tokens,
+            write_guild_pairs,
+            chain_snapshot,
+            compact_member_data,
+        ) in messages:
+            guild_id_bytes = uint_to_bytes(guild_id)
+            member_id_bytes = uint_to_bytes(member_id)
+            for first_token, second_token in zip(tokens, tokens[1:]):
+                if write_guild_pairs:
+                    guild_pairs[guild_id_bytes, first_token, second_token] += 1
+                guild_totals[guild_id_bytes, first_token] += 1
+                if chain_snapshot:
+                    guild_pair_deltas.append(
+                        (guild_id_bytes, first_token, second_token)
+                    )
+                if compact_member_data:
+                    member_contributions[
+                        guild_id_bytes, member_id_bytes, first_token, second_token
+                    ] += 1
+                else:
+                    member_pairs[
+                        guild_id_bytes, member_id_bytes, first_token, second_token
+                    ] += 1
+                    member_totals[guild_id_bytes, member_id_bytes, first_token] += 1
+
+        with self.db:
+            self.db.executemany(
+                "INSERT INTO guild_pairs(guild_id, first_token, second_token, frequency)"
+                " VALUES (?, ?, ?, ?)"
+                " ON CONFLICT(guild_id, first_token, second_token)"
+                " DO UPDATE SET frequency = frequency + excluded.frequency;",
+                ((*key, count) for key, count in guild_pairs.items()),
+            )
+            self.db.executemany(
+                "INSERT INTO guild_total_completion_count(guild_id, first_token, total_completion_count)"
+                " VALUES (?, ?, ?)"
+                " ON CONFLICT(guild_id, first_token)"
+                " DO UPDATE SET total_completion_count = total_completion_count + excluded.total_completion_count;",
+                ((*key, count) for key, count in guild_totals.items()),
+            )
+            self.db.executemany(
+                "INSERT INTO guild_pair_deltas(guild_id, first_token, second_token)"
+                " VALUES (?, ?, ?);",
+                guild_pair_deltas,
+            )
+            self.db.executemany(
+                "INSERT INTO member_pairs(guild_id, member_id, first_token, second_token, frequency)"
+                " VALUES (?, ?, ?, ?, ?)"
+                " ON CONFLICT(guild_id, member_id, first_token, second_token)"
+                " DO UPDATE SET frequency = frequency + excluded.frequency;",
+                ((*key, count) for key, count in member_pairs.items()),
+            )
+            self.db.executemany(
+                "INSERT INTO member_total_completion_count(guild_id, member_id, first_token, total_completion_count)"
+                " VALUES (?, ?, ?, ?)"
+                " ON CONFLICT(guild_id, member_id, first_token)"
+                " DO UPDATE SET total_completion_count = total_completion_count + excluded.total_completion_count;",
+                ((*key, count) for key, count in member_totals.items()),
+            )
+            if member_contributions:
+                token_ids = self.get_token_ids(
+                    {key[2] for key in member_contributions}
+                    | {key[3] for key in member_contributions}
+                )
+                self.db.executemany(
+                    "INSERT INTO member_contributions(guild_id, member_id, first_token_id, second_token_id, frequency)"
+                    " VALUES (?, ?, ?, ?, ?)"
+                    " ON CONFLICT(guild_id, member_id, first_token_id, second_token_id)"
+                    " DO UPDATE SET frequency = frequency + excluded.frequency;",
+                    (
+                        (
+                            guild_id_bytes,
+                            member_id_bytes,
+                            token_ids[first_token],
+                            token_ids[second_token],
+                            count,
+                        )
+                        for (
+                            guild_id_bytes,
+                            member_id_bytes,
+                            first_token,
+                            second_token,
+                        ), count in member_contributions.items()
+                    ),
+                )
+            self.db.execute(
+                "UPDATE writer_state SET last_applied_batch = ?;", (sequence_number,)
+            )
+        self.last_applied_batch = sequence_number
+
+    def get_token_ids(self, tokens: set[str]) -> dict[str, int]:
+        token_ids = {}
+        missing_tokens = []
+        for token in tokens:
+            try:
+                token_ids[token] = self.token_ids[token]
+            except KeyError:
+                missing_tokens.append(token)
+        for i in range(0, len(missing_tokens), TOKEN_LOOKUP_CHUNK_SIZE):
+            chunk = missing_tokens[i : i + TOKEN_LOOKUP_CHUNK_SIZE]
+            self.db.executemany(
+                "INSERT OR IGNORE INTO tokens(token) VALUES (?);",
+                ((token,) for token in chunk),
+            )
+            rows = self.db.execute(
+                "SELECT token, id FROM tokens"
+                f" WHERE token IN ({', '.join('?' * len(chunk))});",
+                chunk,
+            ).fetchall()
+            token_ids.update(rows)
+            if len(self.token_ids) + len(rows) > MAX_CACHED_TOKEN_IDS:
+                self.token_ids.clear()
+            self.token_ids.update(rows)
+        return token_ids
+
+
+def apply_lines(writer: Writer, lines):
+    for line in lines:
+        try:
+            sequence_number, messages = json.loads(line)
+        except json.JSONDecodeError:
+            # A line cut off by the bot stopping while writing to the journal
+            print(f"Skipping malformed batch: {line[:100]!r}", file=sys.stderr)
+            continue
+        writer.apply_batch(sequence_number, messages)
+        print(sequence_number, flush=True)
+
+
+def main():
+    db_path, journal_path = sys.argv[1:]
+    with contextlib.closing(sqlite3.connect(db_path, timeout=BUSY_TIMEOUT_SECS)) as db:
+        writer = Writer(db)
+        try:
+            with open(journal_path, encoding="utf-8") as journal:
+                apply_lines(writer, journal)
+        except FileNotFoundError:
+            pass
+        apply_lines(writer, sys.stdin)
+
+
+if __name__ == "__main__":
+    main()
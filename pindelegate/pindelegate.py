@@ -2,6 +2,16 @@ import discord
 from redbot.core import Config
 from redbot.core import checks
 from redbot.core import commands
+import asyncio
+import collections
+import datetime
+
+MAX_MESSAGES_PER_BULK_OPERATION = 50
+# Pinning and unpinning share a per-channel rate limit, so there's no point sending
+# many requests at once.
+MAX_CONCURRENT_PIN_REQUESTS = 3
+# https://discord.com/developers/docs/topics/opcodes-and-status-codes#json
+MAXIMUM_PINS_REACHED_ERROR_CODE = 30003
 
 
 class PinDelegate(commands.Cog):
@@ -10,70 +20,318 @@ class PinDelegate(commands.Cog):
         self.config = Config.get_conf(
             self, identifier="551742410770612234|6772870d-1739-4ada-a2c5-1821b4f3a618"
         )
-        self.config.register_channel(pin_capable_members={})
+        # pin_capable_members maps str(member id) to True. The "channel" may also be a
+        # category or a thread. guild_id is None for delegations made before it was stored.
+        self.config.register_channel(
+            pin_capable_members={}, guild_id=None, pin_rotation=False
+        )
+
+        # In-memory copies of the above, so checking whether someone may pin doesn't
+        # need to touch Config.
+        # location (channel, category or thread) id -> ids of pin-capable members
+        self.pin_delegations = collections.defaultdict(set)
+        # member id -> ids of locations where they are pin-capable
+        self.member_pin_delegations = collections.defaultdict(set)
+        # location id -> guild id, where known
+        self.location_guilds = {}
+
+        # channel id -> {pinned message id: when it was pinned}
+        self.pin_times = {}
+        self.pin_request_semaphore = asyncio.Semaphore(MAX_CONCURRENT_PIN_REQUESTS)
+
+    async def cog_load(self):
+        for location_id, location_data in (await self.config.all_channels()).items():
+            for member_id in location_data["pin_capable_members"]:
+                self.add_to_index(location_id, int(member_id))
+            if location_data["guild_id"] is not None:
+                self.location_guilds[location_id] = location_data["guild_id"]
+
+    def add_to_index(self, location_id: int, member_id: int):
+        self.pin_delegations[location_id].add(member_id)
+        self.member_pin_delegations[member_id].add(location_id)
+
+    def remove_from_index(self, location_id: int, member_id: int):
+        self.pin_delegations[location_id].discard(member_id)
+        if not self.pin_delegations[location_id]:
+            del self.pin_delegations[location_id]
+        self.member_pin_delegations[member_id].discard(location_id)
+        if not self.member_pin_delegations[member_id]:
+            del self.member_pin_delegations[member_id]
 
     @commands.command()
     @checks.admin_or_permissions(administrator=True)
-    async def pindelegate(self, ctx, user: discord.Member):
+    async def pindelegate(
+        self,
+        ctx,
+        user: discord.Member,
+        location: discord.abc.GuildChannel | discord.Thread | None = None,
+    ):
         """
         Grant a user the ability to pin messages in this channel with the pin command.
+
+        Pass a channel, category or thread to delegate there instead. Delegating in a
+        channel also covers its threads, and delegating in a category covers all of
+        its channels.
         """
-        async with self.config.channel(
-            ctx.channel
-        ).pin_capable_members() as pin_capable_members:
-            pin_capable_members[user.id] = True
+        location = location or ctx.channel
+        location_conf = self.config.channel_from_id(location.id)
+        await location_conf.pin_capable_members.set_raw(str(user.id), value=True)
+        await location_conf.guild_id.set(ctx.guild.id)
+        self.add_to_index(location.id, user.id)
+        self.location_guilds[location.id] = ctx.guild.id
         await ctx.reply(
-            f"User {user.name} ({user.id}) is now pin-capable in this channel."
+            f"User {user.name} ({user.id}) is now pin-capable in {location.mention}."
         )
 
     @commands.command()
     @checks.admin_or_permissions(administrator=True)
-    async def pinundelegate(self, ctx, user: discord.Member):
-        """
-        Remove a user's ability to pin messages in this channel.
-        """
-        async with self.config.channel(
-            ctx.channel
-        ).pin_capable_members() as pin_capable_members:
-            try:
-                del pin_capable_members[str(user.id)]
-            except KeyError:
-                await ctx.reply(
-                    f"User {user.name} ({user.id}) was already not pin-capable in this channel."
-                )
-                return
+    async def pinundelegate(
+        self,
+        ctx,
+        user: discord.Member,
+        location: discord.abc.GuildChannel | discord.Thread | None = None,
+    ):
+        """
+        Remove a user's ability to pin messages in this channel (or the given channel,
+        category or thread).
+        """
+        location = location or ctx.channel
+        if user.id not in self.pin_delegations.get(location.id, ()):
+            await ctx.reply(
+                f"User {user.name} ({user.id}) was already not pin-capable in {location.mention}."
+            )
+            return
+        await self.config.channel_from_id(location.id).pin_capable_members.clear_raw(
+            str(user.id)
+        )
+        self.remove_from_index(location.id, user.id)
         await ctx.reply(
-            f"User {user.name} ({user.id}) removed from pin-capable users in this channel."
+            f"User {user.name} ({user.id}) removed from pin-capable users in {location.mention}."
+        )
+
+    def is_pin_capable(self, channel, member_id: int) -> bool:
+        location_ids = [channel.id]
+        if isinstance(channel, discord.Thread):
+            channel = channel.parent
+            if channel is not None:
+                location_ids.append(channel.id)
+        if channel is not None and channel.category_id is not None:
+            location_ids.append(channel.category_id)
+        return any(
+            member_id in self.pin_delegations.get(location_id, ())
+            for location_id in location_ids
         )
 
-    async def is_pin_capable(self, channel, member_id):
+    @commands.Cog.listener()
+    async def on_member_remove(self, member: discord.Member):
+        for location_id in [*self.member_pin_delegations.get(member.id, ())]:
+            guild_id = self.location_guilds.get(location_id)
+            if guild_id is None:
+                location = self.bot.get_channel(location_id)
+                guild_id = location.guild.id if location is not None else None
+            if guild_id != member.guild.id:
+                continue
+            await self.config.channel_from_id(
+                location_id
+            ).pin_capable_members.clear_raw(str(member.id))
+            self.remove_from_index(location_id, member.id)
+
+    @commands.Cog.listener()
+    async def on_guild_channel_pins_update(self, channel, _last_pin):
+        self.pin_times.pop(channel.id, None)
+
+    async def get_pin_times(self, channel) -> dict[int, datetime.datetime]:
         try:
-            await self.config.channel(channel).pin_capable_members.get_raw(
-                str(member_id)
-            )
+            return self.pin_times[channel.id]
         except KeyError:
-            return False
-        return True
+            pin_times = {
+                message.id: message.pinned_at
+                or discord.utils.snowflake_time(message.id)
+                async for message in channel.pins(limit=None)
+            }
+            self.pin_times[channel.id] = pin_times
+            return pin_times
+
+    async def pin_message_ids(
+        self, channel, message_ids: list[int], reason: str
+    ) -> tuple[int, int, int]:
+        """
+        Pin each message concurrently, rotating out the oldest pins if the channel
+        is full and pin rotation is enabled there.
+
+        Returns the number of messages pinned, the number that couldn't be pinned
+        and the number of old pins removed to make room.
+        """
+        pin_times = await self.get_pin_times(channel)
+        rotate = await self.config.channel(channel).pin_rotation()
+        rotated_out = 0
+
+        async def pin_one(message_id: int) -> bool:
+            nonlocal rotated_out
+            message = channel.get_partial_message(message_id)
+            async with self.pin_request_semaphore:
+                try:
+                    await message.pin(reason=reason)
+                except discord.HTTPException as e:
+                    if not (
+                        rotate
+                        and e.code == MAXIMUM_PINS_REACHED_ERROR_CODE
+                        and pin_times
+                    ):
+                        return False
+                    oldest_message_id = min(pin_times, key=pin_times.__getitem__)
+                    del pin_times[oldest_message_id]
+                    try:
+                        await channel.get_partial_message(oldest_message_id).unpin(
+                            reason="Making room for a new pin."
+                        )
+                        rotated_out += 1
+                        await message.pin(reason=reason)
+                    except discord.HTTPException:
+                        return False
+                pin_times[message_id] = discord.utils.utcnow()
+                return True
+
+        results = await asyncio.gather(
+            *(
+                pin_one(message_id)
+                for message_id in dict.fromkeys(message_ids)
+                if message_id not in pin_times
+            )
+        )
+        return results.count(True), results.count(False), rotated_out
+
+    async def unpin_message_ids(
+        self, channel, message_ids: list[int], reason: str
+    ) -> tuple[int, int]:
+        """
+        Unpin each message concurrently.
+
+        Returns the number of messages unpinned and the number that couldn't be.
+        """
+        pin_times = await self.get_pin_times(channel)
+
+        async def unpin_one(message_id: int) -> bool:
+            async with self.pin_request_semaphore:
+                try:
+                    await channel.get_partial_message(message_id).unpin(reason=reason)
+                except discord.HTTPException:
+                    return False
+            pin_times.pop(message_id, None)
+            return True
+
+        results = await asyncio.gather(
+            *(unpin_one(message_id) for message_id in dict.fromkeys(message_ids))
+        )
+        return results.count(True), results.count(False)
+
+    @commands.command()
+    @checks.admin_or_permissions(administrator=True)
+    async def pinrotation(self, ctx):
+        """
+        Toggle whether pinning in this channel unpins the oldest pin when the channel
+        has reached Discord's pin limit.
+        """
+        channel_conf = self.config.channel(ctx.channel)
+        new_state = not await channel_conf.pin_rotation()
+        await channel_conf.pin_rotation.set(new_state)
+        await ctx.reply(
+            "The oldest pin in this channel will be removed to make room for new ones."
+            if new_state
+            else "Pins in this channel will no longer be removed to make room."
+        )
 
     @commands.command()
-    async def pin(self, ctx):
+    async def pin(self, ctx, *message_ids: int):
         """
-        Pin the replied-to message.
+        Pin the replied-to message, or the messages in this channel with the given ids.
         """
-        if await self.is_pin_capable(ctx.channel, ctx.author.id):
-            await ctx.message.reference.resolved.pin(
-                reason=f"On behalf of {ctx.author.name}"
+        if not self.is_pin_capable(ctx.channel, ctx.author.id):
+            return
+        if not message_ids:
+            if ctx.message.reference is None:
+                await ctx.reply("Error: reply to a message or give message ids.")
+                return
+            message_ids = (ctx.message.reference.message_id,)
+        elif len(message_ids) > MAX_MESSAGES_PER_BULK_OPERATION:
+            await ctx.reply(
+                f"Error: at most {MAX_MESSAGES_PER_BULK_OPERATION} messages can be pinned at once."
             )
+            return
+
+        pinned, failed, rotated_out = await self.pin_message_ids(
+            ctx.channel, message_ids, f"On behalf of {ctx.author.name}"
+        )
+        if len(message_ids) == 1 and not failed and not rotated_out:
+            # Discord already announces the new pin.
+            return
+        summary = f"Pinned {pinned} message{'' if pinned == 1 else 's'}."
+        if rotated_out:
+            summary += f" Unpinned {rotated_out} old message{'' if rotated_out == 1 else 's'} to make room."
+        if failed:
+            summary += f" Failed to pin {failed} message{'' if failed == 1 else 's'}."
+        await ctx.reply(summary)
 
     @commands.command()
-    async def unpin(self, ctx):
+    async def unpin(self, ctx, *message_ids: int):
         """
-        Unpin the replied-to message.
+        Unpin the replied-to message, or the messages in this channel with the given ids.
         """
-        replied_to_message = ctx.message.reference.resolved
-        if await self.is_pin_capable(ctx.channel, ctx.author.id):
-            if replied_to_message.pinned:
-                await replied_to_message.unpin(reason=f"On behalf of {ctx.author.name}")
-                await ctx.reply("Unpinned message!")
-            else:
+        if not self.is_pin_capable(ctx.channel, ctx.author.id):
+            return
+        if not message_ids:
+            if ctx.message.reference is None:
+                await ctx.reply("Error: reply to a message or give message ids.")
+                return
+            replied_to_message_id = ctx.message.reference.message_id
+            if replied_to_message_id not in await self.get_pin_times(ctx.channel):
                 await ctx.reply("That message was already not pinned.")
+                return
+            message_ids = (replied_to_message_id,)
+        elif len(message_ids) > MAX_MESSAGES_PER_BULK_OPERATION:
+            await ctx.reply(
+                f"Error: at most {MAX_MESSAGES_PER_BULK_OPERATION} messages can be unpinned at once."
+            )
+            return
+
+        unpinned, failed = await self.unpin_message_ids(
+            ctx.channel, message_ids, f"On behalf of {ctx.author.name}"
+        )
+        await self.reply_with_unpin_summary(ctx, unpinned, failed)
+
+    @commands.command()
+    async def unpinolderthan(self, ctx, days: int):
+        """
+        Unpin every pinned message in this channel that was sent more than this many days ago.
+        """
+        if not self.is_pin_capable(ctx.channel, ctx.author.id):
+            return
+        if days < 0:
+            await ctx.reply("Error: the number of days can't be negative.")
+            return
+        try:
+            cutoff = discord.utils.utcnow() - datetime.timedelta(days=days)
+        except OverflowError:
+            # Further back than datetime goes, so before any message was sent
+            cutoff = datetime.datetime.min.replace(tzinfo=datetime.timezone.utc)
+        message_ids = [
+            message_id
+            for message_id in await self.get_pin_times(ctx.channel)
+            if discord.utils.snowflake_time(message_id) < cutoff
+        ]
+        if not message_ids:
+            await ctx.reply(f"No pinned messages are older than {days} days.")
+            return
+        unpinned, failed = await self.unpin_message_ids(
+            ctx.channel, message_ids, f"On behalf of {ctx.author.name}"
+        )
+        await self.reply_with_unpin_summary(ctx, unpinned, failed)
+
+    async def reply_with_unpin_summary(self, ctx, unpinned: int, failed: int):
+        if unpinned == 1 and not failed:
+            await ctx.reply("Unpinned message!")
+            return
+        summary = f"Unpinned {unpinned} message{'' if unpinned == 1 else 's'}."
+        if failed:
+            summary += f" Failed to unpin {failed} message{'' if failed == 1 else 's'}."
+        await ctx.reply(summary)
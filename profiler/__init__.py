@@ -0,0 +1,5 @@
+from .profiler import Profiler
+
+
+async def setup(bot):
+    await bot.add_cog(Profiler(bot))
@@ -0,0 +1,201 @@
+from discord.ext import tasks
+import redbot.core
+from redbot.core import commands
+import asyncio
+import collections
+import inspect
+import logging
+import os
+import statistics
+import threading
+import time
+from .sampler import StackSampler
+
+DEFAULT_PROFILE_SECS = 60
+MAX_PROFILE_SECS = 15 * 60
+SAMPLE_INTERVAL_SECS = 0.01
+LAG_CHECK_INTERVAL_SECS = 0.1
+# Lag over this is reported as a stall, along with what the loop was running
+STALL_THRESHOLD_SECS = 0.1
+MAX_STALLS_REPORTED = 10
+MAX_LABELS_REPORTED = 20
+
+
+class ProfilingSession:
+    def __init__(self, sampler: StackSampler, duration_secs: float):
+        self.sampler = sampler
+        self.duration_secs = duration_secs
+        self.started_at = time.perf_counter()
+        # event loop lag measured every LAG_CHECK_INTERVAL_SECS
+        self.lags = []
+        # (seconds into the session, lag, labels sampled during it)
+        self.stalls = []
+        self.stop_event = asyncio.Event()
+
+
+class Profiler(commands.Cog):
+    def __init__(self, bot):
+        self.logger = logging.getLogger("red.aps-cogs.profiler")
+        self.bot = bot
+        self.data_path = redbot.core.data_manager.cog_data_path(self)
+        self.session = None
+        self.session_task = None
+
+    async def cog_unload(self):
+        if self.session is not None:
+            self.session.stop_event.set()
+            await self.session_task
+
+    @commands.group()
+    @commands.is_owner()
+    async def profiler(self, _ctx):
+        """
+        Base for all profiler commands.
+        """
+        pass
+
+    @profiler.command()
+    async def start(self, ctx, duration_secs: int = DEFAULT_PROFILE_SECS):
+        """
+        Profile the bot for some number of seconds (one minute by default).
+
+        While this runs, the stacks of every thread are sampled and event loop lag is
+        measured. Time on the event loop is attributed to the listeners, commands and
+        background tasks of the loaded cogs. Afterwards a summary is posted, and it
+        and a collapsed stack file (which flame graph tools can read) are saved in
+        this cog's data directory.
+        """
+        if self.session is not None:
+            await ctx.reply(
+                f"Error: the profiler is already running. Use `{ctx.clean_prefix}profiler stop` to stop it."
+            )
+            return
+        if not 1 <= duration_secs <= MAX_PROFILE_SECS:
+            await ctx.reply(
+                f"Error: the duration must be between 1 and {MAX_PROFILE_SECS} seconds."
+            )
+            return
+        labels, fallback_labels = self.get_labels()
+        sampler = StackSampler(
+            SAMPLE_INTERVAL_SECS, threading.get_ident(), labels, fallback_labels
+        )
+        self.session = ProfilingSession(sampler, duration_secs)
+        sampler.start()
+        self.session_task = asyncio.create_task(self.run_session(ctx))
+        await ctx.reply(f"Profiling for {duration_secs} seconds.")
+
+    @profiler.command()
+    async def stop(self, ctx):
+        """
+        Stop the profiler early and post what it found.
+        """
+        if self.session is None:
+            await ctx.reply("Error: the profiler isn't running.")
+            return
+        self.session.stop_event.set()
+        await ctx.tick()
+
+    def get_labels(self):
+        """
+        Return labels for the code of each loaded cog's listeners, commands and
+        background tasks, and label prefixes for the directories the cogs are in.
+        """
+        labels = {}
+        fallback_labels = {}
+        for cog_name, cog in self.bot.cogs.items():
+            for listener_name, listener in cog.get_listeners():
+                code = getattr(listener, "__code__", None)
+                if code is not None:
+                    labels[code] = f"{cog_name} listener {listener_name}"
+            for command in cog.walk_commands():
+                labels[command.callback.__code__] = (
+                    f"{cog_name} command {command.qualified_name}"
+                )
+            for value in vars(type(cog)).values():
+                if isinstance(value, tasks.Loop):
+                    labels[value.coro.__code__] = (
+                        f"{cog_name} task {value.coro.__name__}"
+                    )
+            directory = os.path.dirname(inspect.getfile(type(cog)))
+            fallback_labels[directory + os.sep] = cog_name
+        return labels, fallback_labels
+
+    async def run_session(self, ctx):
+        session = self.session
+        try:
+            await asyncio.wait_for(
+                self.monitor_loop_lag(session), session.duration_secs
+            )
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            await asyncio.to_thread(session.sampler.stop)
+            self.session = None
+        summary = self.summarize(session)
+        name = f"profile-{time.strftime('%Y%m%d-%H%M%S')}"
+        try:
+            await asyncio.to_thread(self.write_results, session, name, summary)
+        except OSError:
+            self.logger.exception("Failed to save a profile.")
+        await ctx.send(f"Profile saved as `{name}` in `{self.data_path}`.")
+        for page in redbot.core.utils.chat_formatting.pagify(summary, page_length=1900):
+            await ctx.send(redbot.core.utils.chat_formatting.box(page))
+
+    async def monitor_loop_lag(self, session: ProfilingSession):
+        while not session.stop_event.is_set():
+            start_time = time.perf_counter()
+            await asyncio.sleep(LAG_CHECK_INTERVAL_SECS)
+            end_time = time.perf_counter()
+            lag = max(end_time - start_time - LAG_CHECK_INTERVAL_SECS, 0.0)
+            session.lags.append(lag)
+            if lag >= STALL_THRESHOLD_SECS:
+                session.stalls.append(
+                    (
+                        start_time - session.started_at,
+                        lag,
+                        session.sampler.get_labels_between(start_time, end_time),
+                    )
+                )
+
+    def summarize(self, session: ProfilingSession) -> str:
+        sampler = session.sampler
+        lines = [
+            f"Profiled for {time.perf_counter() - session.started_at:.1f} s, sampling"
+            f" every {SAMPLE_INTERVAL_SECS * 1000:.0f} ms.",
+            "",
+            f"Event loop time ({sampler.loop_samples} samples):",
+        ]
+        for label, count in sampler.loop_labels.most_common(MAX_LABELS_REPORTED):
+            lines.append(f"  {count / sampler.loop_samples:6.1%}  {label}")
+        if session.lags:
+            lags = sorted(session.lags)
+            lines += [
+                "",
+                f"Event loop lag (checked every {LAG_CHECK_INTERVAL_SECS * 1000:.0f} ms):"
+                f" mean {statistics.fmean(lags) * 1000:.1f} ms,"
+                f" p95 {lags[int(len(lags) * 0.95)] * 1000:.1f} ms,"
+                f" max {lags[-1] * 1000:.1f} ms",
+                f"Stalls of {STALL_THRESHOLD_SECS * 1000:.0f} ms or more: {len(session.stalls)}",
+            ]
+        for started_at, lag, labels in sorted(
+            session.stalls, key=lambda stall: stall[1], reverse=True
+        )[:MAX_STALLS_REPORTED]:
+            culprits = ", ".join(
+                f"{label} ({count})" for label, count in labels.most_common(3)
+            )
+            lines.append(
+                f"  {lag * 1000:.0f} ms at +{started_at:.1f} s: {culprits or 'no samples'}"
+            )
+        thread_samples = collections.Counter()
+        for stack, count in sampler.stacks.items():
+            thread_samples[stack.split(";", 1)[0]] += count
+        lines += ["", "Samples by thread:"]
+        for thread_name, count in thread_samples.most_common():
+            lines.append(f"  {count:8}  {thread_name}")
+        return "\n".join(lines)
+
+    def write_results(self, session: ProfilingSession, name: str, summary: str):
+        with open(self.data_path / f"{name}.collapsed", "w", encoding="utf-8") as file:
+            file.write(session.sampler.collapsed_stacks())
+        with open(self.data_path / f"{name}.txt", "w", encoding="utf-8") as file:
+            file.write(summary + "\n")
@@ -0,0 +1,144 @@
+import collections
+import os
+import re
+import sys
+import threading
+import time
+import types
+
+# Loop thread samples taken while the event loop is waiting for events rather than
+# running a callback are attributed to this.
+IDLE_LABEL = "idle"
+OTHER_LABEL = "other (not in a cog)"
+ASYNCIO_EVENTS_PATH = os.path.join("asyncio", "events.py")
+
+
+class StackSampler:
+    """
+    Samples the stack of every thread from a background thread, for a profile of
+    where time goes that costs nothing in the sampled code.
+
+    Stacks are counted in the collapsed format flame graph tools read: frames
+    from outermost to innermost joined by semicolons, starting with the thread's
+    name. Numbers are taken out of thread names, so that short-lived threads doing
+    the same thing (like aiosqlite's connection threads) are counted together.
+
+    Each sample of the event loop thread is also attributed to a label, found by
+    looking for the outermost frame whose code is in labels, then for the
+    outermost frame from a file under one of the directories in fallback_labels.
+    """
+
+    def __init__(
+        self,
+        interval_secs: float,
+        loop_thread_id: int,
+        labels: dict[types.CodeType, str],
+        fallback_labels: dict[str, str],
+    ):
+        self.interval_secs = interval_secs
+        self.loop_thread_id = loop_thread_id
+        self.labels = labels
+        # directory -> label prefix for code in it that isn't in labels
+        self.fallback_labels = fallback_labels
+        # code -> its name in collapsed stacks
+        self.frame_names = {}
+        # collapsed stack -> number of samples
+        self.stacks = collections.Counter()
+        # label -> number of loop thread samples
+        self.loop_labels = collections.Counter()
+        self.loop_samples = 0
+        # (time.perf_counter() at sampling, label) for recent loop thread samples, so
+        # that stalls can be blamed on what was running during them
+        self.recent_loop_labels = collections.deque(maxlen=10_000)
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(
+            target=self.run, name="profiler-sampler", daemon=True
+        )
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stop sampling. This blocks until the sampling thread exits.
+        """
+        self.stop_event.set()
+        self.thread.join()
+
+    def run(self):
+        own_thread_id = threading.get_ident()
+        while not self.stop_event.wait(self.interval_secs):
+            thread_names = {
+                thread.ident: re.sub(r"[-_]?\d+", "", thread.name)
+                for thread in threading.enumerate()
+            }
+            sampled_at = time.perf_counter()
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != own_thread_id:
+                    self.sample(
+                        thread_names.get(thread_id, str(thread_id)),
+                        thread_id == self.loop_thread_id,
+                        frame,
+                        sampled_at,
+                    )
+
+    def sample(self, thread_name: str, is_loop_thread: bool, frame, sampled_at: float):
+        codes = []
+        while frame is not None:
+            codes.append(frame.f_code)
+            frame = frame.f_back
+        codes.reverse()
+        stack = ";".join([thread_name, *(self.get_frame_name(code) for code in codes)])
+        with self.lock:
+            self.stacks[stack] += 1
+            if is_loop_thread:
+                label = self.get_label(codes)
+                self.loop_labels[label] += 1
+                self.loop_samples += 1
+                self.recent_loop_labels.append((sampled_at, label))
+
+    def get_frame_name(self, code: types.CodeType) -> str:
+        try:
+            return self.frame_names[code]
+        except KeyError:
+            frame_name = (
+                f"{getattr(code, 'co_qualname', code.co_name)}"
+                f" ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+            ).replace(";", ":")
+            self.frame_names[code] = frame_name
+            return frame_name
+
+    def get_label(self, codes: list[types.CodeType]) -> str:
+        for code in codes:
+            label = self.labels.get(code)
+            if label is not None:
+                return label
+        for code in codes:
+            for directory, label_prefix in self.fallback_labels.items():
+                if code.co_filename.startswith(directory):
+                    return (
+                        f"{label_prefix} {getattr(code, 'co_qualname', code.co_name)}"
+                    )
+        # Callbacks run from Handle._run; without it on the stack, the loop is
+        # waiting in its selector.
+        if not any(
+            code.co_name == "_run" and code.co_filename.endswith(ASYNCIO_EVENTS_PATH)
+            for code in codes
+        ):
+            return IDLE_LABEL
+        return OTHER_LABEL
+
+    def get_labels_between(self, start: float, end: float) -> collections.Counter:
+        with self.lock:
+            return collections.Counter(
+                label
+                for sampled_at, label in self.recent_loop_labels
+                if start <= sampled_at <= end
+            )
+
+    def collapsed_stacks(self) -> str:
+        with self.lock:
+            return "".join(
+                f"{stack} {count}\n" for stack, count in self.stacks.most_common()
+            )
@@ -0,0 +1,22 @@
+-- Questions are kept densely numbered by position within each guild (0 to count - 1)
+-- so that a random question can be picked with a single index lookup. Removing a
+-- question moves the guild's last question into the freed position.
+CREATE TABLE IF NOT EXISTS questions (
+    id INTEGER PRIMARY KEY,
+    guild_id BLOB NOT NULL,
+    position INTEGER NOT NULL,
+    question TEXT NOT NULL,
+    asked_by BLOB NOT NULL,
+    UNIQUE (guild_id, position)
+) STRICT;
+
+CREATE INDEX IF NOT EXISTS idx_questions__guild_id__id ON questions (guild_id, id);
+
+CREATE TABLE IF NOT EXISTS suggested_questions (
+    id INTEGER PRIMARY KEY,
+    guild_id BLOB NOT NULL,
+    question TEXT NOT NULL,
+    asked_by BLOB NOT NULL
+) STRICT;
+
+CREATE INDEX IF NOT EXISTS idx_suggested_questions__guild_id__id ON suggested_questions (guild_id, id);
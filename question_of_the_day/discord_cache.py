@@ -0,0 +1,118 @@
+# NOTE: Red can't share modules between cogs, so identical copies of this file live
+# in each cog that uses it. Keep them in sync.
+import discord
+import asyncio
+import collections
+import time
+
+DEFAULT_TTL_SECS = 60
+MAX_CACHED_OBJECTS = 1000
+
+
+class DiscordObjectResolver:
+    """
+    Resolve guilds, channels, threads, members and messages from the gateway cache,
+    falling back to the REST API only when an object isn't cached.
+
+    Objects fetched over REST are kept for a short time, and concurrent requests for
+    the same object share a single REST call. Hits and misses are counted per kind
+    of object in the hits and misses counters.
+    """
+
+    def __init__(self, bot, ttl_secs: float = DEFAULT_TTL_SECS):
+        self.bot = bot
+        self.ttl_secs = ttl_secs
+        self.hits = collections.Counter()
+        self.misses = collections.Counter()
+        # (kind, id) -> (expiry time, object)
+        self.fetched = {}
+        # (kind, id) -> future for a REST call in progress
+        self.pending = {}
+
+    async def guild(self, guild_id: int) -> discord.Guild:
+        guild = self.bot.get_guild(guild_id)
+        if guild is not None:
+            self.hits["guild"] += 1
+            return guild
+        return await self.fetch("guild", guild_id, self.bot.fetch_guild)
+
+    async def channel(
+        self, guild: discord.Guild, channel_id: int
+    ) -> discord.abc.GuildChannel | discord.Thread:
+        channel = guild.get_channel_or_thread(channel_id)
+        if channel is not None:
+            self.hits["channel"] += 1
+            return channel
+        return await self.fetch("channel", channel_id, guild.fetch_channel)
+
+    async def channels(self, guild: discord.Guild) -> list[discord.abc.GuildChannel]:
+        if guild.channels:
+            self.hits["channels"] += 1
+            return [*guild.channels]
+        return await self.fetch("channels", guild.id, lambda _: guild.fetch_channels())
+
+    async def member(self, guild: discord.Guild, member_id: int) -> discord.Member:
+        member = guild.get_member(member_id)
+        if member is not None:
+            self.hits["member"] += 1
+            return member
+        return await self.fetch(
+            "member", (guild.id, member_id), lambda _: guild.fetch_member(member_id)
+        )
+
+    async def message(self, channel, message_id: int) -> discord.Message:
+        message = discord.utils.get(self.bot.cached_messages, id=message_id)
+        if message is not None:
+            self.hits["message"] += 1
+            return message
+        return await self.fetch("message", message_id, channel.fetch_message)
+
+    async def fetch(self, kind: str, object_id, fetch_function):
+        key = (kind, object_id)
+        try:
+            expiry, fetched_object = self.fetched[key]
+        except KeyError:
+            pass
+        else:
+            if expiry > time.monotonic():
+                self.hits[kind] += 1
+                return fetched_object
+            del self.fetched[key]
+
+        self.misses[kind] += 1
+        pending = self.pending.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        future = asyncio.ensure_future(fetch_function(object_id))
+        self.pending[key] = future
+        try:
+            fetched_object = await asyncio.shield(future)
+        finally:
+            if future.done():
+                del self.pending[key]
+            else:
+                # We were cancelled but others may still be waiting on the fetch
+                future.add_done_callback(lambda _: self.pending.pop(key, None))
+        if len(self.fetched) >= MAX_CACHED_OBJECTS:
+            self.prune()
+        self.fetched[key] = (time.monotonic() + self.ttl_secs, fetched_object)
+        return fetched_object
+
+    def prune(self):
+        now = time.monotonic()
+        for key, (expiry, _) in [*self.fetched.items()]:
+            if expiry <= now:
+                del self.fetched[key]
+        # If everything is still fresh, drop the oldest entries
+        while len(self.fetched) >= MAX_CACHED_OBJECTS:
+            del self.fetched[next(iter(self.fetched))]
+
+    def stats(self) -> dict[str, tuple[int, int]]:
+        """
+        Return a mapping of kind of object to (hits, misses).
+        """
+        return {
+            kind: (self.hits[kind], self.misses[kind])
+            for kind in self.hits.keys() | self.misses.keys()
+        }
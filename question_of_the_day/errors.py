@@ -18,3 +18,14 @@ class QuestionLimitReachedError(Exception):
 
     def __str__(self):
         return f"Error: there are already {self.question_limit} questions in the main queue; can't add more."
+
+
+class QuestionFileError(Exception):
+    def __init__(self, reason: str):
+        self.reason = reason
+
+    def __repr__(self):
+        return f"QuestionFileError({repr(self.reason)})"
+
+    def __str__(self):
+        return f"Error: could not read questions file: {self.reason}"
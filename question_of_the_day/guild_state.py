@@ -0,0 +1,28 @@
+class GuildState:
+    """
+    The QOTD state of a guild that's read or changed on every post, held in memory so
+    that posting doesn't have to go through Config each time.
+
+    Changes to latest_qotd_message_info are only written back to Config when the cog
+    flushes its dirty guilds. The other settings are written through by the commands
+    that change them.
+    """
+
+    def __init__(self, guild_data: dict):
+        """
+        guild_data is the guild's data from Config.
+        """
+        self.enabled = guild_data["enabled"]
+        self.post_in_channel = guild_data["post_in_channel"]
+        self.latest_qotd_message_info = dict(guild_data["latest_qotd_message_info"])
+        # Queue sizes from the question store, or None if they need to be counted again
+        self.question_count = None
+        self.suggestion_count = None
+        # Bumped whenever the counts are invalidated, so that a count that was started
+        # before a change to the queues isn't cached after it.
+        self.counts_version = 0
+
+    def invalidate_counts(self):
+        self.question_count = None
+        self.suggestion_count = None
+        self.counts_version += 1
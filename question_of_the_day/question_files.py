@@ -0,0 +1,104 @@
+import csv
+import io
+import json
+import pathlib
+import typing
+from .errors import *
+
+FILE_FORMATS = ("txt", "csv", "json")
+
+
+def get_file_format(filename: str) -> str:
+    file_format = pathlib.PurePath(filename).suffix.removeprefix(".").lower()
+    if file_format not in FILE_FORMATS:
+        raise QuestionFileError(
+            f"unsupported file type {repr(file_format)}; use one of {', '.join(FILE_FORMATS)}."
+        )
+    return file_format
+
+
+def parse_questions_file(
+    file_format: str, data: bytes
+) -> typing.Iterator[tuple[str, int | None]]:
+    """
+    Yield (question, asked_by) pairs from the contents of a questions file.
+
+    asked_by is None when the file doesn't say who asked the question.
+
+    - txt: one question per line.
+    - csv: a "question" column and an optional "asked_by" column.
+    - json: a list of strings or of objects with "question" and optionally "asked_by".
+    """
+    try:
+        text = data.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise QuestionFileError("the file is not valid UTF-8.")
+
+    match file_format:
+        case "txt":
+            for line in io.StringIO(text):
+                yield line.strip(), None
+        case "csv":
+            reader = csv.DictReader(io.StringIO(text, newline=""))
+            if reader.fieldnames is None or "question" not in reader.fieldnames:
+                raise QuestionFileError('CSV files must have a "question" column.')
+            for row in reader:
+                yield (row["question"] or "").strip(), parse_asked_by(
+                    row.get("asked_by")
+                )
+        case "json":
+            try:
+                items = json.loads(text)
+            except json.JSONDecodeError as e:
+                raise QuestionFileError(f"invalid JSON ({e}).")
+            if not isinstance(items, list):
+                raise QuestionFileError("JSON files must contain a list.")
+            for item in items:
+                if isinstance(item, str):
+                    yield item.strip(), None
+                elif isinstance(item, dict) and isinstance(item.get("question"), str):
+                    yield item["question"].strip(), parse_asked_by(item.get("asked_by"))
+                else:
+                    yield "", None
+        case _:
+            raise ValueError(f"file_format must be one of {FILE_FORMATS}")
+
+
+def parse_asked_by(asked_by) -> int | None:
+    try:
+        asked_by = int(asked_by)
+    except (TypeError, ValueError):
+        return None
+    return asked_by if asked_by >= 0 else None
+
+
+def write_questions_file(file_format: str, questions: list[dict]) -> bytes:
+    output = io.StringIO(newline="")
+    match file_format:
+        case "txt":
+            for question in questions:
+                # Questions can't contain newlines in this format, so flatten them
+                output.write(" ".join(question["question"].splitlines()) + "\n")
+        case "csv":
+            writer = csv.writer(output)
+            writer.writerow(("question", "asked_by"))
+            writer.writerows(
+                (question["question"], question["asked_by"]) for question in questions
+            )
+        case "json":
+            json.dump(
+                [
+                    {"question": question["question"], "asked_by": question["asked_by"]}
+                    for question in questions
+                ],
+                output,
+                ensure_ascii=False,
+                indent=1,
+            )
+        case _:
+            raise ValueError(f"file_format must be one of {FILE_FORMATS}")
+    return output.getvalue().encode("utf-8")
+
+
+def normalize_question(question: str) -> str:
+    return " ".join(question.split()).casefold()
@@ -0,0 +1,125 @@
+import discord
+import redbot.core
+from redbot.core import commands
+from .question_store import QuestionStore
+
+QUESTIONS_PER_PAGE = 10
+MAX_PAGE_LENGTH = 1900
+
+
+class QuestionListView(discord.ui.View):
+    """
+    A paginated view of a guild's question or suggestion queue.
+
+    Pages are fetched from the database and rendered only when they are shown,
+    so opening the list costs the same regardless of the size of the queue.
+    """
+
+    def __init__(
+        self,
+        ctx: commands.GuildContext,
+        question_store: QuestionStore,
+        suggestions: bool,
+        asked_by: int | None,
+        search: str | None,
+        total_count: int,
+    ):
+        super().__init__(timeout=180)
+        self.ctx = ctx
+        self.question_store = question_store
+        self.suggestions = suggestions
+        self.asked_by = asked_by
+        self.search = search
+        self.total_count = total_count
+        self.message = None
+        # Pages end wherever the length budget runs out, so remember where each
+        # page we've shown started instead of computing offsets.
+        self.page_start_after_ids = [0]
+        self.next_page_start_after_id = None
+        self.asker_names = {}
+
+    async def start(self):
+        content = await self.render_page()
+        self.message = await self.ctx.reply(
+            content, view=self, allowed_mentions=discord.AllowedMentions.none()
+        )
+
+    async def render_page(self) -> str:
+        questions = await self.question_store.get_page(
+            self.ctx.guild.id,
+            self.suggestions,
+            self.page_start_after_ids[-1],
+            QUESTIONS_PER_PAGE + 1,
+            self.asked_by,
+            self.search,
+        )
+        lines = []
+        length = 0
+        for question in questions[:QUESTIONS_PER_PAGE]:
+            line = discord.utils.escape_mentions(
+                f"{question['id']}. {redbot.core.utils.chat_formatting.bold(question['question'])}"
+                f" by {self.get_asker_name(question['asked_by'])} ({question['asked_by']})"
+            )
+            if lines and length + len(line) + 1 > MAX_PAGE_LENGTH:
+                break
+            lines.append(line)
+            length += len(line) + 1
+
+        has_next_page = len(lines) < len(questions)
+        self.next_page_start_after_id = (
+            questions[len(lines) - 1]["id"] if has_next_page else None
+        )
+        self.previous_page.disabled = len(self.page_start_after_ids) == 1
+        self.next_page.disabled = not has_next_page
+
+        return (
+            "\n".join(lines)
+            + f"\n\n*Page {len(self.page_start_after_ids)} | {self.total_count} total*"
+        )
+
+    def get_asker_name(self, asked_by: int) -> str:
+        try:
+            return self.asker_names[asked_by]
+        except KeyError:
+            user = self.ctx.guild.get_member(asked_by) or self.ctx.bot.get_user(
+                asked_by
+            )
+            name = user.name if user is not None else "unknown user"
+            self.asker_names[asked_by] = name
+            return name
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if interaction.user.id != self.ctx.author.id:
+            await interaction.response.send_message(
+                "Only the person who ran this command can change pages.",
+                ephemeral=True,
+            )
+            return False
+        return True
+
+    async def on_timeout(self):
+        if self.message is not None:
+            try:
+                await self.message.edit(view=None)
+            except discord.HTTPException:
+                pass
+
+    @discord.ui.button(label="Previous", style=discord.ButtonStyle.secondary)
+    async def previous_page(
+        self, interaction: discord.Interaction, _button: discord.ui.Button
+    ):
+        if len(self.page_start_after_ids) > 1:
+            self.page_start_after_ids.pop()
+        await interaction.response.edit_message(
+            content=await self.render_page(), view=self
+        )
+
+    @discord.ui.button(label="Next", style=discord.ButtonStyle.secondary)
+    async def next_page(
+        self, interaction: discord.Interaction, _button: discord.ui.Button
+    ):
+        if self.next_page_start_after_id is not None:
+            self.page_start_after_ids.append(self.next_page_start_after_id)
+        await interaction.response.edit_message(
+            content=await self.render_page(), view=self
+        )
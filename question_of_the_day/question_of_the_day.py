@@ -3,18 +3,37 @@ from discord.ext import tasks
 from redbot.core import Config
 from redbot.core import commands
 import redbot.core
+import asyncio
 import copy
-import datetime
+import io
 import logging
 import pathlib
-import random
 import time
 import typing
+from .discord_cache import DiscordObjectResolver
 from .errors import *
+from .guild_state import GuildState
+from .question_files import *
+from .question_list import QuestionListView
+from .question_store import QuestionStore
+from .similarity_index import SimilarityIndex, build_similarity_index
 
-MAX_QUESTIONS_PER_GUILD = 1000
+MAX_QUESTIONS_PER_GUILD = 100_000
 MAX_QUESTION_SIZE = 500
+# Discord's global rate limit is 50 requests per second; each post makes a handful
+# of requests, so keep the number of guilds being posted to at once well below that.
+MAX_CONCURRENT_QOTD_POSTS = 8
+MAX_QOTD_POST_ATTEMPTS = 3
+MAX_IMPORT_FILE_SIZE = 8 * 1024 * 1024
+# How long to wait before writing changed guild state back to Config, so that changes
+# made close together are written at once.
+CONFIG_FLUSH_DELAY_SECS = 5
+MAX_MISSED_MINUTES_TO_RECOVER = 60
 ICON_PATH = pathlib.Path("abstract_swirl/abstract_swirl_160x160.png")
+# PRAGMA optimize is run this long after the cog loads and then at this interval,
+# rather than on every load.
+DATABASE_MAINTENANCE_DELAY_SECS = 10 * 60
+DATABASE_MAINTENANCE_INTERVAL_SECS = 6 * 60 * 60
 
 
 class QuestionOfTheDay(commands.Cog):
@@ -24,6 +43,8 @@ class QuestionOfTheDay(commands.Cog):
         self.config = Config.get_conf(
             self, identifier="551742410770612234|038a0658-85c9-416d-93ea-7c0bdb426734"
         )
+        # questions and suggested_questions are only kept so that data from before
+        # the switch to QuestionStore can be migrated; see migrate_config_questions().
         self.config.register_guild(
             questions=[],
             suggested_questions=[],
@@ -32,67 +53,265 @@ class QuestionOfTheDay(commands.Cog):
             enabled=False,
             latest_qotd_message_info={"channel_id": None, "message_id": None},
         )
-        self.config.register_global(last_posted_qotds_at=None, guild_to_post_at={})
+        self.config.register_global(
+            last_posted_qotds_at=None, guild_to_post_at={}, icon_url=None
+        )
+        self.post_semaphore = asyncio.Semaphore(MAX_CONCURRENT_QOTD_POSTS)
+        self.resolver = DiscordObjectResolver(bot)
+        self.question_store = QuestionStore(
+            redbot.core.data_manager.cog_data_path(self) / "questions.db"
+        )
+        self.guild_states = {}
+        # guild id -> SimilarityIndex of its questions and suggestions, built on first use
+        self.similarity_indexes = {}
+        # The icon_url setting; not named icon_url, since that's the command
+        self.hosted_icon_url = None
+        self.dirty_guild_ids = set()
+        self.flush_task = None
+
+    async def cog_load(self):
+        setup_script = await asyncio.to_thread(
+            (
+                redbot.core.data_manager.bundled_data_path(self) / "migrations/init.sql"
+            ).read_text
+        )
+        await self.question_store.run_setup_script(setup_script)
+        self.icon_bytes = await asyncio.to_thread(
+            (redbot.core.data_manager.bundled_data_path(self) / ICON_PATH).read_bytes
+        )
+        self.hosted_icon_url = await self.config.icon_url()
+        self.guild_to_post_at = await self.config.guild_to_post_at()
+        self.last_posted_qotds_at = await self.config.last_posted_qotds_at()
+        await self.migrate_config_questions()
         self.post_qotds_loop.start()
+        self.maintain_database.start()
+
+    async def migrate_config_questions(self):
+        for guild_id, guild_data in (await self.config.all_guilds()).items():
+            if guild_data["questions"] or guild_data["suggested_questions"]:
+                await self.question_store.import_config_questions(
+                    guild_id,
+                    guild_data["questions"],
+                    guild_data["suggested_questions"],
+                )
+                await self.config.guild_from_id(guild_id).questions.clear()
+                await self.config.guild_from_id(guild_id).suggested_questions.clear()
+                self.logger.info(
+                    f"Migrated {len(guild_data['questions'])} questions and"
+                    f" {len(guild_data['suggested_questions'])} suggestions"
+                    f" for guild {guild_id} from Config to the database."
+                )
 
     async def cog_unload(self):
         self.post_qotds_loop.cancel()
+        self.maintain_database.cancel()
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+        await self.flush_config()
+        await self.config.last_posted_qotds_at.set(self.last_posted_qotds_at)
+        self.logger.debug(
+            f"Discord object cache (hits, misses) by kind: {self.resolver.stats()}"
+        )
+
+    @tasks.loop(seconds=DATABASE_MAINTENANCE_INTERVAL_SECS)
+    async def maintain_database(self):
+        await self.question_store.optimize()
+
+    @maintain_database.before_loop
+    async def before_maintain_database(self):
+        # Keep ANALYZE from competing with everything else that happens on startup
+        await asyncio.sleep(DATABASE_MAINTENANCE_DELAY_SECS)
 
     @tasks.loop(seconds=30)
     async def post_qotds_loop(self):
-        async def post_qotds_for_time(hour, minute):
+        async def post_qotds_for_minute(epoch_minute: int):
+            hour, minute = divmod(epoch_minute % (24 * 60), 60)
             try:
-                guilds_due = (await self.config.guild_to_post_at())[
-                    repr((hour, minute))
-                ].keys()
+                guilds_due = self.guild_to_post_at[repr((hour, minute))].keys()
             except KeyError:
                 guilds_due = []
 
-            for guild_id in guilds_due:
-                guild = await self.bot.fetch_guild(int(guild_id))
-                if await self.config.guild(guild).enabled():
-                    channel_id = await self.config.guild(guild).post_in_channel()
-                    if not channel_id:
-                        self.logger.info(
-                            f"QOTD was due for guild {guild.name} ({guild_id}) but no channel was set, so it was not posted."
-                        )
-                    channel = await guild.fetch_channel(channel_id)
-                    await self.send_question_to_channel(channel)
+            await asyncio.gather(
+                *(
+                    self.post_qotd_for_guild(int(guild_id), epoch_minute * 60)
+                    for guild_id in guilds_due
+                )
+            )
 
         current_time = time.time()
-
-        current_datetime = datetime.datetime.fromtimestamp(
-            current_time, datetime.timezone.utc
-        )
-        hour = current_datetime.hour
-        minute = current_datetime.minute
-
-        last_posted_time = await self.config.last_posted_qotds_at()
-        last_posted_datetime = (
-            datetime.datetime.fromtimestamp(last_posted_time, datetime.timezone.utc)
-            if last_posted_time
-            else None
+        current_minute = int(current_time // 60)
+        # last_posted_qotds_at is only persisted on unload, so after a crash it may be
+        # well out of date; posting checks each guild's latest QOTD so that recovering
+        # minutes that were already handled doesn't post twice.
+        last_posted_minute = (
+            int(self.last_posted_qotds_at // 60)
+            if self.last_posted_qotds_at is not None
+            else current_minute - 1
         )
-        if not last_posted_datetime or not (
-            hour == last_posted_datetime.hour and minute == last_posted_datetime.minute
+        if current_minute != last_posted_minute:
+            await post_qotds_for_minute(current_minute)
+
+            missed_minutes = min(
+                current_minute - last_posted_minute - 1, MAX_MISSED_MINUTES_TO_RECOVER
+            )
+            if missed_minutes > 0:
+                # Posts may have been missed; recover them
+                self.logger.info(
+                    f"Detected gap of {current_time - self.last_posted_qotds_at} seconds."
+                )
+                for epoch_minute in range(
+                    current_minute - 1, current_minute - missed_minutes - 1, -1
+                ):
+                    await post_qotds_for_minute(epoch_minute)
+
+        self.last_posted_qotds_at = current_time
+
+    async def post_qotd_for_guild(self, guild_id: int, due_at: float):
+        async with self.post_semaphore:
+            start_time = time.monotonic()
+            for attempt in range(1, MAX_QOTD_POST_ATTEMPTS + 1):
+                try:
+                    posted = await self.try_post_qotd_for_guild(guild_id, due_at)
+                except (discord.Forbidden, discord.NotFound):
+                    self.logger.exception(
+                        f"Could not post QOTD for guild {guild_id}; giving up."
+                    )
+                    return
+                except (discord.HTTPException, asyncio.TimeoutError):
+                    if attempt == MAX_QOTD_POST_ATTEMPTS:
+                        self.logger.exception(
+                            f"Could not post QOTD for guild {guild_id} after {attempt} attempts; giving up."
+                        )
+                        return
+                    self.logger.warning(
+                        f"Attempt {attempt} to post QOTD for guild {guild_id} failed; retrying.",
+                        exc_info=True,
+                    )
+                    await asyncio.sleep(2**attempt)
+                except Exception:
+                    self.logger.exception(
+                        f"Unexpected error posting QOTD for guild {guild_id}."
+                    )
+                    return
+                else:
+                    if posted:
+                        self.logger.info(
+                            f"QOTD post for guild {guild_id} took {time.monotonic() - start_time:.3f} seconds."
+                        )
+                    return
+
+    async def try_post_qotd_for_guild(self, guild_id: int, due_at: float) -> bool:
+        guild = await self.resolver.guild(guild_id)
+        guild_state = await self.get_guild_state(guild_id)
+        if not guild_state.enabled:
+            return False
+        latest_message_id = guild_state.latest_qotd_message_info["message_id"]
+        if (
+            latest_message_id is not None
+            and discord.utils.snowflake_time(latest_message_id).timestamp() >= due_at
         ):
-            await post_qotds_for_time(hour, minute)
+            # Already posted, e.g. before a restart
+            return False
+        channel_id = guild_state.post_in_channel
+        if not channel_id:
+            self.logger.info(
+                f"QOTD was due for guild {guild.name} ({guild_id}) but no channel was set, so it was not posted."
+            )
+            return False
+        channel = await self.resolver.channel(guild, channel_id)
+        await self.send_question_to_channel(channel)
+        return True
 
-            gap_secs = current_time - (
-                last_posted_time if last_posted_time is not None else current_time
+    async def get_guild_state(self, guild_id: int) -> GuildState:
+        try:
+            return self.guild_states[guild_id]
+        except KeyError:
+            guild_state = GuildState(await self.config.guild_from_id(guild_id).all())
+            # Another task may have loaded the state while we were reading Config
+            return self.guild_states.setdefault(guild_id, guild_state)
+
+    async def get_question_count(self, guild_id: int) -> int:
+        guild_state = await self.get_guild_state(guild_id)
+        if guild_state.question_count is None:
+            counts_version = guild_state.counts_version
+            question_count = await self.question_store.count_questions(guild_id)
+            if guild_state.counts_version != counts_version:
+                return question_count
+            guild_state.question_count = question_count
+        return guild_state.question_count
+
+    async def get_suggestion_count(self, guild_id: int) -> int:
+        guild_state = await self.get_guild_state(guild_id)
+        if guild_state.suggestion_count is None:
+            counts_version = guild_state.counts_version
+            suggestion_count = await self.question_store.count_suggestions(guild_id)
+            if guild_state.counts_version != counts_version:
+                return suggestion_count
+            guild_state.suggestion_count = suggestion_count
+        return guild_state.suggestion_count
+
+    async def invalidate_question_counts(self, guild_id: int):
+        (await self.get_guild_state(guild_id)).invalidate_counts()
+
+    async def get_similarity_index(self, guild_id: int) -> SimilarityIndex:
+        similarity_index = self.similarity_indexes.get(guild_id)
+        if similarity_index is None:
+            guild_state = await self.get_guild_state(guild_id)
+            counts_version = guild_state.counts_version
+            similarity_index = await asyncio.to_thread(
+                build_similarity_index,
+                await self.question_store.get_questions(guild_id),
+                await self.question_store.get_suggestions(guild_id),
             )
-            if gap_secs >= 60:
-                # Posts may have been missed; recover them up to an hour
-                self.logger.info(f"Detected gap of {gap_secs} seconds.")
-                gap_minutes = min(int(gap_secs / 60), 60)
-                for _ in range(gap_minutes):
-                    minute -= 1
-                    if minute < 0:
-                        minute = 59
-                        hour -= 1
-                    await post_qotds_for_time(hour, minute)
-
-        await self.config.last_posted_qotds_at.set(current_time)
+            # If the queues changed while the index was being built, it may be missing
+            # the change, so only use it this once.
+            if guild_state.counts_version == counts_version:
+                self.similarity_indexes[guild_id] = similarity_index
+        return similarity_index
+
+    def index_question(
+        self, guild_id: int, suggestion: bool, question_id: int, question: str
+    ):
+        similarity_index = self.similarity_indexes.get(guild_id)
+        if similarity_index is not None:
+            similarity_index.add((suggestion, question_id), question)
+
+    def unindex_question(self, guild_id: int, suggestion: bool, question_id: int):
+        similarity_index = self.similarity_indexes.get(guild_id)
+        if similarity_index is not None:
+            similarity_index.remove((suggestion, question_id))
+
+    def format_near_duplicate(self, near_duplicate) -> str:
+        (suggestion, question_id), question, similarity = near_duplicate
+        return (
+            f"{'suggestion' if suggestion else 'question'} {question_id}"
+            f" ({similarity:.0%} similar):\n"
+            + redbot.core.utils.chat_formatting.quote(question)
+        )
+
+    def mark_guild_state_dirty(self, guild_id: int):
+        self.dirty_guild_ids.add(guild_id)
+        if self.flush_task is None or self.flush_task.done():
+            self.flush_task = asyncio.create_task(self.flush_config_later())
+
+    async def flush_config_later(self):
+        await asyncio.sleep(CONFIG_FLUSH_DELAY_SECS)
+        try:
+            await self.flush_config()
+        except Exception:
+            # Whatever wasn't written stays dirty and is retried on the next flush
+            self.logger.exception("Failed to write QOTD guild state to Config.")
+
+    async def flush_config(self):
+        while self.dirty_guild_ids:
+            guild_id = self.dirty_guild_ids.pop()
+            try:
+                await self.config.guild_from_id(guild_id).latest_qotd_message_info.set(
+                    dict(self.guild_states[guild_id].latest_qotd_message_info)
+                )
+            except BaseException:
+                self.dirty_guild_ids.add(guild_id)
+                raise
 
     @commands.group()
     @commands.guild_only()
@@ -110,27 +329,43 @@ class QuestionOfTheDay(commands.Cog):
         """
         if not await self.check_and_handle_question_length(ctx, question):
             return
-        async with self.config.guild(ctx.guild).questions() as questions:
-            if len(questions) >= MAX_QUESTIONS_PER_GUILD:
-                await ctx.reply(
-                    f"Error: too many questions already added in this server! Max is {MAX_QUESTIONS_PER_GUILD}."
-                )
-                return
-            questions.append({"question": question, "asked_by": ctx.author.id})
-        await ctx.tick()
+        if await self.get_question_count(ctx.guild.id) >= MAX_QUESTIONS_PER_GUILD:
+            await ctx.reply(
+                f"Error: too many questions already added in this server! Max is {MAX_QUESTIONS_PER_GUILD}."
+            )
+            return
+        near_duplicates = (
+            await self.get_similarity_index(ctx.guild.id)
+        ).find_near_duplicates(question)
+        question_id = await self.question_store.add_question(
+            ctx.guild.id, question, ctx.author.id
+        )
+        self.index_question(ctx.guild.id, False, question_id, question)
+        await self.invalidate_question_counts(ctx.guild.id)
+        if near_duplicates:
+            await ctx.reply(
+                f"Added question {question_id}, but note that it's very similar to "
+                + self.format_near_duplicate(near_duplicates[0]),
+                allowed_mentions=discord.AllowedMentions.none(),
+            )
+        else:
+            await ctx.tick()
 
     @qotd.command()
-    async def list(self, ctx: commands.GuildContext):
+    async def list(
+        self,
+        ctx: commands.GuildContext,
+        asked_by: typing.Optional[discord.User] = None,
+        *,
+        search: str | None = None,
+    ):
         """
         Show questions in the main queue.
+
+        Optionally only show questions asked by a particular user (mention or id)
+        and/or containing some text.
         """
-        pages = await self.paginate_questions(
-            ctx, await self.config.guild(ctx.guild).questions()
-        )
-        if pages:
-            await redbot.core.utils.menus.menu(ctx, pages)
-        else:
-            await ctx.reply("No questions yet.")
+        await self.show_question_list(ctx, False, asked_by, search)
 
     @qotd.command()
     @commands.admin_or_permissions(manage_guild=True)
@@ -138,12 +373,129 @@ class QuestionOfTheDay(commands.Cog):
         """
         Remove a question from the queue using its id (see `qotd list`).
         """
-        async with self.config.guild(ctx.guild).questions() as questions:
-            try:
-                del questions[question_id - 1]
-                await ctx.reply(f"Deleted question {question_id}.")
-            except IndexError:
-                await ctx.reply(f"Error: no question with id {question_id}.")
+        if await self.question_store.remove_question(ctx.guild.id, question_id):
+            self.unindex_question(ctx.guild.id, False, question_id)
+            await self.invalidate_question_counts(ctx.guild.id)
+            await ctx.reply(f"Deleted question {question_id}.")
+        else:
+            await ctx.reply(f"Error: no question with id {question_id}.")
+
+    @qotd.command(name="import")
+    @commands.admin_or_permissions(manage_guild=True)
+    async def import_questions(self, ctx: commands.GuildContext):
+        """
+        Add every question in an attached .txt, .csv or .json file to the main queue.
+
+        Text files have one question per line. CSV files need a "question" column and
+        may have an "asked_by" column of user ids. JSON files hold a list of strings or
+        of objects with "question" and optionally "asked_by". Questions that are too
+        long or already in the queue are skipped.
+        """
+        if not ctx.message.attachments:
+            await ctx.reply("Error: attach a .txt, .csv or .json file of questions.")
+            return
+        attachment = ctx.message.attachments[0]
+        if attachment.size > MAX_IMPORT_FILE_SIZE:
+            await ctx.reply(
+                f"Error: that file is too large! Maximum size is {MAX_IMPORT_FILE_SIZE // (1024 * 1024)} MiB."
+            )
+            return
+
+        try:
+            file_format = get_file_format(attachment.filename)
+            data = await attachment.read()
+            seen_questions = {
+                normalize_question(question["question"])
+                for question in await self.question_store.get_questions(ctx.guild.id)
+            }
+            questions_count = len(seen_questions)
+            new_questions = []
+            skipped_too_long = 0
+            skipped_duplicate = 0
+            skipped_empty = 0
+            for question, asked_by in parse_questions_file(file_format, data):
+                if not question:
+                    skipped_empty += 1
+                    continue
+                if len(question.encode("utf-8")) > MAX_QUESTION_SIZE:
+                    skipped_too_long += 1
+                    continue
+                normalized_question = normalize_question(question)
+                if normalized_question in seen_questions:
+                    skipped_duplicate += 1
+                    continue
+                seen_questions.add(normalized_question)
+                new_questions.append(
+                    {
+                        "question": question,
+                        "asked_by": asked_by if asked_by is not None else ctx.author.id,
+                    }
+                )
+        except QuestionFileError as e:
+            await ctx.reply(str(e))
+            return
+
+        if questions_count + len(new_questions) > MAX_QUESTIONS_PER_GUILD:
+            await ctx.reply(
+                f"Error: importing {len(new_questions)} questions would exceed the maximum of {MAX_QUESTIONS_PER_GUILD}; nothing was imported."
+            )
+            return
+        try:
+            imported_count = await self.question_store.add_questions(
+                ctx.guild.id, new_questions, MAX_QUESTIONS_PER_GUILD
+            )
+        except QuestionLimitReachedError:
+            await ctx.reply(
+                f"Error: importing {len(new_questions)} questions would exceed the maximum of {MAX_QUESTIONS_PER_GUILD}; nothing was imported."
+            )
+            return
+        # Questions added to the queue since it was read above are only caught here
+        skipped_duplicate += len(new_questions) - imported_count
+        # Rebuilt on next use, since the new questions' ids aren't known here
+        self.similarity_indexes.pop(ctx.guild.id, None)
+        await self.invalidate_question_counts(ctx.guild.id)
+
+        summary = (
+            f"Imported {imported_count} question{'' if imported_count == 1 else 's'}."
+        )
+        for count, reason in (
+            (skipped_duplicate, "already in the queue"),
+            (skipped_too_long, f"longer than {MAX_QUESTION_SIZE} bytes"),
+            (skipped_empty, "empty or invalid"),
+        ):
+            if count:
+                summary += f"\nSkipped {count} {reason}."
+        await ctx.reply(summary)
+
+    @qotd.command(name="export")
+    @commands.admin_or_permissions(manage_guild=True)
+    async def export_questions(
+        self,
+        ctx: commands.GuildContext,
+        file_format: typing.Literal["txt", "csv", "json"] = "json",
+        queue: typing.Literal["questions", "suggestions"] = "questions",
+    ):
+        """
+        Export the main queue (or the suggestion queue) as a .txt, .csv or .json file.
+
+        The file can be loaded again with `qotd import`.
+        """
+        if queue == "questions":
+            questions = await self.question_store.get_questions(ctx.guild.id)
+        else:
+            questions = await self.question_store.get_suggestions(ctx.guild.id)
+        if not questions:
+            await ctx.reply(f"No {queue} to export.")
+            return
+        data = write_questions_file(file_format, questions)
+        if len(data) > ctx.guild.filesize_limit:
+            await ctx.reply(
+                "Error: the exported file is larger than the upload limit for this server."
+            )
+            return
+        await ctx.reply(
+            file=discord.File(io.BytesIO(data), f"qotd_{queue}.{file_format}")
+        )
 
     @qotd.command()
     @commands.admin_or_permissions(manage_guild=True)
@@ -153,10 +505,10 @@ class QuestionOfTheDay(commands.Cog):
 
         A question will still be sent at the scheduled time if automatic posting is enabled.
         """
-        channel_id = await self.config.guild(ctx.guild).post_in_channel()
+        channel_id = (await self.get_guild_state(ctx.guild.id)).post_in_channel
         if channel_id:
             await self.send_question_to_channel(
-                await ctx.guild.fetch_channel(channel_id)
+                await self.resolver.channel(ctx.guild, channel_id)
             )
         else:
             await ctx.reply(
@@ -197,6 +549,7 @@ class QuestionOfTheDay(commands.Cog):
                         guild_to_post_at[
                             (hour_after_midnight_utc, minute_after_hour)
                         ] = {ctx.guild.id: 1}
+                self.guild_to_post_at = await self.config.guild_to_post_at()
             await ctx.reply(
                 f"The bot will post the question of the day at {hour_after_midnight_utc:0>2}:{minute_after_hour:0>2} UTC."
             )
@@ -213,18 +566,41 @@ class QuestionOfTheDay(commands.Cog):
         """
         if isinstance(ctx.channel, discord.TextChannel):
             await self.config.guild(ctx.guild).post_in_channel.set(ctx.channel.id)
+            (await self.get_guild_state(ctx.guild.id)).post_in_channel = ctx.channel.id
             await ctx.reply("Questions of the day will be posted in this channel.")
         else:
             await ctx.reply("Error: must use a text channel.")
 
+    @qotd.command()
+    @commands.is_owner()
+    async def icon_url(self, ctx: commands.GuildContext, url: str | None = None):
+        """
+        Use an image hosted at url as the QOTD icon instead of uploading it with each post.
+
+        The URL must be permanent (Discord attachment links expire, so don't use one).
+        Run this without a URL to go back to uploading the bundled icon.
+        """
+        if url is not None and not url.startswith("https://"):
+            await ctx.reply("Error: the icon URL must start with https://.")
+            return
+        await self.config.icon_url.set(url)
+        self.hosted_icon_url = url
+        await ctx.reply(
+            f"QOTDs will use the icon at <{url}>."
+            if url
+            else "QOTDs will upload the bundled icon with each post."
+        )
+
     @qotd.command()
     @commands.admin_or_permissions(manage_guild=True)
     async def toggle(self, ctx: commands.GuildContext):
         """
         Turn on or off automatic posting of questions of the day in this server.
         """
-        should_be_enabled = not await self.config.guild(ctx.guild).enabled()
+        guild_state = await self.get_guild_state(ctx.guild.id)
+        should_be_enabled = not guild_state.enabled
         await self.config.guild(ctx.guild).enabled.set(should_be_enabled)
+        guild_state.enabled = should_be_enabled
         post_at = await self.config.guild(ctx.guild).post_at()
         async with self.config.guild_to_post_at() as guild_to_post_at:
             try:
@@ -233,6 +609,7 @@ class QuestionOfTheDay(commands.Cog):
                 guild_to_post_at[(post_at["hour"], post_at["minute"])] = {
                     ctx.guild.id: 1
                 }
+        self.guild_to_post_at = await self.config.guild_to_post_at()
         await ctx.reply(
             "QOTDs will be posted in this server (provided that the channel has been set with post_here)."
             if should_be_enabled
@@ -243,34 +620,50 @@ class QuestionOfTheDay(commands.Cog):
     async def suggest(self, ctx: commands.GuildContext, *, question: str):
         """
         Add a question to the suggestion queue (it can be approved or denied by moderators).
+
+        Questions that are near-duplicates of one already in either queue are rejected.
         """
         if not await self.check_and_handle_question_length(ctx, question):
             return
-        async with self.config.guild(
-            ctx.guild
-        ).suggested_questions() as suggested_questions:
-            if len(suggested_questions) >= MAX_QUESTIONS_PER_GUILD:
-                await ctx.reply(
-                    f"Error: too many questions already in the suggestion queue for this server! Max is {MAX_QUESTIONS_PER_GUILD}."
-                )
-                return
-            suggested_questions.append(
-                {"question": question, "asked_by": ctx.author.id}
+        if await self.get_suggestion_count(ctx.guild.id) >= MAX_QUESTIONS_PER_GUILD:
+            await ctx.reply(
+                f"Error: too many questions already in the suggestion queue for this server! Max is {MAX_QUESTIONS_PER_GUILD}."
+            )
+            return
+        near_duplicates = (
+            await self.get_similarity_index(ctx.guild.id)
+        ).find_near_duplicates(question)
+        if near_duplicates:
+            await ctx.reply(
+                "Error: that's very similar to "
+                + self.format_near_duplicate(near_duplicates[0])
+                + "\nIf it's really a different question, a moderator can add it"
+                f" with `{ctx.clean_prefix}qotd add`.",
+                allowed_mentions=discord.AllowedMentions.none(),
             )
+            return
+        suggestion_id = await self.question_store.add_suggestion(
+            ctx.guild.id, question, ctx.author.id
+        )
+        self.index_question(ctx.guild.id, True, suggestion_id, question)
+        await self.invalidate_question_counts(ctx.guild.id)
         await ctx.tick()
 
     @qotd.command()
-    async def suggestions(self, ctx: commands.GuildContext):
+    async def suggestions(
+        self,
+        ctx: commands.GuildContext,
+        asked_by: typing.Optional[discord.User] = None,
+        *,
+        search: str | None = None,
+    ):
         """
         View all questions in the suggestion queue.
+
+        Optionally only show suggestions made by a particular user (mention or id)
+        and/or containing some text.
         """
-        pages = await self.paginate_questions(
-            ctx, await self.config.guild(ctx.guild).suggested_questions()
-        )
-        if pages:
-            await redbot.core.utils.menus.menu(ctx, pages)
-        else:
-            await ctx.reply("No suggested questions yet.")
+        await self.show_question_list(ctx, True, asked_by, search)
 
     @qotd.command()
     @commands.admin_or_permissions(manage_guild=True)
@@ -282,47 +675,39 @@ class QuestionOfTheDay(commands.Cog):
 
         This adds the suggestion to the main queue.
         """
-
-        async def approve_suggestion(
-            suggested_questions: list[dict], suggestion_id: int
-        ) -> str:
+        if suggestion_id == "all":
             try:
-                suggested_question = suggested_questions[suggestion_id - 1]
-            except IndexError:
-                raise NoSuchSuggestionError(suggestion_id)
-            approved_suggestion_text = suggested_question["question"]
-            async with self.config.guild(ctx.guild).questions() as questions:
-                if len(questions) >= MAX_QUESTIONS_PER_GUILD:
-                    raise QuestionLimitReachedError
-                else:
-                    questions.append(suggested_question)
-                    del suggested_questions[suggestion_id - 1]
-            return approved_suggestion_text
-
-        async with self.config.guild(
-            ctx.guild
-        ).suggested_questions() as suggested_questions:
-            if suggestion_id == "all":
-                for _ in range(len(suggested_questions)):
-                    try:
-                        await approve_suggestion(suggested_questions, 1)
-                    except (NoSuchSuggestionError, QuestionLimitReachedError) as e:
-                        await ctx.reply(str(e))
-                        return
-                await ctx.reply("Approved all suggestions!")
-            else:
-                try:
-                    approved_suggestion_text = await approve_suggestion(
-                        suggested_questions, suggestion_id
+                await self.question_store.approve_all_suggestions(
+                    ctx.guild.id, MAX_QUESTIONS_PER_GUILD
+                )
+            except QuestionLimitReachedError as e:
+                await ctx.reply(str(e))
+                return
+            self.similarity_indexes.pop(ctx.guild.id, None)
+            await self.invalidate_question_counts(ctx.guild.id)
+            await ctx.reply("Approved all suggestions!")
+        else:
+            try:
+                approved_suggestion, question_id = (
+                    await self.question_store.approve_suggestion(
+                        ctx.guild.id, suggestion_id, MAX_QUESTIONS_PER_GUILD
                     )
-                except (NoSuchSuggestionError, QuestionLimitReachedError) as e:
-                    await ctx.reply(str(e))
-                    return
-                await ctx.reply(
-                    f"Approved suggestion {suggestion_id}:\n"
-                    + redbot.core.utils.chat_formatting.quote(approved_suggestion_text),
-                    allowed_mentions=discord.AllowedMentions.none(),
                 )
+            except (NoSuchSuggestionError, QuestionLimitReachedError) as e:
+                await ctx.reply(str(e))
+                return
+            self.unindex_question(ctx.guild.id, True, suggestion_id)
+            self.index_question(
+                ctx.guild.id, False, question_id, approved_suggestion["question"]
+            )
+            await self.invalidate_question_counts(ctx.guild.id)
+            await ctx.reply(
+                f"Approved suggestion {suggestion_id}:\n"
+                + redbot.core.utils.chat_formatting.quote(
+                    approved_suggestion["question"]
+                ),
+                allowed_mentions=discord.AllowedMentions.none(),
+            )
 
     @qotd.command()
     @commands.admin_or_permissions(manage_guild=True)
@@ -332,108 +717,135 @@ class QuestionOfTheDay(commands.Cog):
 
         For the suggestion's id, see `qotd suggestions`.
         """
-        async with self.config.guild(
-            ctx.guild
-        ).suggested_questions() as suggested_questions:
-            try:
-                question_text = suggested_questions[suggestion_id - 1]["question"]
-                del suggested_questions[suggestion_id - 1]
-                await ctx.reply(
-                    f"Deleted suggestion {suggestion_id}:\n"
-                    + redbot.core.utils.chat_formatting.quote(question_text),
-                    allowed_mentions=discord.AllowedMentions.none(),
-                )
-            except IndexError:
-                await ctx.reply(f"Error: no suggestion with id {suggestion_id}.")
+        suggestion = await self.question_store.remove_suggestion(
+            ctx.guild.id, suggestion_id
+        )
+        if suggestion:
+            self.unindex_question(ctx.guild.id, True, suggestion_id)
+            await self.invalidate_question_counts(ctx.guild.id)
+            await ctx.reply(
+                f"Deleted suggestion {suggestion_id}:\n"
+                + redbot.core.utils.chat_formatting.quote(suggestion["question"]),
+                allowed_mentions=discord.AllowedMentions.none(),
+            )
+        else:
+            await ctx.reply(f"Error: no suggestion with id {suggestion_id}.")
 
     async def send_question_to_channel(self, channel):
         guild = channel.guild
-        async with self.config.guild(guild).questions() as questions:
-            questions_len = len(questions)
-            if not questions_len:
-                await channel.send("**Question of the day: no questions left!**")
-            else:
-                question_index = random.randrange(0, questions_len)
-                question = questions[question_index]
-
-                embed = discord.Embed(
-                    description=question["question"]
-                    + "\n"
-                    + redbot.core.utils.chat_formatting.italics(
-                        "asked by "
-                        + (await guild.fetch_member(question["asked_by"])).mention
-                    )
-                )
-                embed.set_author(
-                    name="Question of the Day",
-                    icon_url=f"attachment://{ICON_PATH.name}",
-                )
-                questions_left = questions_len - 1
-                footer = f"{questions_left} question{'' if questions_left == 1 else 's'} left | "
-                suggestions_count = len(
-                    await self.config.guild(guild).suggested_questions()
-                )
-                footer += (
-                    f"{suggestions_count} suggestion{'' if suggestions_count == 1 else 's'}"
-                    if suggestions_count
-                    else "no suggestions yet! use qotd suggest"
-                )
-                embed.set_footer(text=footer)
-
-                message = await channel.send(
-                    embed=embed,
-                    file=discord.File(
-                        redbot.core.data_manager.bundled_data_path(self) / ICON_PATH,
-                        ICON_PATH.name,
-                    ),
-                    allowed_mentions=discord.AllowedMentions.none(),
-                )
+        question = await self.question_store.get_random_question(guild.id)
+        if question is None:
+            await channel.send("**Question of the day: no questions left!**")
+            return
+
+        embed = discord.Embed(
+            description=question["question"]
+            + "\n"
+            + redbot.core.utils.chat_formatting.italics(
+                "asked by " + await self.get_asker_mention(guild, question)
+            )
+        )
+        if self.hosted_icon_url:
+            embed.set_author(name="Question of the Day", icon_url=self.hosted_icon_url)
+            file = discord.utils.MISSING
+        else:
+            embed.set_author(
+                name="Question of the Day",
+                icon_url=f"attachment://{ICON_PATH.name}",
+            )
+            file = discord.File(io.BytesIO(self.icon_bytes), ICON_PATH.name)
+        questions_left = await self.get_question_count(guild.id) - 1
+        footer = (
+            f"{questions_left} question{'' if questions_left == 1 else 's'} left | "
+        )
+        suggestions_count = await self.get_suggestion_count(guild.id)
+        footer += (
+            f"{suggestions_count} suggestion{'' if suggestions_count == 1 else 's'}"
+            if suggestions_count
+            else "no suggestions yet! use qotd suggest"
+        )
+        embed.set_footer(text=footer)
+
+        message = await channel.send(
+            embed=embed,
+            file=file,
+            allowed_mentions=discord.AllowedMentions.none(),
+        )
 
-                del questions[question_index]
-                await self.manage_qotd_pins(message)
-                self.logger.info(f"Posted QOTD for guild {guild.name} ({guild.id}).")
+        await self.question_store.remove_question(guild.id, question["id"])
+        self.unindex_question(guild.id, False, question["id"])
+        await self.invalidate_question_counts(guild.id)
+        await self.manage_qotd_pins(message)
+        self.logger.info(f"Posted QOTD for guild {guild.name} ({guild.id}).")
+
+    async def get_asker_mention(self, guild: discord.Guild, question: dict) -> str:
+        try:
+            member = await self.resolver.member(guild, question["asked_by"])
+        except discord.NotFound:
+            # The asker has left the guild; a raw mention still renders as their id
+            return f"<@{question['asked_by']}>"
+        return member.mention
 
     async def manage_qotd_pins(self, new_message):
         guild = new_message.guild
-        async with self.config.guild(
-            guild
-        ).latest_qotd_message_info() as latest_qotd_message_info:
-            if (
-                latest_qotd_message_info["channel_id"] is not None
-                and latest_qotd_message_info["message_id"] is not None
-            ):
-                channel = await guild.fetch_channel(
-                    latest_qotd_message_info["channel_id"]
-                )
-                try:
-                    old_message = await channel.fetch_message(
-                        latest_qotd_message_info["message_id"]
-                    )
-                    await old_message.unpin(reason="Unpinning old question of the day.")
-                except (discord.Forbidden, discord.NotFound):
-                    pass
+        guild_state = await self.get_guild_state(guild.id)
+        latest_qotd_message_info = guild_state.latest_qotd_message_info
+        if (
+            latest_qotd_message_info["channel_id"] is not None
+            and latest_qotd_message_info["message_id"] is not None
+        ):
             try:
-                await new_message.pin(reason="Pinning new question of the day.")
+                channel = await self.resolver.channel(
+                    guild, latest_qotd_message_info["channel_id"]
+                )
+                # Unpinning only needs the id, so don't fetch the whole message
+                await channel.get_partial_message(
+                    latest_qotd_message_info["message_id"]
+                ).unpin(reason="Unpinning old question of the day.")
             except (discord.Forbidden, discord.NotFound):
                 pass
-            latest_qotd_message_info["channel_id"] = new_message.channel.id
-            latest_qotd_message_info["message_id"] = new_message.id
-
-    async def paginate_questions(self, ctx: commands.GuildContext, questions: list):
-        return [
-            *redbot.core.utils.chat_formatting.pagify(
-                discord.utils.escape_mentions(
-                    "\n".join(
-                        [
-                            f"{i + 1}. {redbot.core.utils.chat_formatting.bold(question['question'])} by "
-                            + (ctx.guild.get_member(question["asked_by"])).name
-                            + f" ({question['asked_by']})"
-                            for i, question in enumerate(questions)
-                        ]
-                    )
+            except discord.HTTPException:
+                # The question has already been posted, so don't let this propagate
+                # and cause the post to be retried.
+                self.logger.warning(
+                    f"Failed to unpin old QOTD in guild {guild.name} ({guild.id}).",
+                    exc_info=True,
                 )
+        latest_qotd_message_info["channel_id"] = new_message.channel.id
+        latest_qotd_message_info["message_id"] = new_message.id
+        self.mark_guild_state_dirty(guild.id)
+        try:
+            await new_message.pin(reason="Pinning new question of the day.")
+        except (discord.Forbidden, discord.NotFound):
+            pass
+        except discord.HTTPException:
+            self.logger.warning(
+                f"Failed to pin new QOTD in guild {guild.name} ({guild.id}).",
+                exc_info=True,
             )
-        ]
+
+    async def show_question_list(
+        self,
+        ctx: commands.GuildContext,
+        suggestions: bool,
+        asked_by: discord.User | None,
+        search: str | None,
+    ):
+        asked_by_id = asked_by.id if asked_by is not None else None
+        total_count = await self.question_store.count_matching(
+            ctx.guild.id, suggestions, asked_by_id, search
+        )
+        if not total_count:
+            if asked_by is not None or search:
+                await ctx.reply("No matching questions.")
+            elif suggestions:
+                await ctx.reply("No suggested questions yet.")
+            else:
+                await ctx.reply("No questions yet.")
+            return
+        await QuestionListView(
+            ctx, self.question_store, suggestions, asked_by_id, search, total_count
+        ).start()
 
     async def check_and_handle_question_length(
         self, ctx: commands.GuildContext, question: str
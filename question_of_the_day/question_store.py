@@ -0,0 +1,369 @@
+import aiosqlite
+import pathlib
+from .errors import *
+from .question_files import normalize_question
+
+
+class QuestionStore:
+    """
+    SQLite-backed storage for each guild's question and suggestion queues.
+
+    Questions and suggestions are identified by stable integer ids that do not
+    change when other entries are added or removed.
+    """
+
+    def __init__(self, db_path: pathlib.Path):
+        self.db_path = db_path
+
+    def connect(self):
+        return aiosqlite.connect(self.db_path)
+
+    async def run_setup_script(self, setup_script: str):
+        async with self.connect() as db:
+            await db.executescript(setup_script)
+            await db.commit()
+
+    async def optimize(self):
+        async with self.connect() as db:
+            await db.execute("PRAGMA analysis_limit = 1000;")
+            await db.execute("PRAGMA optimize;")
+
+    async def count_questions(self, guild_id: int) -> int:
+        async with self.connect() as db:
+            return await self._count_questions(db, guild_id)
+
+    async def count_suggestions(self, guild_id: int) -> int:
+        async with self.connect() as db:
+            row = await (
+                await db.execute(
+                    "SELECT COUNT(*) FROM suggested_questions WHERE guild_id = ?;",
+                    (uint_to_bytes(guild_id),),
+                )
+            ).fetchone()
+        return row[0]
+
+    async def get_questions(self, guild_id: int) -> list[dict]:
+        async with self.connect() as db:
+            rows = await db.execute_fetchall(
+                "SELECT id, question, asked_by FROM questions"
+                " WHERE guild_id = ? ORDER BY id;",
+                (uint_to_bytes(guild_id),),
+            )
+        return [row_to_question(row) for row in rows]
+
+    async def get_suggestions(self, guild_id: int) -> list[dict]:
+        async with self.connect() as db:
+            rows = await db.execute_fetchall(
+                "SELECT id, question, asked_by FROM suggested_questions"
+                " WHERE guild_id = ? ORDER BY id;",
+                (uint_to_bytes(guild_id),),
+            )
+        return [row_to_question(row) for row in rows]
+
+    async def get_page(
+        self,
+        guild_id: int,
+        suggestions: bool,
+        after_id: int,
+        limit: int,
+        asked_by: int | None = None,
+        search: str | None = None,
+    ) -> list[dict]:
+        """
+        Return up to limit questions (or suggestions) with ids greater than after_id,
+        in id order, optionally only those asked by asked_by or containing search.
+        """
+        conditions, parameters = self._filter_conditions(guild_id, asked_by, search)
+        async with self.connect() as db:
+            rows = await db.execute_fetchall(
+                f"SELECT id, question, asked_by FROM {self._table(suggestions)}"
+                f" WHERE {conditions} AND id > ? ORDER BY id LIMIT ?;",
+                (*parameters, after_id, limit),
+            )
+        return [row_to_question(row) for row in rows]
+
+    async def count_matching(
+        self,
+        guild_id: int,
+        suggestions: bool,
+        asked_by: int | None = None,
+        search: str | None = None,
+    ) -> int:
+        conditions, parameters = self._filter_conditions(guild_id, asked_by, search)
+        async with self.connect() as db:
+            row = await (
+                await db.execute(
+                    f"SELECT COUNT(*) FROM {self._table(suggestions)} WHERE {conditions};",
+                    parameters,
+                )
+            ).fetchone()
+        return row[0]
+
+    async def get_random_question(self, guild_id: int) -> dict | None:
+        # The position is picked in the same statement that reads it, so a question
+        # removed in between can't leave it empty or moved.
+        async with self.connect() as db:
+            row = await (
+                await db.execute(
+                    "SELECT id, question, asked_by FROM questions"
+                    " WHERE guild_id = ?1 AND position = ("
+                    "SELECT (random() & 0x7FFFFFFFFFFFFFFF) % (MAX(position) + 1)"
+                    " FROM questions WHERE guild_id = ?1);",
+                    (uint_to_bytes(guild_id),),
+                )
+            ).fetchone()
+        return row_to_question(row) if row else None
+
+    async def add_question(self, guild_id: int, question: str, asked_by: int) -> int:
+        async with self.connect() as db:
+            cursor = await db.execute(
+                "INSERT INTO questions(guild_id, position, question, asked_by)"
+                " VALUES (?, (SELECT COALESCE(MAX(position) + 1, 0) FROM questions WHERE guild_id = ?), ?, ?);",
+                (
+                    uint_to_bytes(guild_id),
+                    uint_to_bytes(guild_id),
+                    question,
+                    uint_to_bytes(asked_by),
+                ),
+            )
+            await db.commit()
+        return cursor.lastrowid
+
+    async def add_suggestion(self, guild_id: int, question: str, asked_by: int) -> int:
+        async with self.connect() as db:
+            cursor = await db.execute(
+                "INSERT INTO suggested_questions(guild_id, question, asked_by)"
+                " VALUES (?, ?, ?);",
+                (uint_to_bytes(guild_id), question, uint_to_bytes(asked_by)),
+            )
+            await db.commit()
+        return cursor.lastrowid
+
+    async def remove_question(self, guild_id: int, question_id: int) -> dict | None:
+        async with self.connect() as db:
+            question = await self._remove_question(db, guild_id, question_id)
+            await db.commit()
+        return question
+
+    async def remove_suggestion(self, guild_id: int, suggestion_id: int) -> dict | None:
+        async with self.connect() as db:
+            row = await (
+                await db.execute(
+                    "DELETE FROM suggested_questions WHERE guild_id = ? AND id = ?"
+                    " RETURNING id, question, asked_by;",
+                    (uint_to_bytes(guild_id), suggestion_id),
+                )
+            ).fetchone()
+            await db.commit()
+        return row_to_question(row) if row else None
+
+    async def approve_suggestion(
+        self, guild_id: int, suggestion_id: int, question_limit: int
+    ) -> tuple[dict, int]:
+        """
+        Move a suggestion into the main queue. Returns the suggestion and its id as a
+        question.
+        """
+        guild_id_bytes = uint_to_bytes(guild_id)
+        async with self.connect() as db:
+            if await self._count_questions(db, guild_id) >= question_limit:
+                raise QuestionLimitReachedError(question_limit)
+            row = await (
+                await db.execute(
+                    "DELETE FROM suggested_questions WHERE guild_id = ? AND id = ?"
+                    " RETURNING id, question, asked_by;",
+                    (guild_id_bytes, suggestion_id),
+                )
+            ).fetchone()
+            if row is None:
+                raise NoSuchSuggestionError(suggestion_id)
+            suggestion = row_to_question(row)
+            cursor = await db.execute(
+                "INSERT INTO questions(guild_id, position, question, asked_by)"
+                " VALUES (?, (SELECT COALESCE(MAX(position) + 1, 0) FROM questions WHERE guild_id = ?), ?, ?);",
+                (
+                    guild_id_bytes,
+                    guild_id_bytes,
+                    suggestion["question"],
+                    uint_to_bytes(suggestion["asked_by"]),
+                ),
+            )
+            await db.commit()
+        return suggestion, cursor.lastrowid
+
+    async def approve_all_suggestions(self, guild_id: int, question_limit: int) -> int:
+        """
+        Move every suggestion into the main queue in a single transaction.
+
+        Either all suggestions are approved or, if that would exceed
+        question_limit, none are. Returns the number of suggestions approved.
+        """
+        guild_id_bytes = uint_to_bytes(guild_id)
+        async with self.connect() as db:
+            # Nothing else can add questions between counting them and inserting
+            await db.execute("BEGIN IMMEDIATE;")
+            questions_count = await self._count_questions(db, guild_id)
+            suggestions_count = (
+                await (
+                    await db.execute(
+                        "SELECT COUNT(*) FROM suggested_questions WHERE guild_id = ?;",
+                        (guild_id_bytes,),
+                    )
+                ).fetchone()
+            )[0]
+            if questions_count + suggestions_count > question_limit:
+                await db.rollback()
+                raise QuestionLimitReachedError(question_limit)
+            await db.execute(
+                "INSERT INTO questions(guild_id, position, question, asked_by)"
+                " SELECT guild_id, ? + ROW_NUMBER() OVER (ORDER BY id) - 1, question, asked_by"
+                " FROM suggested_questions WHERE guild_id = ?;",
+                (questions_count, guild_id_bytes),
+            )
+            await db.execute(
+                "DELETE FROM suggested_questions WHERE guild_id = ?;",
+                (guild_id_bytes,),
+            )
+            await db.commit()
+        return suggestions_count
+
+    async def add_questions(
+        self, guild_id: int, questions: list[dict], question_limit: int
+    ) -> int:
+        """
+        Add many questions (dicts with "question" and "asked_by") to the main
+        queue in a single transaction, preserving their order.
+
+        Questions already in the queue are skipped, checked within the same
+        transaction. Either all the rest are added or, if that would exceed
+        question_limit, none are. Returns the number of questions added.
+        """
+        async with self.connect() as db:
+            await db.execute("BEGIN IMMEDIATE;")
+            seen_questions = {
+                normalize_question(row[0])
+                for row in await db.execute_fetchall(
+                    "SELECT question FROM questions WHERE guild_id = ?;",
+                    (uint_to_bytes(guild_id),),
+                )
+            }
+            new_questions = []
+            for question in questions:
+                normalized_question = normalize_question(question["question"])
+                if normalized_question not in seen_questions:
+                    seen_questions.add(normalized_question)
+                    new_questions.append(question)
+            if len(seen_questions) > question_limit:
+                await db.rollback()
+                raise QuestionLimitReachedError(question_limit)
+            await self._insert_questions(db, guild_id, new_questions)
+            await db.commit()
+        return len(new_questions)
+
+    async def import_config_questions(
+        self, guild_id: int, questions: list[dict], suggested_questions: list[dict]
+    ):
+        """
+        Copy question and suggestion lists in the format previously stored in
+        Config into the database, preserving their order.
+        """
+        async with self.connect() as db:
+            await self._insert_questions(db, guild_id, questions)
+            await db.executemany(
+                "INSERT INTO suggested_questions(guild_id, question, asked_by)"
+                " VALUES (?, ?, ?);",
+                (
+                    (
+                        uint_to_bytes(guild_id),
+                        question["question"],
+                        uint_to_bytes(question["asked_by"]),
+                    )
+                    for question in suggested_questions
+                ),
+            )
+            await db.commit()
+
+    async def _insert_questions(
+        self, db: aiosqlite.Connection, guild_id: int, questions: list[dict]
+    ):
+        guild_id_bytes = uint_to_bytes(guild_id)
+        questions_count = await self._count_questions(db, guild_id)
+        await db.executemany(
+            "INSERT INTO questions(guild_id, position, question, asked_by)"
+            " VALUES (?, ?, ?, ?);",
+            (
+                (
+                    guild_id_bytes,
+                    questions_count + i,
+                    question["question"],
+                    uint_to_bytes(question["asked_by"]),
+                )
+                for i, question in enumerate(questions)
+            ),
+        )
+
+    def _table(self, suggestions: bool) -> str:
+        return "suggested_questions" if suggestions else "questions"
+
+    def _filter_conditions(
+        self, guild_id: int, asked_by: int | None, search: str | None
+    ) -> tuple[str, tuple]:
+        conditions = ["guild_id = ?"]
+        parameters = [uint_to_bytes(guild_id)]
+        if asked_by is not None:
+            conditions.append("asked_by = ?")
+            parameters.append(uint_to_bytes(asked_by))
+        if search:
+            # lower() in SQLite only folds ASCII, which is good enough for searching.
+            conditions.append("instr(lower(question), lower(?)) > 0")
+            parameters.append(search)
+        return " AND ".join(conditions), tuple(parameters)
+
+    async def _count_questions(self, db: aiosqlite.Connection, guild_id: int) -> int:
+        # Positions are dense, so this is an index lookup rather than a scan.
+        row = await (
+            await db.execute(
+                "SELECT MAX(position) FROM questions WHERE guild_id = ?;",
+                (uint_to_bytes(guild_id),),
+            )
+        ).fetchone()
+        return row[0] + 1 if row[0] is not None else 0
+
+    async def _remove_question(
+        self, db: aiosqlite.Connection, guild_id: int, question_id: int
+    ) -> dict | None:
+        guild_id_bytes = uint_to_bytes(guild_id)
+        row = await (
+            await db.execute(
+                "DELETE FROM questions WHERE guild_id = ? AND id = ?"
+                " RETURNING id, question, asked_by, position;",
+                (guild_id_bytes, question_id),
+            )
+        ).fetchone()
+        if row is None:
+            return None
+        freed_position = row[3]
+        await db.execute(
+            "UPDATE questions SET position = ?"
+            " WHERE guild_id = ? AND position > ?"
+            " AND position = (SELECT MAX(position) FROM questions WHERE guild_id = ?);",
+            (freed_position, guild_id_bytes, freed_position, guild_id_bytes),
+        )
+        return row_to_question(row)
+
+
+def uint_to_bytes(x: int):
+    if x < 0:
+        raise ValueError(f"x must be non-negative (got {x})")
+    byte_length, remainder = divmod(x.bit_length(), 8)
+    if remainder:
+        byte_length += 1
+    return x.to_bytes(byte_length, byteorder="big", signed=False)
+
+
+def bytes_to_uint(b: bytes):
+    return int.from_bytes(b, byteorder="big", signed=False)
+
+
+def row_to_question(row) -> dict:
+    return {"id": row[0], "question": row[1], "asked_by": bytes_to_uint(row[2])}
@@ -0,0 +1,130 @@
+import collections
+import re
+import unicodedata
+
+SHINGLE_SIZE = 3
+# Words dropped before shingling, so that questions aren't similar just because
+# they're both phrased as questions. If nothing else is left, they're kept.
+STOP_WORDS = frozenset(
+    "a an and are do does is it of or s the to what whats which would you your".split()
+)
+# Each question's MinHash signature is split into BANDS bands of ROWS_PER_BAND
+# hashes, and questions that match in any band are candidates. With these values a
+# pair with shingle similarity s is a candidate with probability about
+# 1 - (1 - s^3)^10: 90% at 0.6, 99% at 0.7 and under 8% at 0.2.
+BANDS = 10
+ROWS_PER_BAND = 3
+SIGNATURE_SIZE = BANDS * ROWS_PER_BAND
+# Questions whose shingle sets have at least this Jaccard similarity are near-duplicates
+NEAR_DUPLICATE_SIMILARITY = 0.6
+# Only this many candidates, those matching in the most bands, are compared exactly,
+# so a lookup stays fast however many similar questions a guild has.
+MAX_CANDIDATES_TO_COMPARE = 20
+
+
+def get_shingles(question: str) -> set[str]:
+    """
+    Return the set of SHINGLE_SIZE-character substrings of question after folding
+    case and compatibility characters, dropping punctuation and STOP_WORDS and
+    collapsing whitespace.
+    """
+    words = re.sub(
+        r"[\W_]+", " ", unicodedata.normalize("NFKC", question).casefold()
+    ).split()
+    text = " ".join([word for word in words if word not in STOP_WORDS] or words)
+    if len(text) <= SHINGLE_SIZE:
+        return {text}
+    return {text[i : i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+
+
+def get_band_keys(shingles: set[str]) -> list[int]:
+    # One permutation hashing: rather than hashing every shingle once per signature
+    # element, hash it once and use the hash to pick the element it competes for. str
+    # hashes differ between processes, which is fine since the index is only ever kept
+    # in memory.
+    minimums = [None] * SIGNATURE_SIZE
+    for shingle in shingles:
+        value, element = divmod(hash(shingle) & 0xFFFF_FFFF_FFFF_FFFF, SIGNATURE_SIZE)
+        if minimums[element] is None or value < minimums[element]:
+            minimums[element] = value
+    # Elements no shingle went to borrow the value of the next filled one, tagged with
+    # how far away it was so that borrowed values don't match values that weren't.
+    signature = []
+    for element in range(SIGNATURE_SIZE):
+        for distance in range(SIGNATURE_SIZE):
+            value = minimums[(element + distance) % SIGNATURE_SIZE]
+            if value is not None:
+                signature.append((distance, value))
+                break
+    return [
+        hash((band, *signature[band * ROWS_PER_BAND : (band + 1) * ROWS_PER_BAND]))
+        for band in range(BANDS)
+    ]
+
+
+class SimilarityIndex:
+    """
+    A MinHash LSH index of a guild's questions and suggestions, for finding
+    near-duplicates of a new question without comparing it against every one.
+
+    Entries are keyed by (suggestion, id), where suggestion is whether the id is a
+    suggestion id rather than a question id. Adding and removing entries is
+    idempotent.
+    """
+
+    def __init__(self):
+        # key -> question
+        self.questions = {}
+        # band key -> keys of the entries with that band
+        self.buckets = collections.defaultdict(set)
+
+    def add(self, key: tuple[bool, int], question: str):
+        self.remove(key)
+        self.questions[key] = question
+        for band_key in get_band_keys(get_shingles(question)):
+            self.buckets[band_key].add(key)
+
+    def remove(self, key: tuple[bool, int]):
+        question = self.questions.pop(key, None)
+        if question is None:
+            return
+        for band_key in get_band_keys(get_shingles(question)):
+            bucket = self.buckets[band_key]
+            bucket.discard(key)
+            if not bucket:
+                del self.buckets[band_key]
+
+    def find_near_duplicates(
+        self, question: str
+    ) -> list[tuple[tuple[bool, int], str, float]]:
+        """
+        Return (key, question, similarity) for the entries that are near-duplicates
+        of question, most similar first.
+        """
+        shingles = get_shingles(question)
+        band_matches = collections.Counter()
+        for band_key in get_band_keys(shingles):
+            band_matches.update(self.buckets.get(band_key, ()))
+        near_duplicates = []
+        for key, _ in band_matches.most_common(MAX_CANDIDATES_TO_COMPARE):
+            candidate_shingles = get_shingles(self.questions[key])
+            similarity = len(shingles & candidate_shingles) / len(
+                shingles | candidate_shingles
+            )
+            if similarity >= NEAR_DUPLICATE_SIMILARITY:
+                near_duplicates.append((key, self.questions[key], similarity))
+        near_duplicates.sort(key=lambda near_duplicate: near_duplicate[2], reverse=True)
+        return near_duplicates
+
+
+def build_similarity_index(
+    questions: list[dict], suggestions: list[dict]
+) -> SimilarityIndex:
+    """
+    Build an index of questions and suggestions as returned by QuestionStore.
+    """
+    similarity_index = SimilarityIndex()
+    for suggestion, entries in ((False, questions), (True, suggestions)):
+        for entry in entries:
+            similarity_index.add((suggestion, entry["id"]), entry["question"])
+    return similarity_index
@@ -1,6 +1,28 @@
 import discord
 from redbot.core import commands
 import redbot.core
+import asyncio
+import re
+
+MAX_DESTINATIONS = 5
+# Only mentions and ids are accepted as destinations; channel names are not, since
+# the topic that follows could begin with a word that's also a channel's name.
+DESTINATION_RE = re.compile(r"<#([0-9]{15,20})>|([0-9]{15,20})")
+
+
+class DestinationConverter(commands.Converter):
+    async def convert(
+        self, ctx: commands.GuildContext, argument: str
+    ) -> discord.abc.GuildChannel | discord.Thread:
+        match = DESTINATION_RE.fullmatch(argument)
+        if match is None:
+            raise commands.BadArgument(f"{argument!r} is not a channel mention or id.")
+        destination = ctx.guild.get_channel_or_thread(
+            int(match.group(1) or match.group(2))
+        )
+        if destination is None:
+            raise commands.BadArgument(f"Channel {argument!r} not found.")
+        return destination
 
 
 class Teleport(commands.Cog):
@@ -12,29 +34,47 @@ class Teleport(commands.Cog):
     async def teleport(
         self,
         ctx: commands.GuildContext,
-        destination: discord.abc.GuildChannel | discord.Thread,
+        destinations: commands.Greedy[DestinationConverter],
         *,
         topic: str | None,
     ):
-        if isinstance(destination, discord.Thread):
-            parent = destination.parent
-        else:
-            parent = destination
-
-        if not (
-            hasattr(destination, "send")
-            and parent.permissions_for(ctx.author).send_messages
-            and (
-                not isinstance(destination, discord.Thread)
-                or parent.permissions_for(ctx.author).send_messages_in_threads
-            )
-        ) or (
-            (type(ctx.channel) is type(destination))
-            and ctx.channel.id == destination.id
-        ):
+        """
+        Open a portal from this channel to one or more channels or threads.
+        """
+        # Deduplicate while keeping the order given
+        destinations = [
+            *{destination.id: destination for destination in destinations}.values()
+        ]
+
+        if not destinations or len(destinations) > MAX_DESTINATIONS:
             await ctx.react_quietly("❌")
             return
 
+        for destination in destinations:
+            if isinstance(destination, discord.Thread):
+                parent = destination.parent
+            else:
+                parent = destination
+
+            # Both the author and the bot must be able to send there
+            if not (
+                hasattr(destination, "send")
+                and parent is not None
+                and all(
+                    parent.permissions_for(member).send_messages
+                    and (
+                        not isinstance(destination, discord.Thread)
+                        or parent.permissions_for(member).send_messages_in_threads
+                    )
+                    for member in (ctx.author, ctx.me)
+                )
+            ) or (
+                (type(ctx.channel) is type(destination))
+                and ctx.channel.id == destination.id
+            ):
+                await ctx.react_quietly("❌")
+                return
+
         formatted_topic = (
             redbot.core.utils.chat_formatting.italics(topic) if topic else ""
         )
@@ -47,16 +87,41 @@ class Teleport(commands.Cog):
             + f"\n*(done by {ctx.author.mention})*"
         )
         source_message = await ctx.send(
-            portal_to_template.format(dest=destination.mention),
+            portal_to_template.format(
+                dest=", ".join(destination.mention for destination in destinations)
+            ),
             allowed_mentions=discord.AllowedMentions.none(),
         )
-        dest_message = await destination.send(
+        dest_content = (
             f"Portal opened from {source_message.jump_url}"
             + (f" : {formatted_topic}" if formatted_topic else "")
-            + f"\n*(done by {ctx.author.mention})*",
-            allowed_mentions=discord.AllowedMentions.none(),
+            + f"\n*(done by {ctx.author.mention})*"
+        )
+        dest_messages = await asyncio.gather(
+            *(
+                destination.send(
+                    dest_content, allowed_mentions=discord.AllowedMentions.none()
+                )
+                for destination in destinations
+            ),
+            return_exceptions=True,
         )
         await source_message.edit(
-            content=portal_to_template.format(dest=dest_message.jump_url),
+            content=portal_to_template.format(
+                dest=", ".join(
+                    # If sending to a destination failed, leave its plain mention in place
+                    (
+                        destination.mention
+                        if isinstance(dest_message, BaseException)
+                        else dest_message.jump_url
+                    )
+                    for destination, dest_message in zip(destinations, dest_messages)
+                )
+            ),
             allowed_mentions=discord.AllowedMentions.none(),
         )
+        for dest_message in dest_messages:
+            if isinstance(dest_message, BaseException) and not isinstance(
+                dest_message, discord.HTTPException
+            ):
+                raise dest_message
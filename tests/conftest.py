@@ -0,0 +1,5 @@
+import pathlib
+import sys
+
+# The cogs aren't installed as packages, so they're imported from the repository root
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
@@ -0,0 +1,77 @@
+import collections
+import math
+import random
+from markov.approximate_model import ApproximateModel
+
+SKETCH_WIDTH = 1 << 12
+SKETCH_DEPTH = 4
+MAX_FIRST_TOKENS = 500
+COMPLETIONS_PER_TOKEN = 16
+PAIRS = 100_000
+
+
+def build_model() -> tuple[ApproximateModel, collections.Counter]:
+    """
+    Add Zipf-distributed pairs, like the word pairs in real messages, to a model and
+    count them exactly as well.
+    """
+    rng = random.Random(1)
+    vocabulary = [f"word{i}" for i in range(5000)]
+    weights = [1 / (i + 1) ** 1.1 for i in range(len(vocabulary))]
+    model = ApproximateModel(
+        SKETCH_WIDTH, SKETCH_DEPTH, MAX_FIRST_TOKENS, COMPLETIONS_PER_TOKEN
+    )
+    exact_counts = collections.Counter()
+    for first_token, second_token in zip(
+        rng.choices(vocabulary, weights, k=PAIRS),
+        rng.choices(vocabulary, weights, k=PAIRS),
+    ):
+        model.add(first_token, second_token)
+        exact_counts[first_token, second_token] += 1
+    return model, exact_counts
+
+
+def test_sketch_error_bounds():
+    model, exact_counts = build_model()
+    bound = math.e * model.total / SKETCH_WIDTH
+    errors = [
+        model.estimate(first_token, second_token) - count
+        for (first_token, second_token), count in exact_counts.items()
+    ]
+    assert min(errors) >= 0
+    assert sum(error > bound for error in errors) / len(errors) <= math.exp(
+        -SKETCH_DEPTH
+    )
+
+
+def test_table_error_bounds():
+    model, exact_counts = build_model()
+    completions = collections.defaultdict(dict)
+    for (first_token, second_token), count in exact_counts.items():
+        completions[first_token][second_token] = count
+    checked_tables = 0
+    for first_token, table in model.tables.items():
+        first_token_total = sum(completions[first_token].values())
+        # The guarantees hold for the pairs added since the table was created
+        if model.first_token_totals[first_token] != first_token_total:
+            continue
+        checked_tables += 1
+        max_error = first_token_total / COMPLETIONS_PER_TOKEN
+        for second_token, count in completions[first_token].items():
+            if count > max_error:
+                assert second_token in table
+        for second_token, estimate in model.get_completions(first_token):
+            count = completions[first_token].get(second_token, 0)
+            assert count <= estimate <= count + max_error
+    assert checked_tables >= MAX_FIRST_TOKENS // 2
+
+
+def test_save_and_load(tmp_path):
+    model, _exact_counts = build_model()
+    path = tmp_path / "model.npz"
+    model.save(path)
+    loaded_model = ApproximateModel.load(path)
+    assert (loaded_model.sketch == model.sketch).all()
+    assert loaded_model.tables == model.tables
+    assert loaded_model.first_token_totals == model.first_token_totals
+    assert loaded_model.total == model.total
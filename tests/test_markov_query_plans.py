@@ -0,0 +1,58 @@
+import aiosqlite
+import asyncio
+import pathlib
+from markov import query_plans
+from markov.query_plans import HOT_QUERIES, check_query_plans
+
+MIGRATIONS_PATH = (
+    pathlib.Path(__file__).resolve().parents[1] / "markov" / "data" / "migrations"
+)
+
+
+async def get_query_plans(*statements: str) -> dict[str, tuple[list[str], str | None]]:
+    """
+    Return description -> (query plan, problem or None) for each of HOT_QUERIES, on a
+    new database with every migration applied and then statements run.
+    """
+    async with aiosqlite.connect(":memory:") as db:
+        await db.executescript((MIGRATIONS_PATH / "init.sql").read_text("utf-8"))
+        for migration_path in sorted(MIGRATIONS_PATH.glob("[0-9]*.sql")):
+            await db.executescript(migration_path.read_text("utf-8"))
+        for statement in statements:
+            await db.execute(statement)
+        return {
+            description: (plan, problem)
+            for description, plan, problem in await check_query_plans(db)
+        }
+
+
+def test_hot_queries_use_indexes():
+    plans = asyncio.run(get_query_plans())
+    assert len(plans) == len(HOT_QUERIES)
+    for description, (plan, problem) in plans.items():
+        assert not any(step.startswith("SCAN ") for step in plan), (description, plan)
+        assert problem is None, (description, plan, problem)
+
+
+def test_table_scan_is_a_problem(monkeypatch):
+    monkeypatch.setattr(
+        query_plans,
+        "HOT_QUERIES",
+        [
+            (
+                "pairs by frequency",
+                "SELECT first_token FROM guild_pairs WHERE frequency = ?;",
+                "PRIMARY KEY",
+            )
+        ],
+    )
+    _plan, problem = asyncio.run(get_query_plans())["pairs by frequency"]
+    assert problem is not None and problem.startswith("table scan")
+
+
+def test_sort_is_a_problem():
+    plans = asyncio.run(
+        get_query_plans("DROP INDEX idx_guild_pairs__guild_id__first_token__frequency;")
+    )
+    _plan, problem = plans["guild completions by frequency"]
+    assert problem == "sorts in a temporary B-tree"
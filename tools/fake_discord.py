@@ -0,0 +1,433 @@
+"""
+An offline stand-in for Discord and Red, for running the cogs in this repo without a
+live bot. See replay.py for how it's used.
+
+Guilds, channels, members and messages are real discord.py objects built from
+synthetic gateway payloads, so the cogs' isinstance checks and attribute accesses
+behave as they would on Discord. REST calls go to FakeDiscord.respond() instead of
+the network and are counted, and Config is backed by MemoryDriver instead of disk.
+"""
+
+import aiohttp.web
+import discord
+import discord.http
+import discord.ext.commands
+from redbot.core import commands
+from redbot.core import data_manager
+import redbot.core.config
+from redbot.core._drivers.base import BaseDriver
+import asyncio
+import collections
+import copy
+import datetime
+import json
+import pathlib
+import urllib.parse
+
+PREFIX = "!"
+# https://support.discord.com/hc/en-us/articles/13102146394007
+MAX_PINS_PER_CHANNEL = 250
+# https://discord.com/developers/docs/topics/opcodes-and-status-codes#json
+UNKNOWN_MESSAGE_ERROR_CODE = 10008
+MAXIMUM_PINS_REACHED_ERROR_CODE = 30003
+BOT_USER_ID = 1
+
+
+class MemoryDriver(BaseDriver):
+    """
+    A Config driver that keeps everything in memory, with the same semantics as
+    Red's JSON driver but without writing to disk. Writes are counted per cog in
+    MemoryDriver.writes.
+    """
+
+    data = {}
+    writes = collections.Counter()
+
+    def __init__(self, cog_name: str, identifier: str, **_kwargs):
+        super().__init__(cog_name, identifier)
+        MemoryDriver.data.setdefault(cog_name, {})
+
+    @classmethod
+    async def initialize(cls, **storage_details):
+        pass
+
+    @classmethod
+    async def teardown(cls):
+        pass
+
+    @staticmethod
+    def get_config_details():
+        return {}
+
+    async def get(self, identifier_data):
+        partial = MemoryDriver.data[self.cog_name]
+        for identifier in identifier_data.to_tuple()[1:]:
+            partial = partial[identifier]
+        return copy.deepcopy(partial)
+
+    async def set(self, identifier_data, value=None):
+        partial = MemoryDriver.data[self.cog_name]
+        identifiers = identifier_data.to_tuple()[1:]
+        for identifier in identifiers[:-1]:
+            partial = partial.setdefault(identifier, {})
+        # Round trip through JSON like the JSON driver, so that non-string keys are
+        # converted the same way.
+        partial[identifiers[-1]] = json.loads(json.dumps(value))
+        MemoryDriver.writes[self.cog_name] += 1
+
+    async def clear(self, identifier_data):
+        partial = MemoryDriver.data[self.cog_name]
+        identifiers = identifier_data.to_tuple()[1:]
+        try:
+            for identifier in identifiers[:-1]:
+                partial = partial[identifier]
+            del partial[identifiers[-1]]
+        except KeyError:
+            return
+        MemoryDriver.writes[self.cog_name] += 1
+
+    @classmethod
+    async def aiter_cogs(cls):
+        for cog_name, cog_data in cls.data.items():
+            for identifier in cog_data:
+                yield cog_name, identifier
+
+
+def install_memory_config(data_path: pathlib.Path):
+    """
+    Make Config use MemoryDriver. data_path is still used for cog_data_path(), since
+    the cogs keep their SQLite databases there.
+    """
+    data_manager.basic_config = {
+        "DATA_PATH": str(data_path),
+        "STORAGE_TYPE": "JSON",
+        "STORAGE_DETAILS": {},
+        "CUSTOM_INFO": None,
+        "COG_PATH_APPEND": "cogs",
+        "CORE_PATH_APPEND": "core",
+    }
+    data_manager.instance_name = "replay"
+    MemoryDriver.data.clear()
+    MemoryDriver.writes.clear()
+    redbot.core.config.get_driver = lambda cog_name, identifier, **kwargs: (
+        MemoryDriver(cog_name, identifier)
+    )
+
+
+class FakeResponse:
+    """
+    Just enough of an aiohttp response for discord.HTTPException.
+    """
+
+    def __init__(self, status: int, reason: str):
+        self.status = status
+        self.reason = reason
+
+
+class RecordingHTTPClient(discord.http.HTTPClient):
+    """
+    Sends every REST call to a FakeDiscord instead of the network, counting calls by
+    method and route.
+    """
+
+    def __init__(self, fake_discord: "FakeDiscord", latency_secs: float = 0):
+        super().__init__(asyncio.get_running_loop())
+        self.fake_discord = fake_discord
+        self.latency_secs = latency_secs
+        self.calls = collections.Counter()
+
+    async def request(self, route, *, files=None, form=None, **kwargs):
+        self.calls[f"{route.method} {route.path}"] += 1
+        if self.latency_secs:
+            await asyncio.sleep(self.latency_secs)
+        json_body = kwargs.get("json")
+        for field in form or ():
+            # Requests with files send their JSON as a multipart field instead
+            if field["name"] == "payload_json":
+                json_body = json.loads(field["value"])
+        return self.fake_discord.respond(route, json_body)
+
+
+class FakeDiscord:
+    """
+    The state of a fake Discord, with a bot user that's a member of every guild.
+
+    now is the fake wall clock in seconds since the epoch. It's used for message
+    timestamps and snowflakes, and replay.py also uses it for time.time().
+    """
+
+    def __init__(self, now: float, rest_latency_secs: float = 0):
+        self.now = now
+        self.sequence = 0
+        self.bot = discord.ext.commands.Bot(
+            command_prefix=PREFIX, intents=discord.Intents.all(), max_messages=1000
+        )
+        self.http = RecordingHTTPClient(self, rest_latency_secs)
+        self.bot.http = self.http
+        self.state = self.bot._connection
+        self.state.http = self.http
+        # Normally set on login; typing() needs it
+        self.bot.loop = self.state.loop = asyncio.get_running_loop()
+        # Nobody reacts or presses buttons in a replay, so menus use reactions, like
+        # Red does by default, and stay open until they time out.
+        self.bot.use_buttons = self.use_buttons
+        self.bot.wait_for = self.wait_for
+        # The fake Discord's cache is complete from the start
+        self.bot.wait_until_red_ready = self.wait_until_red_ready
+        self.state.user = discord.ClientUser(
+            state=self.state, data=self.user_payload(BOT_USER_ID, bot=True)
+        )
+        # message id -> message payload, for messages sent through REST
+        self.message_payloads = {}
+        # channel id -> {pinned message id: when it was pinned}, oldest first
+        self.pins = collections.defaultdict(dict)
+
+    @staticmethod
+    async def use_buttons() -> bool:
+        return False
+
+    @staticmethod
+    async def wait_until_red_ready():
+        pass
+
+    @staticmethod
+    async def wait_for(_event: str, *, check=None, timeout: float | None = None):
+        # No event ever comes, so this only ends by timing out or being cancelled
+        await asyncio.wait_for(asyncio.get_running_loop().create_future(), timeout)
+
+    def next_snowflake(self) -> int:
+        self.sequence += 1
+        return discord.utils.time_snowflake(
+            datetime.datetime.fromtimestamp(self.now, datetime.timezone.utc)
+        ) + (self.sequence % 4096)
+
+    def timestamp(self) -> str:
+        return datetime.datetime.fromtimestamp(
+            self.now, datetime.timezone.utc
+        ).isoformat()
+
+    @staticmethod
+    def user_payload(user_id: int, bot: bool = False) -> dict:
+        return {
+            "id": str(user_id),
+            "username": f"user{user_id}",
+            "discriminator": "0",
+            "global_name": None,
+            "avatar": None,
+            "bot": bot,
+        }
+
+    def add_guild(
+        self, guild_id: int, channel_ids: list[int], member_ids: list[int]
+    ) -> discord.Guild:
+        member_payloads = [
+            {
+                "user": self.user_payload(member_id, bot=member_id == BOT_USER_ID),
+                "roles": [],
+                "joined_at": self.timestamp(),
+                "deaf": False,
+                "mute": False,
+                "flags": 0,
+            }
+            for member_id in [BOT_USER_ID, *member_ids]
+        ]
+        return self.state._add_guild_from_data(
+            {
+                "id": str(guild_id),
+                "name": f"guild{guild_id}",
+                "owner_id": str(member_ids[0] if member_ids else BOT_USER_ID),
+                "roles": [
+                    {
+                        "id": str(guild_id),
+                        "name": "@everyone",
+                        "permissions": str(discord.Permissions.all().value),
+                        "position": 0,
+                        "color": 0,
+                        "hoist": False,
+                        "managed": False,
+                        "mentionable": False,
+                    }
+                ],
+                "channels": [
+                    {
+                        "id": str(channel_id),
+                        "type": discord.ChannelType.text.value,
+                        "name": f"channel{channel_id}",
+                        "position": position,
+                        "permission_overwrites": [],
+                        "guild_id": str(guild_id),
+                    }
+                    for position, channel_id in enumerate(channel_ids)
+                ],
+                "members": member_payloads,
+                "member_count": len(member_payloads),
+                "emojis": [],
+                "stickers": [],
+                "features": [],
+                "threads": [],
+                "voice_states": [],
+                "presences": [],
+            }
+        )
+
+    def message_payload(
+        self, channel, author_id: int, content: str, embeds: list | None = None
+    ) -> dict:
+        return {
+            "id": str(self.next_snowflake()),
+            "channel_id": str(channel.id),
+            "guild_id": str(channel.guild.id),
+            "author": self.user_payload(author_id, bot=author_id == BOT_USER_ID),
+            "content": content,
+            "timestamp": self.timestamp(),
+            "edited_timestamp": None,
+            "tts": False,
+            "mention_everyone": False,
+            "mentions": [],
+            "mention_roles": [],
+            "attachments": [],
+            "embeds": embeds or [],
+            "pinned": False,
+            "type": 0,
+        }
+
+    def receive_message(self, channel, author_id: int, content: str):
+        """
+        Create a message as if it had arrived over the gateway.
+        """
+        message = self.state.create_message(
+            channel=channel,
+            data=self.message_payload(channel, author_id, content),
+        )
+        self.state._messages.append(message)
+        return message
+
+    def make_context(self, message, command) -> commands.Context:
+        return commands.Context(
+            message=message,
+            bot=self.bot,
+            view=discord.ext.commands.view.StringView(message.content),
+            prefix=PREFIX,
+            command=command,
+            invoked_with=command.name,
+        )
+
+    def not_found(self, message: str):
+        return discord.NotFound(
+            FakeResponse(404, "Not Found"),
+            {"code": UNKNOWN_MESSAGE_ERROR_CODE, "message": message},
+        )
+
+    def respond(self, route, json_body: dict | None):
+        """
+        Return what Discord would for a REST call, for the calls the cogs make.
+        Anything else gets an empty response.
+        """
+        path = route.path
+        channel_id = int(route.channel_id) if route.channel_id is not None else None
+        # Route only keeps some of its parameters, but message ids always come last
+        last_id = route.url.rsplit("/", 1)[1]
+        if path == "/channels/{channel_id}/messages" and route.method == "POST":
+            channel = self.bot.get_channel(channel_id)
+            payload = self.message_payload(
+                channel,
+                BOT_USER_ID,
+                json_body.get("content") or "",
+                json_body.get("embeds"),
+            )
+            self.message_payloads[int(payload["id"])] = payload
+            return payload
+        if path == "/channels/{channel_id}/messages/{message_id}":
+            try:
+                payload = self.message_payloads[int(last_id)]
+            except KeyError:
+                raise self.not_found("Unknown Message")
+            if route.method == "PATCH":
+                payload.update(
+                    {key: value for key, value in json_body.items() if key in payload}
+                )
+                payload["edited_timestamp"] = self.timestamp()
+            return payload
+        if path == "/channels/{channel_id}/messages/pins/{message_id}":
+            pins = self.pins[channel_id]
+            if route.method == "PUT":
+                if len(pins) >= MAX_PINS_PER_CHANNEL:
+                    raise discord.HTTPException(
+                        FakeResponse(400, "Bad Request"),
+                        {
+                            "code": MAXIMUM_PINS_REACHED_ERROR_CODE,
+                            "message": "Maximum number of pins reached",
+                        },
+                    )
+                if int(last_id) not in pins:
+                    pins[int(last_id)] = self.timestamp()
+            else:
+                pins.pop(int(last_id), None)
+            return None
+        if path == "/channels/{channel_id}/messages/pins":
+            channel = self.bot.get_channel(channel_id)
+            return {
+                "items": [
+                    {
+                        "message": self.message_payloads.get(message_id)
+                        or {
+                            **self.message_payload(channel, BOT_USER_ID, ""),
+                            "id": str(message_id),
+                        },
+                        "pinned_at": pinned_at,
+                    }
+                    for message_id, pinned_at in reversed(self.pins[channel_id].items())
+                ],
+                "has_more": False,
+            }
+        if route.method == "GET" and path in (
+            "/guilds/{guild_id}",
+            "/channels/{channel_id}",
+            "/guilds/{guild_id}/members/{member_id}",
+        ):
+            # Everything that exists is already in the gateway cache
+            raise self.not_found("Unknown")
+        return None
+
+
+class WikipediaStandIn:
+    """
+    A local HTTP server that answers Special:Search like Wikipedia does: a search
+    for an existing title redirects to the article, and anything else stays on the
+    search page.
+    """
+
+    def __init__(self, titles):
+        self.titles = {title.casefold() for title in titles}
+        self.requests = 0
+        self.runner = None
+        self.url = None
+
+    async def start(self):
+        app = aiohttp.web.Application()
+        app.router.add_route("*", "/wiki/Special:Search", self.search)
+        app.router.add_route("*", "/wiki/{title}", self.article)
+        self.runner = aiohttp.web.AppRunner(app)
+        await self.runner.setup()
+        site = aiohttp.web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = self.runner.addresses[0][1]
+        self.url = f"http://127.0.0.1:{port}"
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+    async def search(self, request):
+        self.requests += 1
+        title = request.query.get("search", "")
+        if title.casefold() in self.titles:
+            raise aiohttp.web.HTTPFound(
+                f"/wiki/{urllib.parse.quote(title.replace(' ', '_'))}"
+            )
+        return aiohttp.web.Response(text="Search results")
+
+    async def article(self, request):
+        self.requests += 1
+        if request.match_info["title"].replace("_", " ").casefold() in self.titles:
+            return aiohttp.web.Response(text="Article")
+        raise aiohttp.web.HTTPNotFound()
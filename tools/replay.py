@@ -0,0 +1,363 @@
+"""
+Replay a stream of Discord events through the cogs in this repo offline, and report
+how long each handler took, which REST calls were made and how many Config writes
+there were.
+
+    python tools/replay.py [TRACE] [--cogs COG ...] [--seed SEED]
+        [--messages COUNT] [--save-trace PATH] [--rest-latency-ms MS]
+
+TRACE is a file of JSON objects, one per line. Without it, a synthetic trace is
+generated from --seed, so runs are repeatable; --save-trace writes it out for
+editing or reuse. Each object has an "event" key:
+
+    {"event": "guild", "id": ..., "channels": [...], "members": [...]}
+    {"event": "message", "channel": ..., "author": ..., "content": "..."}
+    {"event": "command", "channel": ..., "author": ..., "command": "qotd add",
+        "args": [...], "kwargs": {...}}
+    {"event": "tick", "time": ...}
+    {"event": "member_remove", "guild": ..., "member": ...}
+
+A tick sets the fake clock (which time.time() follows during the replay) and runs
+every cog's background loops once. Command arguments of the form {"channel": id},
+{"member": id} or {"recent_message": channel id} are turned into the channel, the
+member, or the id of the latest message in that channel. Commands are called
+directly, so checks and argument converters are skipped. Nobody reacts to menus, so
+a command that opens one takes as long as the menu's timeout (30 seconds by
+default).
+"""
+
+import discord.ext.tasks
+import argparse
+import collections
+import importlib
+import json
+import pathlib
+import random
+import statistics
+import sys
+import tempfile
+import time
+import traceback
+import unittest.mock
+from fake_discord import *
+
+REPO_PATH = pathlib.Path(__file__).resolve().parent.parent
+ALL_COGS = ["markov", "question_of_the_day", "wplink", "pindelegate", "teleport"]
+SYNTHETIC_START_TIME = 1_700_000_000
+SYNTHETIC_WORDS = (
+    "the a an and or but if then so because question day bot server channel"
+    " message pin portal chain word random today tomorrow yesterday good bad"
+    " interesting weird funny cat dog python discord red cog markov data"
+).split()
+WIKIPEDIA_TITLES = ["Markov chain", "Discord", "Python (programming language)"]
+
+
+class Replay:
+    def __init__(self, fake_discord: FakeDiscord):
+        self.fake_discord = fake_discord
+        self.bot = fake_discord.bot
+        self.cogs = []
+        # (cog, loop) for each background loop, run on every tick
+        self.loops = []
+        # handler name -> latencies in seconds
+        self.latencies = collections.defaultdict(list)
+        self.errors = collections.Counter()
+        # channel id -> id of the latest message received there
+        self.recent_message_ids = {}
+
+    async def load_cog(self, package_name: str):
+        package = importlib.import_module(package_name)
+        cog_names = {*self.bot.cogs}
+        await self.run_handler(f"setup ({package_name})", package.setup(self.bot))
+        for cog_name, cog in self.bot.cogs.items():
+            if cog_name in cog_names:
+                continue
+            self.cogs.append(cog)
+            for attribute_name, value in vars(type(cog)).items():
+                if isinstance(value, discord.ext.tasks.Loop):
+                    loop = getattr(cog, attribute_name)
+                    # Ticks drive the loops instead, so that they follow the trace
+                    loop.cancel()
+                    self.loops.append((cog, loop))
+
+    async def unload_cogs(self):
+        for cog in self.cogs:
+            await self.run_handler(
+                f"cog_unload ({cog.qualified_name})",
+                self.bot.remove_cog(cog.qualified_name),
+            )
+
+    async def run_handler(self, name: str, coroutine):
+        start_time = time.perf_counter()
+        try:
+            await coroutine
+        except Exception:
+            if not self.errors[name]:
+                print(f"Error in {name}:", file=sys.stderr)
+                traceback.print_exc()
+            self.errors[name] += 1
+        finally:
+            self.latencies[name].append(time.perf_counter() - start_time)
+
+    async def dispatch(self, event_name: str, *args):
+        for cog in self.cogs:
+            for listener_name, listener in cog.get_listeners():
+                if listener_name == event_name:
+                    await self.run_handler(
+                        f"{listener_name} ({cog.qualified_name})", listener(*args)
+                    )
+
+    def convert_argument(self, channel, argument):
+        if isinstance(argument, list):
+            return [self.convert_argument(channel, element) for element in argument]
+        if isinstance(argument, dict):
+            if "channel" in argument:
+                return self.bot.get_channel(argument["channel"])
+            if "member" in argument:
+                return channel.guild.get_member(argument["member"])
+            if "recent_message" in argument:
+                return self.recent_message_ids.get(argument["recent_message"])
+        return argument
+
+    async def replay_event(self, event: dict):
+        if event["event"] == "guild":
+            self.fake_discord.add_guild(
+                event["id"], event["channels"], event["members"]
+            )
+        elif event["event"] == "message":
+            channel = self.bot.get_channel(event["channel"])
+            message = self.fake_discord.receive_message(
+                channel, event["author"], event["content"]
+            )
+            self.recent_message_ids[channel.id] = message.id
+            await self.dispatch("on_message", message)
+            await self.dispatch("on_message_without_command", message)
+        elif event["event"] == "command":
+            command = self.bot.get_command(event["command"])
+            if command is None:
+                raise ValueError(f"No command {event['command']!r}")
+            channel = self.bot.get_channel(event["channel"])
+            message = self.fake_discord.receive_message(
+                channel, event["author"], f"{PREFIX}{event['command']}"
+            )
+            args = self.convert_argument(channel, event.get("args", []))
+            kwargs = {
+                key: self.convert_argument(channel, value)
+                for key, value in event.get("kwargs", {}).items()
+            }
+            await self.run_handler(
+                f"command {command.qualified_name}",
+                command.callback(
+                    command.cog,
+                    self.fake_discord.make_context(message, command),
+                    *args,
+                    **kwargs,
+                ),
+            )
+        elif event["event"] == "tick":
+            self.fake_discord.now = event["time"]
+            for cog, loop in self.loops:
+                await self.run_handler(
+                    f"loop {loop.coro.__name__} ({cog.qualified_name})",
+                    loop.coro(cog),
+                )
+        elif event["event"] == "member_remove":
+            member = self.bot.get_guild(event["guild"]).get_member(event["member"])
+            await self.dispatch("on_member_remove", member)
+        else:
+            raise ValueError(f"Unknown event {event['event']!r}")
+
+    def print_report(self):
+        print("Handler latency (ms):")
+        print(
+            f"  {'handler':<56} {'count':>6} {'mean':>8} {'p50':>8}"
+            f" {'p95':>8} {'max':>8} {'errors':>6}"
+        )
+        for name, latencies in sorted(self.latencies.items()):
+            latencies = sorted(latency * 1000 for latency in latencies)
+            print(
+                f"  {name:<56} {len(latencies):>6}"
+                f" {statistics.fmean(latencies):>8.2f}"
+                f" {latencies[len(latencies) // 2]:>8.2f}"
+                f" {latencies[int(len(latencies) * 0.95)]:>8.2f}"
+                f" {latencies[-1]:>8.2f} {self.errors[name]:>6}"
+            )
+        print("REST calls:")
+        for route, count in self.fake_discord.http.calls.most_common():
+            print(f"  {route:<64} {count:>6}")
+        print("Config writes:")
+        for cog_name, count in MemoryDriver.writes.most_common():
+            print(f"  {cog_name:<64} {count:>6}")
+
+
+def synthetic_trace(
+    seed: int,
+    messages: int,
+    guilds: int = 2,
+    channels_per_guild: int = 3,
+    members_per_guild: int = 20,
+) -> list[dict]:
+    """
+    Generate a repeatable trace that sets up every cog in a few guilds and then
+    sends messages, with occasional commands and a tick every 30 seconds of fake
+    time.
+    """
+    rng = random.Random(seed)
+    now = SYNTHETIC_START_TIME
+    events = []
+    guild_layouts = []
+
+    def command(guild_layout, name, *args, author=None, **kwargs):
+        channel_ids, member_ids = guild_layout
+        events.append(
+            {
+                "event": "command",
+                "channel": channel_ids[0],
+                "author": author if author is not None else member_ids[0],
+                "command": name,
+                "args": [*args],
+                "kwargs": kwargs,
+            }
+        )
+
+    def sentence():
+        words = rng.choices(SYNTHETIC_WORDS, k=rng.randint(3, 15))
+        if rng.random() < 0.02:
+            title = rng.choice([*WIKIPEDIA_TITLES, "No such article"])
+            words.insert(rng.randrange(len(words) + 1), f"[[{title}]]")
+        return " ".join(words)
+
+    for guild_index in range(guilds):
+        guild_id = 10_000 + guild_index
+        channel_ids = [
+            guild_id * 100 + channel_index
+            for channel_index in range(channels_per_guild)
+        ]
+        member_ids = [
+            2_000_000 + guild_index * 1000 + member_index
+            for member_index in range(members_per_guild)
+        ]
+        guild_layouts.append((channel_ids, member_ids))
+        events.append(
+            {
+                "event": "guild",
+                "id": guild_id,
+                "channels": channel_ids,
+                "members": member_ids,
+            }
+        )
+
+    # Post QOTDs shortly after the trace starts
+    post_at = time.gmtime(now + 120)
+    for guild_layout in guild_layouts:
+        channel_ids, member_ids = guild_layout
+        command(guild_layout, "markov toggle_guild")
+        command(guild_layout, "markov enable_all_channels")
+        command(guild_layout, "qotd post_here")
+        command(guild_layout, "qotd post_at", post_at.tm_hour, post_at.tm_min)
+        command(guild_layout, "qotd toggle")
+        for _ in range(20):
+            command(guild_layout, "qotd add", question=sentence() + "?")
+        for member_id in member_ids[1:6]:
+            command(
+                guild_layout,
+                "qotd suggest",
+                question=sentence() + "?",
+                author=member_id,
+            )
+        command(guild_layout, "pindelegate", {"member": member_ids[1]})
+
+    for message_index in range(messages):
+        guild_layout = rng.choice(guild_layouts)
+        channel_ids, member_ids = guild_layout
+        events.append(
+            {
+                "event": "message",
+                "channel": rng.choice(channel_ids),
+                "author": rng.choice(member_ids),
+                "content": sentence(),
+            }
+        )
+        if message_index % 25 == 24:
+            now += 30
+            events.append({"event": "tick", "time": now})
+        if message_index % 200 == 199:
+            command(guild_layout, "markov generate", None)
+            command(guild_layout, "markov generate", {"member": rng.choice(member_ids)})
+            command(
+                guild_layout,
+                "pin",
+                {"recent_message": channel_ids[0]},
+                author=member_ids[1],
+            )
+            command(
+                guild_layout,
+                "teleport",
+                [{"channel": channel_ids[1]}, {"channel": channel_ids[2]}],
+                topic=sentence(),
+            )
+    # Menus stay open until they time out, so there's only one of each
+    command(guild_layouts[0], "markov top")
+    command(guild_layouts[0], "markov query_plans")
+    return events
+
+
+async def main(args):
+    if args.trace is not None:
+        with open(args.trace, encoding="utf-8") as trace_file:
+            events = [json.loads(line) for line in trace_file if line.strip()]
+    else:
+        events = synthetic_trace(args.seed, args.messages)
+    if args.save_trace is not None:
+        with open(args.save_trace, "w", encoding="utf-8") as trace_file:
+            for event in events:
+                trace_file.write(json.dumps(event) + "\n")
+
+    sys.path.insert(0, str(REPO_PATH))
+    data_directory = tempfile.TemporaryDirectory()
+    install_memory_config(pathlib.Path(data_directory.name))
+    start_time = next(
+        (event["time"] for event in events if event["event"] == "tick"),
+        SYNTHETIC_START_TIME,
+    )
+    fake_discord = FakeDiscord(start_time, args.rest_latency_ms / 1000)
+    wikipedia = WikipediaStandIn(WIKIPEDIA_TITLES)
+    await wikipedia.start()
+    replay = Replay(fake_discord)
+    try:
+        with unittest.mock.patch("time.time", lambda: fake_discord.now):
+            if "wplink" in args.cogs:
+                importlib.import_module("wplink.wplink").WIKIPEDIA_URL = wikipedia.url
+            for cog in args.cogs:
+                await replay.load_cog(cog)
+            for event in events:
+                await replay.replay_event(event)
+            await replay.unload_cogs()
+    finally:
+        await wikipedia.stop()
+        data_directory.cleanup()
+    replay.print_report()
+    print(f"Wikipedia stand-in requests: {wikipedia.requests}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Replay Discord events through the cogs offline."
+    )
+    parser.add_argument("trace", nargs="?", help="a JSON lines trace to replay")
+    parser.add_argument("--cogs", nargs="+", choices=ALL_COGS, default=ALL_COGS)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--messages",
+        type=int,
+        default=2000,
+        help="how many messages to put in a synthetic trace",
+    )
+    parser.add_argument("--save-trace", help="write the trace being replayed here")
+    parser.add_argument(
+        "--rest-latency-ms",
+        type=float,
+        default=0,
+        help="simulated latency of each REST call",
+    )
+    asyncio.run(main(parser.parse_args()))
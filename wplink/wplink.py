@@ -6,6 +6,8 @@ import logging
 import re
 import urllib.parse
 
+WIKIPEDIA_URL = "https://en.wikipedia.org"
+
 
 class WPLink(commands.Cog):
     def __init__(self, bot):
@@ -40,14 +42,14 @@ class WPLink(commands.Cog):
     async def look_up_page(self, title: str) -> str | None:
         self.logger.info("Looking up page title %s", title)
         MAX_URL_SIZE = 400
-        query_url = f"https://en.wikipedia.org/wiki/Special:Search?search={urllib.parse.quote(title)}&go=Go"
+        query_url = f"{WIKIPEDIA_URL}/wiki/Special:Search?search={urllib.parse.quote(title)}&go=Go"
         async with aiohttp.ClientSession() as session:
             async with session.head(query_url, allow_redirects=True) as response:
                 if response.status != 200:
                     return None
                 result_url = str(response.url)
                 if len(result_url) > MAX_URL_SIZE or result_url.startswith(
-                    "https://en.wikipedia.org/wiki/Special:Search?"
+                    f"{WIKIPEDIA_URL}/wiki/Special:Search?"
                 ):
                     return None
                 return result_url